@@ -0,0 +1,70 @@
+"""Timing of the error vector used when the spectral response is not uniform
+
+Compares nonuniform_error_vector with the previous implementation, which computed the products twice and the squared
+weights and the edges of the response function at each call, on random traces. Usage::
+
+    python benchmarks/bench_error_vector.py --shape 1024 1024 --repeats 50
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from pypret import lib
+
+from pymodaq_femto.pipeline import nonuniform_error_vector
+
+
+def previous_error_vector(self, Tmn, store=True):
+    rs = self._retrieval_state
+    Tmn_meas = self.Tmn_meas
+    w2 = self._weights * self._weights
+    mean_mu = np.sum(Tmn_meas * Tmn * w2) / np.sum(Tmn * Tmn * w2)
+    mu = np.full(self.N, mean_mu)
+    mask = (w2.sum(axis=0) > 0.0) & (Tmn_meas.sum(axis=0) > 0.0)
+    mu[mask] = np.sum(Tmn_meas * Tmn * w2, axis=0)[mask] / np.sum(Tmn * Tmn * w2, axis=0)[mask]
+    idx1 = lib.find(mask, lambda x: x)
+    mu[:idx1] = mu[idx1]
+    idx2 = lib.find(mask, lambda x: x, n=-1)
+    mu[idx2:] = mu[idx2]
+    if store:
+        rs.mu = mu
+        rs.Tmn = Tmn
+        rs.Smk = self.pnps.Smk
+    return np.ravel((Tmn_meas - mu * Tmn) * self._weights)
+
+
+def fake_retriever(M, N):
+    """ The attributes of a retriever used by the error vector, with a measurement vanishing on the edges"""
+    rng = np.random.default_rng(0)
+    Tmn_meas = rng.random((M, N))
+    Tmn_meas[:, :N // 20] = 0.0
+    Tmn_meas[:, -N // 20:] = 0.0
+    return SimpleNamespace(_retrieval_state=SimpleNamespace(), Tmn_meas=Tmn_meas, _weights=np.ones((M, N)), N=N,
+                           pnps=SimpleNamespace(Smk=None))
+
+
+def timeit(func, retriever, Tmn, repeats):
+    func(retriever, Tmn)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        r = func(retriever, Tmn)
+    return (time.perf_counter() - start) / repeats, r
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shape", type=int, nargs=2, default=[1024, 1024], metavar=("M", "N"))
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    retriever = fake_retriever(*args.shape)
+    Tmn = np.random.default_rng(1).random(tuple(args.shape))
+    previous, r_previous = timeit(previous_error_vector, retriever, Tmn, args.repeats)
+    current, r_current = timeit(nonuniform_error_vector, retriever, Tmn, args.repeats)
+    print(f"shape={tuple(args.shape)}  previous={previous * 1e3:8.2f} ms  current={current * 1e3:8.2f} ms  "
+          f"speed-up={previous / current:5.2f}  max difference={np.max(np.abs(r_current - r_previous)):.1e}")
+
+
+if __name__ == "__main__":
+    main()
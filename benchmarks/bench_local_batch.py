@@ -0,0 +1,65 @@
+"""Timing of the COPRA local iteration with a fixed spectrum, sequential vs mini-batch
+
+Simulates a d-scan trace, then retrieves it with `retrieve_step_fix_spectrum` for several values of the local batch
+size. Usage::
+
+    python benchmarks/bench_local_batch.py --npoints 1024 --rows 512 --batch-sizes 1 8 32 128
+"""
+import argparse
+import time
+
+import numpy as np
+from pypret import FourierTransform, Pulse, PNPS, random_gaussian, Retriever
+from pypret.frequencies import wl2om
+
+from pymodaq_femto.materials import FS
+from pymodaq_femto.pipeline import retrieve_step_fix_spectrum
+
+
+def simulated_dscan(npoints, rows, wl0=800e-9, fwhm=8e-15):
+    ft = FourierTransform(npoints, dt=0.5e-15, w0=wl2om(-wl0 - 300e-9))
+    pulse = Pulse(ft, wl0)
+    random_gaussian(pulse, fwhm, phase_max=1.0)
+    pnps = PNPS(pulse, "dscan", "shg", material=FS)
+    parameter = np.linspace(-2e-3, 2e-3, rows)
+    pnps.calculate(pulse.spectrum, parameter)
+    return pulse, pnps, pnps.trace
+
+
+def run(pulse, pnps, trace, batch_size, maxiter, seed):
+    np.random.seed(seed)
+    retriever = Retriever(pnps, "copra", maxiter=maxiter, verbose=False)
+    retriever._retrieve_step = retrieve_step_fix_spectrum.__get__(retriever)
+    retriever.options.local_batch_size = batch_size
+    guess = pulse.copy()
+    random_gaussian(guess, 10e-15, phase_max=0.1)
+    guess.spectrum = np.abs(pulse.spectrum) * np.exp(1j * np.angle(guess.spectrum))
+    start = time.perf_counter()
+    retriever.retrieve(trace, guess.spectrum)
+    elapsed = time.perf_counter() - start
+    return elapsed, retriever.result().trace_error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--npoints", type=int, default=1024)
+    parser.add_argument("--rows", type=int, default=512)
+    parser.add_argument("--maxiter", type=int, default=20)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    pulse, pnps, trace = simulated_dscan(args.npoints, args.rows)
+    reference = None
+    for batch_size in args.batch_sizes:
+        results = [run(pulse, pnps, trace, batch_size, args.maxiter, seed) for seed in range(args.repeats)]
+        elapsed = np.mean([r[0] for r in results])
+        errors = [r[1] for r in results]
+        if reference is None:
+            reference = elapsed
+        print(f"batch={batch_size:5d}  time={elapsed:8.3f} s  speed-up={reference / elapsed:6.2f}  "
+              f"error={np.mean(errors):.3e} +/- {np.std(errors):.1e}")
+
+
+if __name__ == "__main__":
+    main()
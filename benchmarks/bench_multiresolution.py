@@ -0,0 +1,72 @@
+"""Timing of the multiresolution retrieval against the full grid retrieval
+
+Simulates a d-scan trace on the grid of a RetrievalPipeline and retrieves it from the same initial guess on the full
+grid only, then with the coarse-to-fine schedule. Prints the retrieval time, the number of iterations per level and
+the final trace error. Usage::
+
+    python benchmarks/bench_multiresolution.py --npoints 4096 --rows 800 --maxiter 100 --schedule "8, 4, 2"
+"""
+import argparse
+import time
+
+import numpy as np
+from pypret import Pulse, PNPS, random_gaussian
+
+from pymodaq_femto.materials import FS
+from pymodaq_femto.pipeline import RetrievalPipeline
+
+
+def make_pipeline(npoints, maxiter, schedule, coarse_maxiter):
+    pipeline = RetrievalPipeline()
+    config = pipeline.config
+    config.algo.method = "dscan"
+    config.algo.nlprocess = "shg"
+    config.grid.npoints = npoints
+    config.grid.time_resolution = 0.5
+    config.grid.wl0 = 800.
+    config.retrieving.max_iter = maxiter
+    config.retrieving.fwhm = 10.
+    config.retrieving.verbose = False
+    config.multiresolution.schedule = schedule
+    config.multiresolution.max_iter = coarse_maxiter
+    pipeline.generate_ft_grid()
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--npoints", type=int, default=4096)
+    parser.add_argument("--rows", type=int, default=800)
+    parser.add_argument("--maxiter", type=int, default=100)
+    parser.add_argument("--coarse-maxiter", type=int, default=0, help="0 for --maxiter")
+    parser.add_argument("--schedule", default="8, 4, 2")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    pipeline = make_pipeline(args.npoints, args.maxiter, args.schedule, args.coarse_maxiter)
+    pulse = Pulse(pipeline.ft, 800e-9)
+    random_gaussian(pulse, 8e-15, phase_max=1.0)
+    pnps = PNPS(pulse, "dscan", "shg", material=FS)
+    pnps.calculate(pulse.spectrum, np.linspace(-2e-3, 2e-3, args.rows))
+    trace = pnps.trace.copy()
+
+    for enabled in (False, True):
+        pipeline.config.multiresolution.enabled = enabled
+        pipeline.pulse_in = pulse
+        pipeline.pnps = pnps
+        pipeline.trace_in = trace.copy()
+        np.random.seed(args.seed)
+        start = time.perf_counter()
+        result = pipeline.retrieve()
+        elapsed = time.perf_counter() - start
+        name = "multires" if enabled else "full"
+        print(f"{name:8s}  time={elapsed:8.3f} s  iterations={result.iterations:4d}  "
+              f"trace error={result.trace_error:.4e}")
+        if enabled:
+            levels = result.multiresolution
+            for factor, iterations, error in zip(levels.factors, levels.iterations, levels.trace_errors):
+                print(f"    level 1/{factor:<3d} iterations={iterations:4d}  trace error={error:.4e}")
+
+
+if __name__ == "__main__":
+    main()
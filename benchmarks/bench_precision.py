@@ -0,0 +1,116 @@
+"""Accuracy and timing of single vs double precision retrievals
+
+Simulates a d-scan trace and retrieves it with the RetrievalPipeline in double and in single precision from the same
+initial guess. Prints the retrieval time, the final trace error and the relative difference between the spectra
+retrieved in single and double precision (after removal of the absolute phase). With --components, only the stages
+stored in the configured precision are measured: the build of the d-scan mask table (time and memory) and the error
+vector used when the spectral response is not uniform (time and relative difference). Usage::
+
+    python benchmarks/bench_precision.py --npoints 2048 --rows 800 --maxiter 100
+    python benchmarks/bench_precision.py --npoints 8192 --rows 800 --components
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from pypret import FourierTransform, Pulse, PNPS, random_gaussian, lib
+from pypret.frequencies import wl2om
+
+from pymodaq_femto.materials import FS
+from pymodaq_femto.pipeline import RetrievalPipeline, nonuniform_error_vector, precisions
+
+
+def simulated_dscan(npoints, rows, wl0=800e-9, fwhm=8e-15):
+    ft = FourierTransform(npoints, dt=0.5e-15, w0=wl2om(-wl0 - 300e-9))
+    pulse = Pulse(ft, wl0)
+    random_gaussian(pulse, fwhm, phase_max=1.0)
+    pnps = PNPS(pulse, "dscan", "shg", material=FS)
+    pnps.calculate(pulse.spectrum, np.linspace(-2e-3, 2e-3, rows))
+    return pulse, pnps
+
+
+def retrieve(pulse, pnps, precision, maxiter, seed):
+    pipeline = RetrievalPipeline()
+    pipeline.config.algo.method = "dscan"
+    pipeline.config.retrieving.precision = precision
+    pipeline.config.retrieving.max_iter = maxiter
+    pipeline.config.retrieving.fwhm = 10.
+    pipeline.config.retrieving.verbose = False
+    pipeline.pulse_in = pulse
+    pipeline.pnps = pnps
+    pipeline.trace_in = pnps.trace.copy()
+    np.random.seed(seed)
+    start = time.perf_counter()
+    result = pipeline.retrieve()
+    return time.perf_counter() - start, result
+
+
+def best_time(func, repeats):
+    func()
+    elapsed = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+def components(pnps, repeats):
+    insertions = np.linspace(-2e-3, 2e-3, pnps.trace.data.shape[0])
+    tables = dict()
+    for precision, (real_type, complex_type) in precisions.items():
+        def build():
+            pnps._mask_table = None
+            pnps.prepare_masks(insertions, dtype=complex_type)
+        elapsed = best_time(build, repeats)
+        tables[precision] = pnps._mask_table
+        print(f"{precision:6s}  mask table={pnps._mask_table.nbytes / 2 ** 20:6.1f} MB  build={elapsed * 1e3:8.1f} ms")
+    print(f"maximum difference of the masks: {np.max(np.abs(tables['single'] - tables['double'])):.1e}")
+
+    rng = np.random.default_rng(0)
+    M, N = pnps.trace.data.shape
+    Tmn_meas = rng.random((M, N))
+    Tmn_meas[:, :N // 20] = 0.0
+    Tmn_meas[:, -N // 20:] = 0.0
+    Tmn = rng.random((M, N))
+    vectors = dict()
+    for precision, (real_type, complex_type) in precisions.items():
+        retriever = SimpleNamespace(_retrieval_state=SimpleNamespace(), Tmn_meas=Tmn_meas.astype(real_type),
+                                    _weights=np.ones((M, N), dtype=real_type), N=N, pnps=SimpleNamespace(Smk=None))
+        Tmn_typed = Tmn.astype(real_type)
+        elapsed = best_time(lambda: nonuniform_error_vector(retriever, Tmn_typed), repeats)
+        vectors[precision] = nonuniform_error_vector(retriever, Tmn_typed).astype(np.float64)
+        print(f"{precision:6s}  error vector={elapsed * 1e3:8.2f} ms")
+    print(f"relative difference of the error vectors: "
+          f"{lib.norm(vectors['single'] - vectors['double']) / lib.norm(vectors['double']):.1e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--npoints", type=int, default=2048)
+    parser.add_argument("--rows", type=int, default=800)
+    parser.add_argument("--maxiter", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--components", action="store_true", help="only measure the mask table and error vector")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    pulse, pnps = simulated_dscan(args.npoints, args.rows)
+    if args.components:
+        components(pnps, args.repeats)
+        return
+    results = dict()
+    for precision in ("double", "single"):
+        elapsed, result = retrieve(pulse, pnps, precision, args.maxiter, args.seed)
+        results[precision] = result
+        print(f"{precision:6s}  time={elapsed:8.3f} s  trace error={result.trace_error:.4e}")
+
+    single = results["single"].pulse_retrieved
+    double = results["double"].pulse_retrieved
+    single = single * np.exp(-1j * np.angle(np.vdot(double, single)))
+    print(f"relative difference of the retrieved spectra: {lib.norm(single - double) / lib.norm(double):.2e}")
+
+
+if __name__ == "__main__":
+    main()
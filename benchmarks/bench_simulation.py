@@ -0,0 +1,42 @@
+"""Timing of the Standard and Batched simulation engines
+
+Simulates a d-scan with both engines of simulation_core and prints the time of the simulation of the trace on a linear
+wavelength grid and the maximum difference between the two traces. Usage::
+
+    python benchmarks/bench_simulation.py --npoints 8192 --rows 2000 --wl-points 1024
+"""
+import argparse
+import time
+
+import numpy as np
+
+from pymodaq_femto.simulation_core import SimulationConfig, simulate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--npoints", type=int, default=8192)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--wl-points", type=int, default=1024)
+    parser.add_argument("--batch-memory", type=int, default=256, help="in MB")
+    args = parser.parse_args()
+
+    config = SimulationConfig()
+    config.algo.method = "dscan"
+    config.grid.npoints = args.npoints
+    config.grid.batch_memory = args.batch_memory
+    config.output.Npts = args.wl_points
+    scan = config.algo.dscan_parameter
+    scan.step = (scan.max - scan.min) / args.rows
+
+    traces = dict()
+    for engine in ("Standard", "Batched"):
+        config.grid.engine = engine
+        start = time.perf_counter()
+        traces[engine] = simulate(config)[0].data
+        print(f"{engine:8s}  time={time.perf_counter() - start:8.3f} s")
+    print(f"max difference of the normalized traces: {np.max(np.abs(traces['Standard'] - traces['Batched'])):.2e}")
+
+
+if __name__ == "__main__":
+    main()
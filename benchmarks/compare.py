@@ -0,0 +1,57 @@
+"""Compare two result files of run_benchmarks.py
+
+Stages are matched on method, process, grid size, stage and algorithm. Those whose wall time or peak memory grew by
+more than the tolerance, or whose trace error grew by more than the error tolerance, are reported as regressions and
+the exit code is 1. Usage::
+
+    python benchmarks/compare.py baseline.json results.json --tolerance 0.2
+"""
+import argparse
+import json
+import sys
+
+
+def load(fname):
+    with open(fname) as f:
+        records = json.load(f)["results"]
+    return {(r.get("method"), r.get("process"), r.get("npoints"), r["stage"], r.get("algo")): r
+            for r in records if r["status"] == "ok"}
+
+
+def compare(baseline, results, tolerance=0.2, error_tolerance=0.1, min_time=1e-3):
+    """ List of (key, quantity, baseline value, new value) of the regressions"""
+    regressions = []
+    for key, new in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        if new["wall_time"] > max(old["wall_time"], min_time) * (1 + tolerance):
+            regressions.append((key, "wall_time", old["wall_time"], new["wall_time"]))
+        if new["peak_memory"] > old["peak_memory"] * (1 + tolerance):
+            regressions.append((key, "peak_memory", old["peak_memory"], new["peak_memory"]))
+        if "trace_error" in new and new["trace_error"] > old["trace_error"] * (1 + error_tolerance):
+            regressions.append((key, "trace_error", old["trace_error"], new["trace_error"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("results")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative increase of time or memory")
+    parser.add_argument("--error-tolerance", type=float, default=0.1, help="relative increase of the trace error")
+    parser.add_argument("--min-time", type=float, default=1e-3, help="times below are not compared (s)")
+    args = parser.parse_args()
+
+    regressions = compare(load(args.baseline), load(args.results), args.tolerance, args.error_tolerance,
+                          args.min_time)
+    for key, quantity, old, new in regressions:
+        name = "/".join(str(k) for k in key if k is not None)
+        print(f"{name:50s} {quantity:12s} {old:12.4g} -> {new:12.4g}")
+    if not regressions:
+        print("no regression")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Benchmark of the retrieval stages over simulated pulses
+
+Traces are simulated with simulation_core (no Qt needed) for each combination of method, non-linear process
+and grid size, then each stage of the retrieval is timed: pulse_from_spectrum, PNPS construction, preprocess,
+preprocess2, the retrieval with each algorithm and the propagation. Wall time, peak memory allocated during the stage
+(as traced by tracemalloc) and the final trace error of the retrievals are written in a JSON file. Combinations not
+supported by pypret or by an algorithm are recorded with a failed status. Usage::
+
+    python benchmarks/run_benchmarks.py --methods frog dscan miips --processes shg thg pg --npoints 256 1024 8192
+        --algos copra pcgpa --maxiter 30 -o results.json
+
+Compare two runs with benchmarks/compare.py.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+from pypret import PNPS
+from pypret.retrieval.retriever import _RETRIEVER_CLASSES
+
+from pymodaq_femto import _PNPS_CLASSES
+from pymodaq_femto.pipeline import (RetrievalPipeline, PipelineConfig, pulse_from_spectrum, preprocess, preprocess2,
+                                    materials, spectrum_center)
+from pymodaq_femto.simulation_core import SimulationConfig, simulate as simulate_trace
+
+
+class Recorder:
+    """ Collects one record per measured stage"""
+
+    def __init__(self):
+        self.records = []
+
+    @contextmanager
+    def measure(self, stage, **info):
+        """ Time the enclosed block and trace its peak memory, exceptions are recorded and not propagated
+
+        The yielded dict can be filled with extra values such as the final error.
+        """
+        record = dict(info, stage=stage)
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield record
+            record["status"] = "ok"
+        except Exception as e:
+            record.update(status="failed", message=f"{type(e).__name__}: {e}")
+        finally:
+            record["wall_time"] = time.perf_counter() - start
+            record["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.records.append(record)
+            print(f"{stage:20s} {record.get('algo', ''):10s} {record['status']:6s} {record['wall_time']:9.4f} s  "
+                  f"{record['peak_memory'] / 2 ** 20:9.1f} MB")
+
+
+def simulate(method, process, npoints, rows):
+    """ Simulated trace and spectrum in the format of the Retriever data, with about rows parameter values"""
+    config = SimulationConfig()
+    config.algo.method = method
+    config.algo.nlprocess = process
+    config.grid.npoints = npoints
+    config.output.Npts = min(npoints, 1024)
+    for scan in (config.algo.dscan_parameter, config.algo.miips_parameter):
+        scan.step = (scan.max - scan.min) / rows
+    trace, spectrum, pulse = simulate_trace(config)
+
+    # frog traces are simulated on all the delays of the grid
+    decimation = max(1, len(trace.axes[0]) // rows)
+    raw_trace = dict(data=trace.data[::decimation], x_axis=dict(data=trace.axes[1], units="m"),
+                     y_axis=dict(data=trace.axes[0][::decimation], units=trace.units[0]))
+    raw_spectrum = dict(data=spectrum.data, x_axis=dict(data=spectrum.axes[0], units="m"))
+    return raw_trace, raw_spectrum, config
+
+
+def run_case(recorder, method, process, npoints, args):
+    info = dict(method=method, process=process, npoints=npoints)
+    with recorder.measure("simulation", **info):
+        raw_trace, raw_spectrum, simulation = simulate(method, process, npoints, args.rows)
+    if recorder.records[-1]["status"] != "ok":
+        return
+
+    config = PipelineConfig()
+    config.algo.method = method
+    config.algo.nlprocess = process
+    config.grid.npoints = npoints
+    config.grid.time_resolution = simulation.grid.time_resolution
+    config.grid.wl0 = spectrum_center(raw_spectrum["x_axis"]["data"], raw_spectrum["data"]) * 1e9
+    config.retrieving.verbose = False
+    config.retrieving.max_iter = args.maxiter
+    pipeline = RetrievalPipeline(config)
+    pipeline.set_data(raw_trace, raw_spectrum)
+    pipeline.process_spectrum()
+
+    wavelength = raw_spectrum["x_axis"]["data"]
+    with recorder.measure("pulse_from_spectrum", **info):
+        pulse_from_spectrum(wavelength, raw_spectrum["data"], pulse=pipeline.pulse_in.copy())
+
+    if method == "dscan":
+        kwargs = dict(material=materials[config.algo.material])
+    elif method == "miips":
+        kwargs = dict(alpha=config.algo.alpha, gamma=config.algo.gamma)
+    else:
+        kwargs = dict()
+    with recorder.measure("pnps", **info):
+        PNPS(pipeline.pulse_in, method, process, **kwargs)
+
+    trace_wl = raw_trace["x_axis"]["data"]
+    with recorder.measure("preprocess", **info):
+        trace = preprocess(pipeline.get_trace_in(), dark_signal_range=(trace_wl[0], trace_wl[len(trace_wl) // 10]))
+    with recorder.measure("preprocess2", **info):
+        preprocess2(trace, pipeline.pnps)
+
+    retrieved = False
+    for algo in args.algos:
+        config.retrieving.algo_type = algo
+        pipeline.process_trace()
+        np.random.seed(args.seed)
+        with recorder.measure("retrieve", algo=algo, **info) as record:
+            record["trace_error"] = float(pipeline.retrieve().trace_error)
+            retrieved = True
+    if retrieved:
+        with recorder.measure("propagate", **info):
+            pipeline.propagate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--methods", nargs="+", default=["frog", "dscan", "miips"])
+    parser.add_argument("--processes", nargs="+", default=["shg", "thg", "pg"])
+    parser.add_argument("--npoints", type=int, nargs="+", default=[256, 1024, 8192])
+    parser.add_argument("--rows", type=int, default=128, help="approximate number of parameter values of the traces")
+    parser.add_argument("--algos", nargs="+", default=["copra", "pcgpa", "gpa", "pie", "gp-dscan"])
+    parser.add_argument("--maxiter", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="benchmark_results.json")
+    args = parser.parse_args()
+    args.algos = [algo for algo in args.algos if algo in _RETRIEVER_CLASSES]
+
+    recorder = Recorder()
+    for method in args.methods:
+        for process in args.processes:
+            if process not in _PNPS_CLASSES.get(method, {}):
+                print(f"skipping {method}/{process}: not available")
+                continue
+            for npoints in args.npoints:
+                print(f"--- {method} {process} {npoints} points")
+                run_case(recorder, method, process, npoints, args)
+
+    output = dict(
+        meta=dict(date=datetime.now().isoformat(timespec="seconds"), python=sys.version.split()[0],
+                  numpy=np.__version__, platform=platform.platform(), processor=platform.processor(),
+                  args=vars(args)),
+        results=recorder.records,
+    )
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"results written in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Headless batch retrieval of a folder of H5 traces
+
+Each file goes through the same steps as in the Retriever user interface (process spectrum, process trace, retrieve,
+propagate) using a RetrievalPipeline configured from settings saved from the Retriever, and files are dispatched over
+a pool of processes. No QApplication is created and pymodaq is only used to write the result files (see
+h5io.save_retrieval).
+
+Files holding several scans of the same trace (Scan000, Scan001...) can be combined (mean or median) before the
+retrieval, or each scan can be retrieved separately (stack), see pymodaq_femto.multiscan.
+"""
+import csv
+import logging
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+from pathlib import Path
+
+import numpy as np
+
+from pymodaq_femto.h5io import load_h5_trace, load_h5_attribute, save_retrieval
+from pymodaq_femto.multiscan import ScanStack, load_combined, scan_name
+from pymodaq_femto.pipeline import RetrievalPipeline, PipelineConfig, spectrum_center
+
+logger = logging.getLogger(__name__)
+
+summary_fields = ["file", "trace_node", "status", "trace_error", "stop_reason", "iterations", "cached", "fwhm", "gdd",
+                  "tod", "fod", "result_file", "message"]
+
+
+def load_settings(settings_path):
+    """ Read settings from a xml file or from a h5 file saved by the Retriever
+
+    The xml content can be the retriever settings tree alone or the "All_settings" node written by
+    Retriever.save_data, which also contains the propagation settings.
+
+    Returns
+    -------
+    config: (PipelineConfig)
+    root: (Element) the xml root element of the settings
+    """
+    settings_path = Path(settings_path)
+    if settings_path.suffix == ".h5":
+        xml_string = load_h5_attribute(settings_path, "/PyMoDAQFemtoAnalysis", "settings")
+    else:
+        xml_string = settings_path.read_bytes()
+    return PipelineConfig.from_xml(xml_string), ET.fromstring(xml_string)
+
+
+def load_data_in(config, fname, trace_node, spectrum_fname, spectrum_node, scans=None):
+    """ Load the raw trace and spectrum as done by Retriever.load_trace_in and Retriever.load_spectrum_in
+
+    The trace is a LazyH5Array, only the block of the ROI is read when processing it, unless the scans of the file
+    are combined (scans is "mean" or "median"), the variance of the mean being then returned with the trace.
+    """
+    variance = None
+    if scans is None:
+        data, axes = load_h5_trace(fname, trace_node, lazy=True)
+    else:
+        data, axes, variance = load_combined(fname, trace_node, mode=scans)
+    wl, parameter_axis = axes["x_axis"], axes["nav_00"]
+    wl["data"] = wl["data"] * config.data_in.wl_scaling
+    wl["units"] = "m"
+    parameter_axis["data"] = parameter_axis["data"] * config.data_in.param_scaling
+    parameter_axis["units"] = "p.u."
+
+    lazy_spectrum, spectrum_axes = load_h5_trace(spectrum_fname, spectrum_node, lazy=True)
+    with lazy_spectrum:
+        spectrum = np.asarray(lazy_spectrum, dtype="double")
+    raw_trace = dict(data=data, x_axis=wl, y_axis=parameter_axis)
+    if variance is not None:
+        raw_trace["variance"] = variance
+    return raw_trace, dict(data=spectrum, x_axis=spectrum_axes["x_axis"])
+
+
+def settings_xml(root):
+    """ xml strings of the settings in the format written by Retriever.save_data
+
+    Returns
+    -------
+    settings_str: (bytes) retriever settings
+    prop_settings_str: (bytes or None) propagation settings if present in the settings file
+    all_settings_str: (bytes) all settings
+    """
+    settings_elt = root if root.tag == "dataIN_settings" else root.find("dataIN_settings")
+    if settings_elt is None:
+        settings_elt = root
+    settings_str = b"<DataIn_settings>" + ET.tostring(settings_elt) + b"</DataIn_settings>"
+    prop_elt = root.find("propagation_settings")
+    prop_settings_str = None
+    if prop_elt is not None:
+        prop_settings_str = (b'<prop_settings title="Prop. Settings" type="group">' + ET.tostring(prop_elt) +
+                             b"</prop_settings>")
+    if root.tag == "All_settings":
+        all_settings_str = ET.tostring(root)
+    else:
+        all_settings_str = (b'<All_settings title="All Settings" type="group">' + ET.tostring(settings_elt) +
+                            b"</All_settings>")
+    return settings_str, prop_settings_str, all_settings_str
+
+
+def retrieve_file(fname, settings_path, output_dir, trace_node=None, spectrum_fname=None, spectrum_node=None,
+                  scans=None, suffix=""):
+    """ Run the whole pipeline on one file and save the results in output_dir
+
+    This is the function executed by the pool workers, it never raises but reports errors in the returned summary.
+    As when loading data in the Retriever, the central wavelength of the grid is taken from the spectrum.
+
+    Parameters
+    ----------
+    scans: (str) None to retrieve the trace node only, "mean" or "median" to combine all the scans of the file
+    suffix: (str) appended to the name of the result file, e.g. the scan name when retrieving scans separately
+
+    Returns
+    -------
+    dict: summary of the retrieval with the keys of summary_fields
+    """
+    summary = dict(file=str(fname), trace_node=trace_node, status="failed")
+    raw_trace = None
+    try:
+        config, root = load_settings(settings_path)
+        if trace_node is None:
+            trace_node = root.findtext(".//data_in_info/loaded_node")
+            summary["trace_node"] = trace_node
+        if spectrum_fname is None:
+            spectrum_fname = fname
+        raw_trace, raw_spectrum = load_data_in(config, fname, trace_node, spectrum_fname, spectrum_node, scans)
+        config.grid.wl0 = spectrum_center(raw_spectrum["x_axis"]["data"], raw_spectrum["data"]) * 1e9
+
+        settings_str, prop_settings_str, all_settings_str = settings_xml(root)
+        pipeline = RetrievalPipeline(config)
+        pipeline.set_data(raw_trace, raw_spectrum)
+        pipeline.process_spectrum()
+        pipeline.process_trace()
+        result = pipeline.retrieve()
+        propagated_pulse = pipeline.propagate()
+
+        result_file = Path(output_dir).joinpath(f"{Path(fname).stem}{suffix}_retrieved.h5")
+        save_retrieval(str(result_file), raw_trace, raw_spectrum, settings_str, all_settings_str, result=result,
+                       propagated_pulse=propagated_pulse, prop_settings_xml=prop_settings_str)
+
+        summary.update(asdict(pipeline.pulse_properties))
+        summary.update(status="ok", trace_error=result.trace_error, stop_reason=result.stop_reason,
+                       iterations=result.iterations, cached=result.cached, result_file=str(result_file))
+    except Exception as e:
+        logger.exception(str(e))
+        summary["message"] = str(e)
+    finally:
+        if raw_trace is not None and hasattr(raw_trace["data"], "close"):
+            raw_trace["data"].close()
+    return summary
+
+
+def scan_tasks(fname, settings_path, trace_node):
+    """ (trace node, result file suffix) of each scan of a file, to retrieve them separately"""
+    if trace_node is None:
+        trace_node = load_settings(settings_path)[1].findtext(".//data_in_info/loaded_node")
+    with ScanStack(fname, trace_node) as stack:
+        return [(path, f"_{scan_name(path, ind)}") for ind, path in enumerate(stack.paths)]
+
+
+def run_batch(folder, settings_path, output_dir=None, workers=None, pattern="*.h5", trace_node=None,
+              spectrum_fname=None, spectrum_node=None, scans=None):
+    """ Retrieve all the h5 files of a folder over a pool of processes and write a summary.csv file
+
+    Parameters
+    ----------
+    folder: (str or Path) folder containing the trace files
+    settings_path: (str or Path) xml or h5 file with the retriever settings
+    output_dir: (str or Path) folder where results are written, defaults to folder/retrieved
+    workers: (int) number of processes, None for the number of CPUs, 1 to run in the current process
+    pattern: (str) glob pattern of the trace files within folder
+    trace_node: (str) path of the trace node within each file, defaults to the loaded node of the settings
+    spectrum_fname: (str) file containing the fundamental spectrum, defaults to each trace file
+    spectrum_node: (str) path of the spectrum node
+    scans: (str) None to retrieve the trace node only, "mean" or "median" to combine all the scans of each file,
+           "stack" to retrieve each scan separately
+
+    Returns
+    -------
+    list of dict: the summaries of each file (or scan), in the order of the sorted file names
+    """
+    folder = Path(folder)
+    output_dir = folder.joinpath("retrieved") if output_dir is None else Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    files = sorted(fname for fname in folder.glob(pattern) if fname.parent != output_dir)
+    if scans == "stack":
+        args = [(fname, settings_path, output_dir, node, spectrum_fname, spectrum_node, None, suffix)
+                for fname in files for node, suffix in scan_tasks(fname, settings_path, trace_node)]
+    else:
+        args = [(fname, settings_path, output_dir, trace_node, spectrum_fname, spectrum_node, scans)
+                for fname in files]
+
+    if workers == 1:
+        summaries = [retrieve_file(*arg) for arg in args]
+    else:
+        summaries = [None] * len(args)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(retrieve_file, *arg): ind for ind, arg in enumerate(args)}
+            for future in as_completed(futures):
+                summary = future.result()
+                summaries[futures[future]] = summary
+                logger.info(f"{summary['file']}: {summary['status']}")
+
+    with open(output_dir.joinpath("summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=summary_fields)
+        writer.writeheader()
+        writer.writerows(summaries)
+    return summaries
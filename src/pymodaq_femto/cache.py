@@ -0,0 +1,216 @@
+"""Content-addressed on-disk cache of the retrieval results
+
+A retrieval is identified by the sha256 hash of the arrays it is computed from (the processed trace and its axes, the
+weights, the fundamental spectrum and its grid) and of its full configuration (see cache_key), so that retrieving
+again the same data with the same settings returns the previous result without retrieving again. Each entry is a npz file named after its key in the cache folder, holding the
+retrieved spectrum, the retrieved trace, the spectral response (mu) and the metrics of the retrieval (trace error,
+iterations, stop reason).
+
+The total size of the entries is bounded: the least recently used entries (modification time, updated when an entry is
+read) are removed beyond max_bytes. The cache can be emptied with ``pymodaq_femto cache clear``.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from types import SimpleNamespace
+import uuid
+
+import numpy as np
+
+cache_dir = Path.home().joinpath(".pymodaq_femto", "cache")
+default_max_bytes = 1024 * 2 ** 20
+hash_block_bytes = 64 * 2 ** 20  # memory of the blocks of rows converted at once when hashing arrays
+
+metrics_fields = ["trace_error", "iterations", "stop_reason"]
+
+
+def _json_default(value):
+    """ Conversion of the numpy values of a configuration to json types"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _remove(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:  # removed by another process
+        pass
+
+
+def _update_array(hasher, data):
+    """ Hash the dtype, the shape and the bytes of an array, by blocks of rows"""
+    if not hasattr(data, "dtype"):
+        data = np.asarray(data)
+    shape = tuple(data.shape)
+    dtype = np.dtype(data.dtype)
+    hasher.update(f"{dtype.str}{shape}".encode())
+    if not shape:
+        hasher.update(np.asarray(data).tobytes())
+        return
+    rows = max(1, hash_block_bytes // max(1, int(np.prod(shape[1:])) * dtype.itemsize))
+    for start in range(0, shape[0], rows):
+        hasher.update(np.ascontiguousarray(data[start:start + rows]).tobytes())
+
+
+def cache_key(arrays, settings):
+    """ Key of a retrieval in the cache
+
+    Parameters
+    ----------
+    arrays: (dict) the arrays the retrieval is computed from, keyed by name. None values (e.g. no weights) are hashed
+            as missing
+    settings: (dict) the configuration of the retrieval, e.g. dataclasses.asdict of a PipelineConfig. Numpy values
+              are converted to python ones
+
+    Returns
+    -------
+    str: the hexadecimal sha256 digest
+    """
+    hasher = hashlib.sha256()
+    for name in sorted(arrays):
+        hasher.update(name.encode())
+        if arrays[name] is None:
+            hasher.update(b"None")
+        else:
+            _update_array(hasher, arrays[name])
+    hasher.update(b"settings")
+    hasher.update(json.dumps(settings, sort_keys=True, default=_json_default).encode())
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    """ Size bounded least recently used cache of retrieval results in a folder
+
+    Parameters
+    ----------
+    directory: (str or Path) folder of the entries, defaults to cache_dir
+    max_bytes: (int) maximum total size of the entries, defaults to default_max_bytes
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = Path(cache_dir if directory is None else directory)
+        self.max_bytes = default_max_bytes if max_bytes is None else max_bytes
+
+    def path(self, key):
+        return self.directory.joinpath(f"{key}.npz")
+
+    def _stats(self):
+        """ (modification time, size, path) of the entries from the least to the most recently used"""
+        if not self.directory.is_dir():
+            return []
+        stats = []
+        for path in self.directory.glob("*.npz"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # removed by another process
+                continue
+            stats.append((stat.st_mtime, stat.st_size, path))
+        return sorted(stats)
+
+    def entries(self):
+        """ Paths of the entries from the least to the most recently used"""
+        return [path for mtime, size, path in self._stats()]
+
+    def __len__(self):
+        return len(self.entries())
+
+    def __contains__(self, key):
+        return self.path(key).is_file()
+
+    def size(self):
+        """ Total size of the entries in bytes"""
+        return sum(size for mtime, size, path in self._stats())
+
+    def get(self, key):
+        """ Entry of key, None if it is not cached
+
+        Returns
+        -------
+        SimpleNamespace: with pulse_retrieved, trace_retrieved, response_function (None if not stored) and the
+                         metrics_fields attributes
+        """
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                entry = SimpleNamespace(
+                    pulse_retrieved=npz["pulse_retrieved"],
+                    trace_retrieved=npz["trace_retrieved"],
+                    response_function=npz["response_function"] if "response_function" in npz else None,
+                    **json.loads(str(npz["metrics"])),
+                )
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:  # corrupted entry
+            self.invalidate(key)
+            return None
+        return entry
+
+    def put(self, key, result, response_function=None):
+        """ Store a retrieval result, then evict the least recently used entries beyond max_bytes
+
+        Parameters
+        ----------
+        key: (str) see cache_key
+        result: (SimpleNamespace) the retrieval result, see RetrievalPipeline.retrieve
+        response_function: (ndarray) the spectral response (mu) of the retrieval
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        arrays = dict(
+            pulse_retrieved=np.asarray(result.pulse_retrieved),
+            trace_retrieved=np.asarray(result.trace_retrieved),
+            metrics=np.array(json.dumps({name: getattr(result, name, None) for name in metrics_fields},
+                                        default=float)),
+        )
+        if response_function is not None:
+            arrays["response_function"] = np.atleast_1d(response_function)
+        # written to a temporary file then renamed, so that concurrent processes never read a partial entry
+        tmp_path = self.directory.joinpath(f"{key}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self, max_bytes=None):
+        """ Remove the least recently used entries until their total size is below max_bytes
+
+        Returns
+        -------
+        int: the number of removed entries
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        stats = self._stats()
+        total = sum(size for mtime, size, path in stats)
+        removed = 0
+        for mtime, size, path in stats:
+            if total <= max_bytes:
+                break
+            _remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def invalidate(self, key):
+        """ Remove the entry of key, return True if it was cached"""
+        path = self.path(key)
+        if path.is_file():
+            _remove(path)
+            return True
+        return False
+
+    def clear(self):
+        """ Remove all the entries (and the temporary files of interrupted writes)
+
+        Returns
+        -------
+        int: the number of removed entries
+        """
+        removed = len(self.entries())
+        if self.directory.is_dir():
+            for path in list(self.directory.glob("*.npz")) + list(self.directory.glob("*.tmp")):
+                _remove(path)
+        return removed
@@ -0,0 +1,109 @@
+"""Command line entry point: pymodaq_femto <command> ...
+
+Commands
+--------
+batch: headless retrieval of all the h5 traces of a folder, see pymodaq_femto.batch
+dataset: generation of sharded sets of simulated traces, see pymodaq_femto.dataset
+cache: information on and invalidation of the retrieval result cache, see pymodaq_femto.cache
+"""
+import argparse
+import json
+import sys
+
+
+def batch(args):
+    from pymodaq_femto.batch import run_batch
+
+    summaries = run_batch(
+        args.folder,
+        args.settings,
+        output_dir=args.output,
+        workers=args.workers,
+        pattern=args.pattern,
+        trace_node=args.trace_node,
+        spectrum_fname=args.spectrum_file,
+        spectrum_node=args.spectrum_node,
+        scans=args.scans,
+    )
+    failed = [summary for summary in summaries if summary["status"] != "ok"]
+    print(f"{len(summaries) - len(failed)}/{len(summaries)} {'scans' if args.scans == 'stack' else 'files'} retrieved")
+    return 1 if failed else 0
+
+
+def dataset(args):
+    from pymodaq_femto.dataset import DatasetSpec, run_dataset
+
+    values = dict()
+    if args.spec is not None:
+        with open(args.spec) as f:
+            values = json.load(f)
+    for name in ("n_samples", "shard_size", "seed"):
+        if getattr(args, name) is not None:
+            values[name] = getattr(args, name)
+    manifest = run_dataset(args.output, DatasetSpec.from_dict(values), workers=args.workers)
+    print(f"{len(manifest['shards'])} shards in {args.output}")
+    return 0
+
+
+def cache(args):
+    from pymodaq_femto.cache import ResultCache
+
+    result_cache = ResultCache(args.dir)
+    if args.action == "clear":
+        print(f"{result_cache.clear()} results removed from {result_cache.directory}")
+    else:
+        print(f"{len(result_cache)} results, {result_cache.size() / 2 ** 20:.1f} MB in {result_cache.directory}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="pymodaq_femto", description="PyMoDAQ Femto command line tools")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    parser_batch = subparsers.add_parser("batch", help="Retrieve all the h5 traces of a folder without user interface")
+    parser_batch.add_argument("folder", help="Folder containing the h5 trace files")
+    parser_batch.add_argument("settings", help="xml settings file, or h5 file saved from the Retriever")
+    parser_batch.add_argument("-o", "--output", default=None,
+                              help="Folder for the result files and summary.csv (default: FOLDER/retrieved)")
+    parser_batch.add_argument("-w", "--workers", type=int, default=None,
+                              help="Number of worker processes (default: number of CPUs)")
+    parser_batch.add_argument("--pattern", default="*.h5", help="Glob pattern of the trace files")
+    parser_batch.add_argument("--trace-node", default=None,
+                              help="Trace node path within each file (default: loaded node from the settings)")
+    parser_batch.add_argument("--spectrum-file", default=None,
+                              help="File containing the fundamental spectrum (default: each trace file)")
+    parser_batch.add_argument("--spectrum-node", required=True, help="Fundamental spectrum node path")
+    parser_batch.add_argument("--scans", choices=["mean", "median", "stack"], default=None,
+                              help="Combine all the scans (Scan000, Scan001...) of each file before the retrieval, or "
+                                   "retrieve each of them separately (stack). Default: the trace node only")
+    parser_batch.set_defaults(func=batch)
+
+    parser_dataset = subparsers.add_parser("dataset", help="Generate a sharded set of simulated traces, resuming an "
+                                                           "interrupted generation")
+    parser_dataset.add_argument("output", help="Folder of the shards and of manifest.json")
+    parser_dataset.add_argument("--spec", default=None,
+                                help="json file with the DatasetSpec values (simulation, distributions...)")
+    parser_dataset.add_argument("-n", "--n-samples", dest="n_samples", type=int, default=None,
+                                help="Number of samples (default: 1000)")
+    parser_dataset.add_argument("--shard-size", type=int, default=None, help="Samples per shard (default: 100)")
+    parser_dataset.add_argument("--seed", type=int, default=None, help="Seed of the sampling (default: 0)")
+    parser_dataset.add_argument("-w", "--workers", type=int, default=None,
+                                help="Number of worker processes (default: number of CPUs)")
+    parser_dataset.set_defaults(func=dataset)
+
+    parser_cache = subparsers.add_parser("cache", help="Show or clear the cache of the retrieval results")
+    parser_cache.add_argument("action", choices=["info", "clear"],
+                              help="info: number and size of the cached results, clear: remove all of them")
+    parser_cache.add_argument("--dir", default=None, help="Cache folder (default: ~/.pymodaq_femto/cache)")
+    parser_cache.set_defaults(func=cache)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
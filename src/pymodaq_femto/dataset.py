@@ -0,0 +1,300 @@
+"""Generation of large sets of simulated traces
+
+Pulses are sampled from parameter distributions (Taylor or Gaussian phases, sequences of pulses, noise...), their
+traces are simulated with simulation_core over a pool of processes and written in shards: h5 files holding a fixed
+number of samples. Each sample is a scan group with the node layout of DScanCustomSaver (the trace with its
+insertion navigation axis and the fundamental spectrum) plus a GroundTruth group with the complex spectrum of the
+simulated pulse, the sampled values being saved as a json attribute of the scan group.
+
+The samples only depend on the seed and on their index, and a manifest.json file records the sha256 checksum of each
+completed shard, so that an interrupted generation can be resumed: valid shards are kept and the others are
+generated again.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import copy
+from dataclasses import dataclass, field, asdict
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+from pymodaq_femto.simulation_core import SimulationConfig, simulate
+
+logger = logging.getLogger(__name__)
+
+manifest_name = "manifest.json"
+package_dir = Path(__file__).parent
+# data files of the simulation, stored relative to package_dir in the manifest so that it does not depend on where the
+# package is installed. Relative paths of a spec are relative to package_dir
+data_file_fields = ["pulse.data_file_path", "detector.response_file"]
+
+# {"uniform": [low, high]} or {"choice": [values]}, keyed on the attribute path within SimulationConfig. "noise" is
+# the standard deviation of the gaussian noise added to the normalized trace, more realistic measurements are
+# obtained by enabling the detector model (simulation.detector) and sampling its "detector.*" values
+default_distributions = {
+    "pulse.fwhm_time": {"uniform": [4., 12.]},
+    "pulse.shaping_type": {"choice": ["Taylor", "Gaussian"]},
+    "pulse.GDD": {"uniform": [-100., 100.]},
+    "pulse.TOD": {"uniform": [-1000., 1000.]},
+    "pulse.gauss_amp": {"uniform": [0., 6.]},
+    "pulse.dtime": {"uniform": [5., 30.]},
+    "pulse.npulses": {"choice": [1, 1, 1, 2, 3]},
+    "pulse.delay_pulses": {"uniform": [30., 150.]},
+    "noise": {"uniform": [0., 0.02]},
+}
+
+
+def default_simulation():
+    config = SimulationConfig()
+    config.algo.method = "dscan"
+    return config
+
+
+@dataclass
+class DatasetSpec:
+    n_samples: int = 1000
+    shard_size: int = 100  # number of samples per shard
+    seed: int = 0
+    simulation: SimulationConfig = field(default_factory=default_simulation)  # values not sampled
+    distributions: Dict[str, dict] = field(default_factory=lambda: copy.deepcopy(default_distributions))
+
+    @property
+    def n_shards(self):
+        return -(-self.n_samples // self.shard_size)
+
+    def shard_samples(self, shard):
+        """ range of the sample indexes of a shard"""
+        return range(shard * self.shard_size, min((shard + 1) * self.shard_size, self.n_samples))
+
+    @classmethod
+    def from_dict(cls, values):
+        """ Build a spec from a dict (e.g. read from a json file)
+
+        The simulation entry holds nested dicts of the SimulationConfig values to change from default_simulation,
+        the distributions entry replaces the default distributions. Relative paths of the data files (data_file_fields)
+        are relative to package_dir.
+        """
+        values = dict(values)
+        spec = cls(**{key: value for key, value in values.items() if key != "simulation"})
+        for path, value in _flatten(values.get("simulation", {})):
+            if path in data_file_fields and value and not Path(value).is_absolute():
+                value = str(package_dir.joinpath(value).resolve())
+            set_value(spec.simulation, path, value)
+        return spec
+
+    def to_dict(self):
+        """ The values of the spec as json types: arrays (e.g. the detector response) are converted to lists and the
+        paths of the data files are made relative to package_dir"""
+        values = json.loads(json.dumps(asdict(self), default=_json_default))
+        for path in data_file_fields:
+            *parents, name = path.split(".")
+            config = values["simulation"]
+            for parent in parents:
+                config = config[parent]
+            if config[name]:
+                try:
+                    config[name] = Path(os.path.relpath(Path(config[name]).resolve(),
+                                                        package_dir.resolve())).as_posix()
+                except ValueError:  # on another drive
+                    pass
+        return values
+
+
+def _json_default(value):
+    """ Conversion of the numpy values of a spec to json types"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _flatten(values, prefix=""):
+    for key, value in values.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+
+def set_value(config, path, value):
+    """ Set the attribute at path ("pulse.GDD", "algo.dscan_parameter.step"...) of config, converted to the type of
+    the current value"""
+    *parents, name = path.split(".")
+    for parent in parents:
+        config = getattr(config, parent)
+    current = getattr(config, name)
+    if isinstance(current, (bool, int, float, str)) and not isinstance(value, type(current)):
+        value = type(current)(round(value) if isinstance(current, int) else value)
+    setattr(config, name, value)
+
+
+def sample_values(distributions, rng):
+    """ One value of each distribution, numpy scalars are converted to python ones"""
+    values = dict()
+    for path, distribution in distributions.items():
+        if "uniform" in distribution:
+            value = rng.uniform(*distribution["uniform"])
+        elif "choice" in distribution:
+            choices = distribution["choice"]
+            value = choices[rng.integers(len(choices))]
+        else:
+            raise ValueError(f"Unknown distribution for {path}: {distribution}")
+        values[path] = value.item() if isinstance(value, np.generic) else value
+    return values
+
+
+def sample(spec, index):
+    """ Simulate the sample index of spec
+
+    Returns
+    -------
+    tuple: (trace MeshData with noise, spectrum MeshData, pulse, dict of the sampled values)
+    """
+    rng = np.random.default_rng([spec.seed, index])
+    values = sample_values(spec.distributions, rng)
+    config = copy.deepcopy(spec.simulation)
+    for path, value in values.items():
+        if path != "noise":
+            set_value(config, path, value)
+    if config.detector.enabled:
+        config.detector.seed = int(rng.integers(2 ** 32))
+    trace, spectrum, pulse = simulate(config)
+    noise = values.get("noise", 0.)
+    if noise > 0:
+        trace.data = trace.data + noise * rng.standard_normal(trace.data.shape)
+    return trace, spectrum, pulse, values
+
+
+def dataset_saver():
+    """ DScanCustomSaver writing the ground truth pulses, pymodaq is imported here so that sampling does not need it"""
+    from pymodaq_femto.utils.convert_to_pymodaq_compatible import DScanCustomSaver
+
+    class DatasetSaver(DScanCustomSaver):
+        def add_ground_truth(self, node, pulse):
+            group = self.get_set_group(node, "GroundTruth", title='Ground truth')
+            self.add_data(group, dict(data=pulse.spectrum, x_axis=dict(data=pulse.ft.w, label="frequency", units="Hz")),
+                          title='Spectrum')
+            self.set_attr(group, "w0", pulse.w0)
+            self.set_attr(group, "Npts", pulse.ft.N)
+
+    return DatasetSaver()
+
+
+def sha256(fname):
+    digest = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(2 ** 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def shard_name(shard):
+    return f"shard_{shard:05d}.h5"
+
+
+def generate_shard(spec, shard, output_dir):
+    """ Simulate the samples of a shard and write them in output_dir
+
+    This is the function executed by the pool workers. The shard is written in a temporary file renamed once
+    complete, so that interrupted shards are never mistaken for complete ones.
+
+    Returns
+    -------
+    dict: name, samples (first index and number of samples) and sha256 of the shard
+    """
+    path = Path(output_dir).joinpath(shard_name(shard))
+    tmp_path = path.with_suffix(".h5.tmp")
+    saver = dataset_saver()
+    saver.init_file(addhoc_file_path=str(tmp_path), update_h5=True)
+    try:
+        for index in spec.shard_samples(shard):
+            trace, spectrum, pulse, values = sample(spec, index)
+            scannode = saver.add_scan_group()
+            scannode.set_attr('scan_type', "Scan1D")
+            scannode.set_attr('sample_index', index)
+            scannode.set_attr('sample_values', json.dumps(values))
+            saver.add_exp_insertion(scannode, trace.axes[0], label=trace.labels[0], units=trace.units[0])
+            saver.add_exp_trace(scannode, trace.data, trace.axes[1])
+            saver.add_exp_fundamental(scannode, spectrum.data, spectrum.axes[0])
+            saver.add_ground_truth(scannode, pulse)
+    finally:
+        saver.close_file()
+    os.replace(tmp_path, path)
+    samples = spec.shard_samples(shard)
+    return dict(name=path.name, samples=[samples.start, len(samples)], sha256=sha256(path))
+
+
+def load_manifest(output_dir):
+    path = Path(output_dir).joinpath(manifest_name)
+    if not path.is_file():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(output_dir, manifest):
+    path = Path(output_dir).joinpath(manifest_name)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def valid_shards(output_dir, manifest):
+    """ Names of the shards of the manifest whose file exists and matches its checksum"""
+    valid = set()
+    for name, entry in manifest["shards"].items():
+        path = Path(output_dir).joinpath(name)
+        if path.is_file() and sha256(path) == entry["sha256"]:
+            valid.add(name)
+    return valid
+
+
+def run_dataset(output_dir, spec=None, workers=None):
+    """ Generate the dataset of spec in output_dir, resuming a previous generation if any
+
+    Parameters
+    ----------
+    output_dir: (str or Path) folder of the shards and of the manifest
+    spec: (DatasetSpec) defaults to DatasetSpec()
+    workers: (int) number of processes, None for the number of CPUs, 1 to run in the current process
+
+    Returns
+    -------
+    dict: the manifest, with the spec and the entries of all the shards
+    """
+    spec = DatasetSpec() if spec is None else spec
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    spec_values = spec.to_dict()
+
+    manifest = load_manifest(output_dir)
+    if manifest is not None and manifest["spec"] != spec_values:
+        raise ValueError(f"{output_dir} holds a dataset generated with another spec, use another folder")
+    if manifest is None:
+        manifest = dict(spec=spec_values, shards=dict())
+    valid = valid_shards(output_dir, manifest)
+    manifest["shards"] = {name: entry for name, entry in manifest["shards"].items() if name in valid}
+    todo = [shard for shard in range(spec.n_shards) if shard_name(shard) not in valid]
+    logger.info(f"{spec.n_shards - len(todo)}/{spec.n_shards} shards already generated")
+
+    def done(entry):
+        manifest["shards"][entry["name"]] = entry
+        write_manifest(output_dir, manifest)
+        logger.info(f"{entry['name']} written")
+
+    if workers == 1:
+        for shard in todo:
+            done(generate_shard(spec, shard, output_dir))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(generate_shard, spec, shard, output_dir) for shard in todo]
+            for future in as_completed(futures):
+                done(future.result())
+    write_manifest(output_dir, manifest)
+    return manifest
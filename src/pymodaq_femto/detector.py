@@ -0,0 +1,76 @@
+"""Detector model applied to simulated traces
+
+Simulated traces are noiseless and perfectly normalized. DetectorModel turns them into realistic measurements: the
+trace is multiplied by the spectral response of the detector, convolved by the resolution of the spectrometer,
+scaled to a number of counts, and shot noise, a dark offset and read noise are added. All the operations are
+vectorized along the leading axes, so that batches of traces of shape (B, M, N) are processed at once.
+"""
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+import scipy.ndimage
+
+
+@dataclass
+class DetectorModel:
+    enabled: bool = False
+    peak_counts: float = 1e4  # counts at the maximum of each trace
+    shot_noise: bool = True  # gaussian approximation of the Poisson noise of the counts
+    read_noise: float = 0.  # standard deviation of the read noise in counts
+    dark_offset: float = 0.  # in counts
+    resolution: float = 0.  # FWHM of the spectrometer response in nm, 0 for an infinite resolution
+    response_file: str = ""  # csv file with wavelength (nm) and response columns, "" for a flat response
+    normalize: bool = True  # divide the counts by peak_counts
+    seed: int = 0
+    response: Optional[Tuple[np.ndarray, np.ndarray]] = None  # (wavelength in m, response), overrides response_file
+
+    def response_curve(self, wavelength):
+        """ Spectral response on the wavelength axis (in m), zero outside of the range of the curve, None if flat"""
+        if self.response is not None:
+            wl, response = self.response
+        elif self.response_file:
+            data = np.genfromtxt(self.response_file, delimiter=',', skip_header=1)
+            wl, response = data[:, 0] * 1e-9, data[:, 1]
+        else:
+            return None
+        order = np.argsort(wl)
+        return np.interp(wavelength, np.asarray(wl)[order], np.asarray(response)[order], left=0, right=0)
+
+    def apply(self, data, wavelength, rng=None):
+        """ Measured trace(s) of the simulated ones
+
+        Parameters
+        ----------
+        data: (ndarray) a trace of shape (M, N) or a batch of traces of shape (..., M, N), on a linear wavelength axis
+        wavelength: (1D array) the N wavelengths in m
+        rng: (numpy Generator) defaults to a generator seeded with seed
+
+        Returns
+        -------
+        ndarray: the measured trace(s), a copy of data if the model is not enabled
+        """
+        data = np.array(data, dtype=float)
+        if not self.enabled:
+            return data
+        rng = np.random.default_rng(self.seed) if rng is None else rng
+        wavelength = np.asarray(wavelength)
+
+        response = self.response_curve(wavelength)
+        if response is not None:
+            data *= response
+        if self.resolution > 0:
+            step = np.abs(wavelength[1] - wavelength[0])
+            sigma = self.resolution * 1e-9 / step / (2 * np.sqrt(2 * np.log(2)))
+            data = scipy.ndimage.gaussian_filter1d(data, sigma, axis=-1, mode='constant')
+
+        peak = np.max(data, axis=(-2, -1), keepdims=True) if data.ndim > 1 else np.max(data)
+        data *= self.peak_counts / np.where(peak > 0, peak, 1.)
+        if self.shot_noise:
+            data += np.sqrt(np.maximum(data, 0.)) * rng.standard_normal(data.shape)
+        data += self.dark_offset
+        if self.read_noise > 0:
+            data += self.read_noise * rng.standard_normal(data.shape)
+        if self.normalize:
+            data /= self.peak_counts
+        return data
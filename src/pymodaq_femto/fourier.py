@@ -0,0 +1,223 @@
+"""Selectable FFT backends for pypret's Fourier transforms
+
+pypret's FourierTransform computes its transforms with single threaded, unplanned FFTs. BackendFourierTransform is a
+drop-in replacement whose forward and backward transforms run on one of the backends of this module:
+
+* numpy: numpy.fft, single threaded
+* scipy: scipy.fft with a number of worker threads
+* pyfftw: FFTW through pyFFTW (optional dependency) with a number of threads. Its plans are measured once and the
+  wisdom is saved to disk so that they are reused in the following sessions.
+
+The transforms of pypret are pre-factors, an FFT (or inverse FFT) and post-factors. Rather than relying on the
+internals of pypret, these factors are obtained once per grid from transforms computed by pypret, and checked on a
+random vector.
+"""
+from collections import OrderedDict
+import os
+from pathlib import Path
+import pickle
+import threading
+import warnings
+
+import numpy as np
+import scipy.fft
+from pypret import FourierTransform
+
+try:
+    import pyfftw
+    import pyfftw.interfaces.numpy_fft
+    import pyfftw.interfaces.cache
+except ImportError:
+    pyfftw = None
+
+wisdom_path = Path.home().joinpath(".pymodaq_femto", "fftw_wisdom.pickle")
+
+
+class FFTBackend:
+    """ numpy.fft transforms along the last axis"""
+    name = "numpy"
+
+    def __init__(self, workers=0):
+        self.workers = workers if workers > 0 else os.cpu_count()
+
+    def fft(self, x):
+        return np.fft.fft(x, axis=-1)
+
+    def ifft(self, x):
+        return np.fft.ifft(x, axis=-1)
+
+
+class ScipyFFTBackend(FFTBackend):
+    """ scipy.fft transforms along the last axis computed with several threads"""
+    name = "scipy"
+
+    def fft(self, x):
+        return scipy.fft.fft(x, axis=-1, workers=self.workers)
+
+    def ifft(self, x):
+        return scipy.fft.ifft(x, axis=-1, workers=self.workers)
+
+
+class FFTWBackend(FFTBackend):
+    """ pyFFTW transforms along the last axis computed with several threads
+
+    The plans are cached in memory and the accumulated wisdom is saved in wisdom_path each time new plans are made.
+    """
+    name = "pyfftw"
+    planner_effort = "FFTW_MEASURE"
+    _lock = threading.Lock()
+    _planned = set()
+
+    def __init__(self, workers=0):
+        if pyfftw is None:
+            raise ImportError("pyFFTW is not installed")
+        super().__init__(workers)
+        pyfftw.interfaces.cache.enable()
+        pyfftw.interfaces.cache.set_keepalive_time(60)
+        load_wisdom()
+
+    def _transform(self, func, x):
+        key = (func.__name__, x.shape, x.dtype.str, self.workers)
+        result = func(x, axis=-1, threads=self.workers, planner_effort=self.planner_effort)
+        if key not in self._planned:
+            with self._lock:
+                self._planned.add(key)
+                save_wisdom()
+        return result
+
+    def fft(self, x):
+        return self._transform(pyfftw.interfaces.numpy_fft.fft, x)
+
+    def ifft(self, x):
+        return self._transform(pyfftw.interfaces.numpy_fft.ifft, x)
+
+
+backends = OrderedDict(numpy=FFTBackend, scipy=ScipyFFTBackend, pyfftw=FFTWBackend)
+
+
+def load_wisdom(path=None):
+    """ Import the FFTW wisdom saved in path (defaults to wisdom_path) if any"""
+    path = wisdom_path if path is None else Path(path)
+    if pyfftw is None or not path.is_file():
+        return
+    try:
+        with open(path, "rb") as f:
+            pyfftw.import_wisdom(pickle.load(f))
+    except Exception as e:
+        warnings.warn(f"Could not load the FFTW wisdom from {path}: {e}")
+
+
+def save_wisdom(path=None):
+    """ Save the accumulated FFTW wisdom in path (defaults to wisdom_path)"""
+    path = wisdom_path if path is None else Path(path)
+    if pyfftw is None:
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump(pyfftw.export_wisdom(), f)
+    except OSError as e:
+        warnings.warn(f"Could not save the FFTW wisdom in {path}: {e}")
+
+
+def get_backend(name="numpy", workers=0):
+    """ Instance of the FFT backend called name, numpy is used if pyFFTW is requested but not installed
+
+    Parameters
+    ----------
+    name: (str) one of backends
+    workers: (int) number of threads, 0 for the number of CPUs
+    """
+    if name not in backends:
+        raise ValueError(f"Unknown FFT backend: {name}, should be one of {list(backends)}")
+    try:
+        return backends[name](workers)
+    except ImportError as e:
+        warnings.warn(f"{e}, using numpy FFT")
+        return FFTBackend(workers)
+
+
+class BackendFourierTransform(FourierTransform):
+    """ pypret FourierTransform whose transforms are computed with an FFT backend
+
+    Parameters
+    ----------
+    N, dt, dw, t0, w0: see pypret.FourierTransform
+    backend: (FFTBackend) defaults to numpy
+    """
+
+    def __init__(self, N, dt=None, dw=None, t0=None, w0=None, backend=None):
+        super().__init__(N, dt=dt, dw=dw, t0=t0, w0=w0)
+        self.backend = FFTBackend() if backend is None else backend
+        self._forward_plan = self._calibrate(super().forward)
+        self._backward_plan = self._calibrate(super().backward)
+
+    def _calibrate(self, transform):
+        """ Factors and direction of the FFT reproducing transform
+
+        transform(x) is post * F(pre * x) with F the FFT or the inverse FFT. transform of the first unit vector
+        gives post * pre[0] up to the constant F(e0) and the transform of ones then gives pre / pre[0]. Both
+        directions are tried and checked on a random vector.
+
+        Returns
+        -------
+        tuple or None: (inverse, pre, post) with inverse True for the inverse FFT, None if no direction reproduces
+                       transform, which is then used as is
+        """
+        N = self.N
+        e0 = np.zeros(N, dtype=np.complex128)
+        e0[0] = 1.0
+        ones = np.ones(N, dtype=np.complex128)
+        x = np.array([1.0, 1.0j]) @ np.random.default_rng(0).standard_normal((2, N))
+        reference = transform(x)
+        t_e0 = transform(e0)
+        t_ones = transform(ones)
+        for inverse, func, f_e0 in ((False, np.fft.fft, 1.0), (True, np.fft.ifft, 1.0 / N)):
+            post = t_e0 / f_e0
+            if np.any(post == 0):
+                continue
+            inverse_func = np.fft.fft if inverse else np.fft.ifft
+            pre = inverse_func(t_ones / post)
+            if np.allclose(post * func(pre * x), reference, rtol=1e-8, atol=1e-12 * np.abs(reference).max()):
+                return inverse, pre, post
+        warnings.warn("Could not reproduce pypret's Fourier transform, the FFT backend is not used")
+        return None
+
+    def _apply(self, plan, base_transform, x, out):
+        if plan is None:
+            return base_transform(x) if out is None else base_transform(x, out=out)
+        inverse, pre, post = plan
+        x = np.asarray(x)
+        dtype = np.complex64 if x.dtype in (np.float32, np.complex64) else np.complex128
+        pre = pre.astype(dtype, copy=False)
+        post = post.astype(dtype, copy=False)
+        transform = self.backend.ifft if inverse else self.backend.fft
+        result = post * transform(pre * x)
+        if out is not None:
+            out[...] = result
+            return out
+        return result
+
+    def forward(self, x, out=None):
+        """ Forward transform along the last axis of x, see pypret.FourierTransform"""
+        return self._apply(self._forward_plan, super().forward, x, out)
+
+    def backward(self, x, out=None):
+        """ Backward transform along the last axis of x, see pypret.FourierTransform"""
+        return self._apply(self._backward_plan, super().backward, x, out)
+
+
+def fourier_transform(N, dt, w0, backend="numpy", workers=0):
+    """ Fourier transform of the grid with the FFT backend called backend, the plain pypret one for numpy
+
+    Parameters
+    ----------
+    N: (int) number of points
+    dt: (float) time step in s
+    w0: (float) first angular frequency of the grid
+    backend: (str) one of backends
+    workers: (int) number of threads, 0 for the number of CPUs
+    """
+    if backend == "numpy":
+        return FourierTransform(N, dt, w0=w0)
+    return BackendFourierTransform(N, dt, w0=w0, backend=get_backend(backend, workers))
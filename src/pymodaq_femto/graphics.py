@@ -392,3 +392,32 @@ class RetrievalResultPlot:
                 left=0.1, right=0.95, top=0.9, bottom=0.1, hspace=0.5, wspace=1.0
             )
             plt.show()
+
+
+class MonitorPlot:
+    """ Rolling FWHM, GDD and TOD of the pulses retrieved online, see monitor.OnlineMonitor.series"""
+
+    fields = [("fwhm", "FWHM (fs)"), ("gdd", "GDD (fs$^2$)"), ("tod", "TOD (fs$^3$)")]
+
+    def __init__(self, series, fig=None, plot=True, **kwargs):
+        self.series = series
+        self.fig = fig
+        if plot:
+            self.plot(**kwargs)
+
+    def plot(self, show=True):
+        series = self.series
+        if self.fig is None:
+            fig = plt.figure()
+        else:
+            fig = self.fig
+        axes = fig.subplots(nrows=len(self.fields), ncols=1, sharex=True)
+        t = series["timestamp"] - series["timestamp"][0] if len(series["timestamp"]) else series["timestamp"]
+        for ax, (name, label) in zip(axes, self.fields):
+            ax.plot(t, series[name], ".-")
+            ax.set_ylabel(label)
+        axes[-1].set_xlabel("time (s)")
+
+        self.fig, self.axes = fig, axes
+        if show:
+            fig.tight_layout()
@@ -0,0 +1,265 @@
+"""Reading and writing of PyMoDAQ h5 files
+
+Lazy arrays, axes and attributes are read with pytables only, so that headless retrievals do not depend on pymodaq
+to load their data; the Retriever reads whole traces with the same functions. Writing the results with save_retrieval
+uses the h5 modules of pymodaq, which are imported when called.
+"""
+import numpy as np
+import tables
+
+lazy_block_bytes = 64 * 2 ** 20  # size of the blocks read by the reductions of LazyH5Array
+
+
+class LazyH5Array:
+    """ Read-only view of an array node of a h5 file, only the requested blocks are read from the file
+
+    The dimensions of length 1 of the node are squeezed, as done by H5BrowserUtil.get_h5_data. Indexing with integers
+    and slices (with steps) reads the corresponding block, np.asarray reads the whole array and sum is computed by
+    blocks of rows. The file is opened on first access and kept open until close is called; instances can be pickled
+    to be used in other processes.
+
+    Parameters
+    ----------
+    fname: (str or Path) path of the h5 file
+    node_path: (str) path of the array node within the file
+    h5file: (tables.File) the file if already opened
+    """
+
+    def __init__(self, fname, node_path, h5file=None):
+        self.fname = str(fname)
+        self.node_path = node_path
+        self._file = h5file
+        node = self.node
+        self._node_shape = tuple(int(size) for size in node.shape)
+        self.shape = tuple(size for size in self._node_shape if size != 1)
+        self.dtype = np.dtype(node.dtype)
+
+    @property
+    def node(self):
+        if self._file is None or not self._file.isopen:
+            self._file = tables.open_file(self.fname, mode="r")
+        return self._file.get_node(self.node_path)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        if any(item is Ellipsis for item in key):
+            ind = key.index(Ellipsis)
+            key = key[:ind] + (slice(None),) * (self.ndim - len(key) + 1) + key[ind + 1:]
+        key = list(key) + [slice(None)] * (self.ndim - len(key))
+        node_key = tuple(0 if size == 1 else key.pop(0) for size in self._node_shape)
+        return np.asarray(self.node[node_key])
+
+    def __array__(self, dtype=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def sum(self, axis=None, dtype=None, out=None, keepdims=False, **kwargs):
+        """ Sum computed by blocks of rows, see numpy.sum"""
+        rows = max(1, lazy_block_bytes // max(1, self.nbytes // max(1, self.shape[0])))
+        if axis in (0, -self.ndim) or axis is None:
+            result = sum(np.sum(self[start:start + rows], axis=axis, dtype=dtype)
+                         for start in range(0, self.shape[0], rows))
+            result = np.asarray(result)
+        else:
+            result = np.concatenate([np.sum(self[start:start + rows], axis=axis, dtype=dtype)
+                                     for start in range(0, self.shape[0], rows)])
+        if keepdims:
+            result = np.expand_dims(result, tuple(range(self.ndim)) if axis is None else axis)
+        if out is not None:
+            out[...] = result
+            return out
+        return result
+
+    def close(self):
+        if self._file is not None and self._file.isopen:
+            self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_file"] = None
+        return state
+
+
+def _attribute(node, name, default=""):
+    if name not in node._v_attrs._v_attrnames:
+        return default
+    value = node._v_attrs[name]
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _axis(node):
+    """ Axis as a dict with data, label and units keys, like pymodaq's daq_utils.Axis"""
+    return dict(data=np.squeeze(node.read()), label=_attribute(node, "label"), units=_attribute(node, "units"))
+
+
+def read_h5_axes(h5file, node_path):
+    """ Axes of a data node of a PyMoDAQ h5 file, without reading its data
+
+    The signal axes are the X_axis and Y_axis siblings of the node. The navigation axes are its Nav_x_axis and
+    Nav_y_axis siblings (ND data) or the children of the Navigation_axes group of the enclosing scan group.
+
+    Parameters
+    ----------
+    h5file: (tables.File or str or Path) the opened file or its path
+    node_path: (str) path of the data node within the file
+
+    Returns
+    -------
+    dict: the axes with the keys of H5BrowserUtil.get_h5_data ('x_axis', 'y_axis', 'nav_00', ...)
+    """
+    if not isinstance(h5file, tables.File):
+        with tables.open_file(str(h5file), mode="r") as f:
+            return read_h5_axes(f, node_path)
+    node = h5file.get_node(node_path)
+    parent = node._v_parent
+    axes = dict()
+    for name in ("x_axis", "y_axis"):
+        axes[name] = _axis(parent._v_children[name.capitalize()]) if name.capitalize() in parent._v_children else \
+            dict(data=np.array([]), label="", units="")
+
+    nav_nodes = [parent._v_children[name] for name in ("Nav_x_axis", "Nav_y_axis") if name in parent._v_children]
+    if not nav_nodes:
+        group = parent
+        while group is not h5file.root and not group._v_name.startswith("Scan"):
+            group = group._v_parent
+        if group is not h5file.root and "Navigation_axes" in group._v_children:
+            nav_group = group._v_children["Navigation_axes"]
+            nav_nodes = [nav_group._v_children[name] for name in sorted(nav_group._v_children)]
+    for ind, nav_node in enumerate(nav_nodes):
+        axes[f"nav_{ind:02d}"] = _axis(nav_node)
+    return axes
+
+
+def load_h5_trace(fname, node_path, lazy=False):
+    """ Read the data and axes of a node of a PyMoDAQ h5 file with pytables, the file is opened once
+
+    The Retriever displays the whole trace and reads it in memory (lazy=False), the batch retrievals keep it lazy so
+    that only the blocks selected by the ROI and the reductions are read.
+
+    Parameters
+    ----------
+    fname: (str or Path) path of the h5 file
+    node_path: (str) path of the data node within the file
+    lazy: (bool) if True the data is returned as a LazyH5Array, only the blocks used later on are read
+
+    Returns
+    -------
+    data: (ndarray or LazyH5Array) the data with the dimensions of length 1 squeezed
+    axes: (dict) the axes of the node ('x_axis', 'nav_00', ...)
+    """
+    data = LazyH5Array(fname, node_path)
+    axes = read_h5_axes(data.node._v_file, node_path)
+    if not lazy:
+        with data:
+            data = np.asarray(data)
+    return data, axes
+
+
+def load_h5_attribute(fname, node_path, name):
+    """ Read the attribute called name of a node of a h5 file"""
+    with tables.open_file(str(fname), mode="r") as h5file:
+        node = h5file.get_node(node_path)
+        if name not in node._v_attrs._v_attrnames:
+            raise KeyError(f"No attribute {name} in the node {node_path} of {fname}")
+        return _attribute(node, name)
+
+
+def save_retrieval(file_path, raw_trace, raw_spectrum, settings_xml, all_settings_xml, result=None,
+                   propagated_pulse=None, prop_settings_xml=None):
+    """ Save the input data and the retrieval results in a h5 file under the PyMoDAQFemtoAnalysis group
+
+    Parameters
+    ----------
+    file_path: (str) path of the h5 file
+    raw_trace: (dict) with data, x_axis and y_axis keys
+    raw_spectrum: (dict) with data and x_axis keys
+    settings_xml: (bytes) xml representation of the retriever settings
+    all_settings_xml: (bytes) xml representation of all the settings (retriever, pulse and propagation)
+    result: (SimpleNamespace) result of the retrieval as returned by pypret retrievers
+    propagated_pulse: (Pulse) the retrieved pulse after propagation
+    prop_settings_xml: (bytes) xml representation of the propagation and pulse settings
+    """
+    from pymodaq.daq_utils.h5modules import H5Saver
+
+    raw_trace = dict(raw_trace, data=np.asarray(raw_trace["data"]))  # the trace may be a LazyH5Array
+    h5saver = H5Saver(save_type="custom")
+    h5saver.init_file(
+        update_h5=True,
+        custom_naming=False,
+        addhoc_file_path=file_path,
+        raw_group_name="PyMoDAQFemtoAnalysis",
+    )
+    try:
+        data_in_group = h5saver.get_set_group(h5saver.raw_group, "DataIn")
+        trace_group = h5saver.get_set_group(data_in_group, "NLTrace")
+        spectrum_group = h5saver.get_set_group(data_in_group, "FunSpectrum")
+        h5saver.add_data(trace_group, raw_trace, scan_type="")
+        h5saver.add_data(spectrum_group, raw_spectrum, scan_type="")
+        h5saver.set_attr(data_in_group, "settings", settings_xml)
+
+        if result is not None:
+            result_group = h5saver.get_set_group(h5saver.raw_group, "Result")
+            if getattr(result, "stop_reason", None) is not None:
+                h5saver.set_attr(result_group, "stop_reason", result.stop_reason)
+                h5saver.set_attr(result_group, "iterations", result.iterations)
+
+            spectrum_group = h5saver.get_set_group(result_group, "Spectrum")
+            h5saver.add_data(
+                spectrum_group,
+                dict(
+                    data=result.pulse_retrieved,
+                    x_axis=dict(data=result.pnps.ft.w, label="frequency", units="Hz"),
+                ),
+                scan_type="",
+            )
+
+            h5saver.set_attr(spectrum_group, "w0", result.pnps.w0)
+            h5saver.set_attr(spectrum_group, "Npts", result.pnps.ft.N)
+
+            trace_group_retrieved = h5saver.get_set_group(result_group, "NLTrace")
+            trace_retrieved = dict(
+                data=result.trace_retrieved,
+                x_axis=dict(data=result.pnps.process_w, label="frequency", units="Hz"),
+                y_axis=dict(
+                    data=result.parameter, label="parameter", units="Par. units"
+                ),
+            )
+            h5saver.add_data(trace_group_retrieved, trace_retrieved, scan_type="")
+
+            if propagated_pulse is not None:
+                propag_group = h5saver.get_set_group(result_group, "Propagation")
+                h5saver.add_data(
+                    propag_group,
+                    dict(
+                        data=propagated_pulse.spectrum,
+                        x_axis=dict(data=result.pnps.ft.w, label="frequency", units="Hz"),
+                    ),
+                    scan_type="",
+                )
+                h5saver.set_attr(propag_group, "settings", prop_settings_xml)
+
+        h5saver.set_attr(h5saver.raw_group, "settings", all_settings_xml)
+    finally:
+        h5saver.close_file()
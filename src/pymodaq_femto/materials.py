@@ -1,8 +1,131 @@
+import abc
+
 from pypret.material import BaseMaterial
+from pypret.frequencies import convert
 import numpy as np
+import scipy.constants as sc
+
+
+def _power_jet(x, p, order):
+    """ x**p and its derivatives up to order, p broadcast against x"""
+    jet = [x ** p]
+    factor = 1.
+    for i in range(order):
+        factor = factor * (p - i)
+        jet.append(factor * x ** (p - i - 1))
+    return jet
+
+
+def _pole_jet(x, b, order):
+    """ 1 / (x**2 - b) and its derivatives up to order (at most 3), b broadcast against x"""
+    d = 1. / (x * x - b)
+    jet = [d]
+    if order > 0:
+        jet.append(-2 * x * d ** 2)
+    if order > 1:
+        jet.append(-2 * d ** 2 + 8 * x * x * d ** 3)
+    if order > 2:
+        jet.append(24 * x * d ** 3 - 48 * x ** 3 * d ** 4)
+    return jet
+
+
+def _product_jet(f, g):
+    """ Derivatives of the product of f and g (Leibniz rule), up to the order of the jets"""
+    binomials = [[1], [1, 1], [1, 2, 1], [1, 3, 3, 1]]
+    return [sum(b * f[i] * g[n - i] for i, b in enumerate(binomials[n])) for n in range(len(f))]
+
 
+class SellmeierMaterial(BaseMaterial, abc.ABC):
+    """ Defines a dispersive material whose squared index is a sum of rational and power terms::
 
-class SellmeierF1(BaseMaterial):
+            n^2(l) = c + a1 * l^p1 / (l^2 - b1) + ... + a'1 * l^p'1 + ...
+
+        All the terms are evaluated at once, the wavelengths being broadcast against the arrays of coefficients, and so
+        are their derivatives which give analytic group delay, GDD and TOD. Subclasses define the terms from the
+        coefficients of their formula.
+    """
+
+    @abc.abstractmethod
+    def _terms(self):
+        """ Constant c, rational terms (a, p, b) and power terms (a', p') as arrays of coefficients"""
+
+    def _n2(self, x, order=0):
+        """ n^2 and its derivatives with respect to the scaled wavelength x up to order (at most 3)"""
+        constant, (a, p, b), (a_power, p_power) = self._terms()
+        x = np.asarray(x, dtype=float)[..., None]  # terms along the last axis
+        rational = _product_jet(_power_jet(x, p, order), _pole_jet(x, b, order))
+        power = _power_jet(x, p_power, order)
+        n2 = [np.sum(a * term, axis=-1) + np.sum(a_power * term_power, axis=-1)
+              for term, term_power in zip(rational, power)]
+        n2[0] += constant
+        return n2
+
+    def _func(self, x):
+        return np.sqrt(np.maximum(self._n2(x)[0], 0))
+
+    def dispersion(self, x, unit="wl", order=3):
+        """ Wavenumber in the material (rad/m) and its derivatives with respect to the angular frequency
+
+        Parameters
+        ----------
+        x: (ndarray or float) wavelengths, frequencies... in unit
+        unit: (str) unit of x as in pypret.frequencies.convert ('wl', 'om'...)
+        order: (int) highest derivative, at most 3
+
+        Returns
+        -------
+        list of ndarray: k, dk/dw (s/m), d2k/dw2 (s^2/m) and d3k/dw3 (s^3/m) up to order
+        """
+        if not 0 <= order <= 3:
+            raise ValueError("The derivatives of the wavenumber are computed up to the third order")
+        x_scaled = np.asarray(self._convert(x, unit), dtype=float)
+        w = convert(np.asarray(x, dtype=float), unit, "om")
+        N = self._n2(x_scaled, order)
+        # chain rule with x = A / w: dx/dw = -x / w, d2x/dw2 = 2 x / w^2, d3x/dw3 = -6 x / w^3
+        x1, x2, x3 = -x_scaled / w, 2 * x_scaled / w ** 2, -6 * x_scaled / w ** 3
+        Nw = [N[0]]
+        if order > 0:
+            Nw.append(N[1] * x1)
+        if order > 1:
+            Nw.append(N[2] * x1 ** 2 + N[1] * x2)
+        if order > 2:
+            Nw.append(N[3] * x1 ** 3 + 3 * N[2] * x1 * x2 + N[1] * x3)
+        # n = sqrt(N): N' = 2 n n', N'' = 2 n'^2 + 2 n n'', N''' = 6 n' n'' + 2 n n'''
+        n = np.sqrt(np.maximum(N[0], 0))
+        half_inv = np.divide(0.5, n, out=np.zeros_like(n), where=n > 0)
+        nw = [n]
+        if order > 0:
+            nw.append(Nw[1] * half_inv)
+        if order > 1:
+            nw.append((Nw[2] - 2 * nw[1] ** 2) * half_inv)
+        if order > 2:
+            nw.append((Nw[3] - 6 * nw[1] * nw[2]) * half_inv)
+        # k = n w / c: k^(m) = (m n^(m-1) + w n^(m)) / c
+        return [n * w / sc.c] + [(m * nw[m - 1] + w * nw[m]) / sc.c for m in range(1, order + 1)]
+
+    def group_delay(self, x, unit="wl"):
+        """ Group delay per unit length in s/m"""
+        return self.dispersion(x, unit, order=1)[1]
+
+    def gdd(self, x, unit="wl"):
+        """ Group delay dispersion per unit length in s^2/m"""
+        return self.dispersion(x, unit, order=2)[2]
+
+    def tod(self, x, unit="wl"):
+        """ Third order dispersion per unit length in s^3/m"""
+        return self.dispersion(x, unit, order=3)[3]
+
+
+def _sellmeier_pairs(c):
+    """ (c[1], c[2]), (c[3], c[4])... as two arrays"""
+    npairs = (len(c) - 1) // 2
+    return c[1:2 * npairs:2], c[2:2 * npairs + 1:2]
+
+
+_no_power_terms = (np.zeros(0), np.zeros(0))
+
+
+class SellmeierF1(SellmeierMaterial):
     """ Defines a dispersive material via a specific Sellmeier equation.
 
         This subclass supports materials with a Sellmeier equation of the
@@ -13,17 +136,13 @@ class SellmeierF1(BaseMaterial):
         This is formula 1 from refractiveindex.info [DispersionFormulas]_.
     """
 
-    def _func(self, x):
+    def _terms(self):
         c = self._coefficients
-        x2 = x * x
-        n2 = np.full_like(x, 1.0 + c[0])
-        for i in range(1, len(c) - 1, 2):
-            n2 += c[i] * x2 / (x2 - c[i + 1] * c[i + 1])
-        n2[n2 < 0] = 0
-        return np.sqrt(n2)
+        a, b = _sellmeier_pairs(c)
+        return 1.0 + c[0], (a, 2., b * b), _no_power_terms
 
 
-class SellmeierF2(BaseMaterial):
+class SellmeierF2(SellmeierMaterial):
     """ Defines a dispersive material via a specific Sellmeier equation.
 
         This subclass supports materials with a Sellmeier equation of the
@@ -34,17 +153,13 @@ class SellmeierF2(BaseMaterial):
         This is formula 2 from refractiveindex.info [DispersionFormulas]_.
     """
 
-    def _func(self, x):
+    def _terms(self):
         c = self._coefficients
-        x2 = x * x
-        n2 = np.full_like(x, 1.0 + c[0])
-        for i in range(1, c.size - 1, 2):
-            n2 += c[i] * x2 / (x2 - c[i + 1])
-        n2[n2 < 0] = 0
-        return np.sqrt(n2)
+        a, b = _sellmeier_pairs(c)
+        return 1.0 + c[0], (a, 2., b), _no_power_terms
 
 
-class RefractiveIndexDotInfo(BaseMaterial):
+class RefractiveIndexDotInfo(SellmeierMaterial):
     """ Defines a dispersive material via a specific Sellmeier equation.
 
         This subclass supports materials with a Sellmeier equation of the
@@ -55,19 +170,11 @@ class RefractiveIndexDotInfo(BaseMaterial):
         This is formula 4 from refractiveindex.info [DispersionFormulas]_.
     """
 
-    def _func(self, x):
+    def _terms(self):
         c = self._coefficients
-        x2 = x * x
-        n2 = np.full_like(x, c[0])
-
-        if len(c) > 1:
-            n2 += c[1] * x ** c[2] / (x2 - c[3] ** c[4])
-        if len(c) > 5:
-            n2 += c[5] * x ** c[6] / (x2 - c[7] ** c[8])
-        for i in range(9, len(c) - 1, 2):
-            n2 += c[i] * x ** c[i + 1]
-        n2[n2 < 0] = 0
-        return np.sqrt(n2)
+        rational = np.array([c[i:i + 4] for i in (1, 5) if len(c) > i]).reshape(-1, 4)
+        power = np.array([c[i:i + 2] for i in range(9, len(c) - 1, 2)]).reshape(-1, 2)
+        return c[0], (rational[:, 0], rational[:, 1], rational[:, 2] ** rational[:, 3]), (power[:, 0], power[:, 1])
 
 
 # Fused Silica dispersion with extended spectral range
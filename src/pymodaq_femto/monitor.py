@@ -0,0 +1,174 @@
+"""Online monitoring of a laser from consecutive traces
+
+Traces acquired continuously (for instance by the DAQ_Scan module of PyMoDAQ, see Retriever.start_monitoring) are
+submitted to an OnlineMonitor which processes and retrieves them in a background thread with a RetrievalPipeline. Each
+retrieval starts from the pulse retrieved on the previous trace ("Previous result" guess) with a reduced number of
+iterations, so that it keeps up with the acquisition. If traces arrive faster than they are retrieved, the pending
+queue is bounded and the oldest (stale) traces are dropped. The properties of the propagated pulses (FWHM, GDD, TOD,
+FOD) are kept as rolling time series.
+"""
+import collections
+import copy
+from dataclasses import dataclass
+import logging
+import threading
+import time
+
+import numpy as np
+
+from pymodaq_femto.pipeline import RetrievalPipeline
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MonitorRecord:
+    """ Properties of the pulse retrieved from one trace"""
+    timestamp: float  # acquisition time of the trace, as returned by time.time()
+    fwhm: float  # in fs
+    gdd: float  # in fs2
+    tod: float  # in fs3
+    fod: float  # in fs4
+    trace_error: float
+    iterations: int
+    stop_reason: str
+    warm_start: bool
+    latency: float  # from the submission of the trace to the end of its retrieval, in s
+
+
+series_fields = ["timestamp", "fwhm", "gdd", "tod", "fod", "trace_error", "iterations", "latency"]
+
+
+class OnlineMonitor:
+    """ Retrieve the traces submitted to the monitor in a background thread
+
+    Typical use::
+
+        monitor = OnlineMonitor(config, raw_spectrum, on_record=print)
+        monitor.start()
+        monitor.submit(raw_trace)  # for each new trace
+        ...
+        monitor.stop()
+        series = monitor.series()
+
+    Parameters
+    ----------
+    config: (PipelineConfig) configuration of the retrievals, the initial guess is forced to "Previous result"
+    raw_spectrum: (dict) the fundamental spectrum, see RetrievalPipeline.set_data
+    queue_size: (int) maximum number of pending traces, the oldest ones are dropped beyond
+    history: (int) maximum number of records kept in the time series
+    on_record: (callable) called from the worker thread as on_record(record, result) after each retrieval
+    """
+
+    def __init__(self, config, raw_spectrum, queue_size=1, history=1000, on_record=None):
+        config = copy.deepcopy(config)
+        config.retrieving.guess_type = "Previous result"
+        config.multistart.enabled = False
+        self.pipeline = RetrievalPipeline(config)
+        self.raw_spectrum = raw_spectrum
+        self.on_record = on_record
+        self.records = collections.deque(maxlen=history)
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self._pending = collections.deque(maxlen=max(1, queue_size))
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def submit(self, raw_trace, timestamp=None):
+        """ Enqueue a trace for retrieval, dropping the oldest pending trace if the queue is full
+
+        Parameters
+        ----------
+        raw_trace: (dict) the raw trace, see RetrievalPipeline.set_data
+        timestamp: (float) acquisition time of the trace, defaults to the current time
+        """
+        with self._condition:
+            self.submitted += 1
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append((raw_trace, time.time() if timestamp is None else timestamp, time.perf_counter()))
+            self._condition.notify()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Stop the worker thread, interrupting the current retrieval. Pending traces are discarded"""
+        with self._condition:
+            self._running = False
+            self._pending.clear()
+            self._condition.notify()
+        self.pipeline.stop()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                raw_trace, timestamp, submitted = self._pending.popleft()
+            try:
+                self.process(raw_trace, timestamp, submitted)
+            except Exception as e:
+                self.failed += 1
+                logger.exception(str(e))
+
+    def process(self, raw_trace, timestamp=None, submitted=None):
+        """ Process, retrieve and propagate one trace, and record the properties of the pulse
+
+        The spectrum is processed with the first trace only, all the traces being retrieved on the same grid.
+
+        Returns
+        -------
+        MonitorRecord
+        """
+        pipeline = self.pipeline
+        pipeline.set_data(raw_trace, self.raw_spectrum)
+        if pipeline.pnps is None:
+            pipeline.process_spectrum()
+        pipeline.process_trace()
+        result = pipeline.retrieve()
+        pipeline.propagate()
+        properties = pipeline.pulse_properties
+        record = MonitorRecord(
+            timestamp=time.time() if timestamp is None else timestamp,
+            fwhm=properties.fwhm,
+            gdd=properties.gdd,
+            tod=properties.tod,
+            fod=properties.fod,
+            trace_error=float(result.trace_error),
+            iterations=result.iterations,
+            stop_reason=result.stop_reason,
+            warm_start=result.warm_start,
+            latency=0. if submitted is None else time.perf_counter() - submitted,
+        )
+        with self._condition:
+            self.records.append(record)
+        if self.on_record is not None:
+            self.on_record(record, result)
+        return record
+
+    def series(self):
+        """ Time series of the records
+
+        Returns
+        -------
+        dict: arrays of the series_fields values of the records, from the oldest to the latest
+        """
+        with self._condition:
+            records = list(self.records)
+        return {name: np.array([getattr(record, name) for record in records], dtype=float) for name in series_fields}
@@ -0,0 +1,150 @@
+"""Ingestion of repeated scans stored in a single h5 file
+
+Acquisitions often hold many repetitions of the same d-scan, e.g. Scan000..ScanNNN under the Raw_datas group written
+by DScanCustomSaver. The trace nodes of all the scans are matched by a path pattern ("/Raw_datas/Scan*/...") and
+opened as a ScanStack of LazyH5Array, which can be:
+
+* averaged: the mean and the variance are accumulated scan by scan (Welford's algorithm), so that the memory does not
+  depend on the number of scans. The variance of the mean gives retrieval weights (see
+  RetrievalPipeline.process_trace),
+* median combined: computed by blocks of rows whose size is bounded for all the scans,
+* kept as a stack for per-scan retrievals.
+"""
+from fnmatch import fnmatch
+import re
+
+import numpy as np
+import tables
+
+from pymodaq_femto.h5io import LazyH5Array, read_h5_axes
+
+modes = ["mean", "median", "stack"]
+median_block_bytes = 256 * 2 ** 20  # memory of the blocks of all the scans read at once by the median
+
+
+def scan_pattern(node_path):
+    """ Pattern matching node_path in all the scans: the Scan group name (ScanXXX) is replaced by Scan*"""
+    return re.sub(r"/Scan\d+(?=/|$)", "/Scan*", node_path)
+
+
+def scan_name(node_path, index=0):
+    """ Name of the Scan group (ScanXXX) of node_path, scan{index} if there is none"""
+    match = re.search(r"/(Scan\d+)(?=/|$)", node_path)
+    return match.group(1) if match else f"scan{index:03d}"
+
+
+def match_nodes(h5file, pattern):
+    """ Sorted paths of the nodes of h5file matching pattern, whose components are fnmatch patterns
+
+    Parameters
+    ----------
+    h5file: (tables.File)
+    pattern: (str) e.g. "/Raw_datas/Scan*/Detector000/Data1D/Ch000/Data"
+    """
+    groups = [h5file.root]
+    for component in pattern.strip("/").split("/"):
+        groups = [child for group in groups if isinstance(group, tables.Group)
+                  for name, child in sorted(group._v_children.items()) if fnmatch(name, component)]
+    return [node._v_pathname for node in groups]
+
+
+class ScanStack:
+    """ Lazy stack of the traces of all the scans of a file matching a node path pattern
+
+    The file is opened once and the scans are only read when combined or indexed.
+
+    Parameters
+    ----------
+    fname: (str or Path) path of the h5 file
+    node_path: (str) path of the trace node of one of the scans, or a pattern (see match_nodes)
+    """
+
+    def __init__(self, fname, node_path):
+        self.fname = str(fname)
+        self.pattern = scan_pattern(node_path)
+        self.h5file = tables.open_file(self.fname, mode="r")
+        self.paths = match_nodes(self.h5file, self.pattern)
+        if not self.paths:
+            self.close()
+            raise ValueError(f"No node matching {self.pattern} in {self.fname}")
+        self.scans = [LazyH5Array(self.fname, path, self.h5file) for path in self.paths]
+        shapes = {scan.shape for scan in self.scans}
+        if len(shapes) > 1:
+            self.close()
+            raise ValueError(f"The scans matching {self.pattern} have different shapes: {shapes}")
+        self.shape = self.scans[0].shape
+        self.axes = read_h5_axes(self.h5file, self.paths[0])
+
+    def __len__(self):
+        return len(self.scans)
+
+    def __getitem__(self, index):
+        return self.scans[index]
+
+    def __iter__(self):
+        return iter(self.scans)
+
+    def mean_variance(self):
+        """ Mean and unbiased variance of the scans, accumulated one scan at a time
+
+        Returns
+        -------
+        tuple: (mean, variance) arrays, the variance is zero for a single scan
+        """
+        mean = np.zeros(self.shape)
+        m2 = np.zeros(self.shape)
+        for count, scan in enumerate(self.scans, start=1):
+            data = np.asarray(scan, dtype=float)
+            delta = data - mean
+            mean += delta / count
+            data -= mean
+            m2 += delta * data
+        return mean, m2 / max(1, len(self) - 1)
+
+    def median(self, max_bytes=None):
+        """ Median of the scans, computed by blocks of rows holding at most max_bytes for all the scans"""
+        max_bytes = median_block_bytes if max_bytes is None else max_bytes
+        row_bytes = len(self) * int(np.prod(self.shape[1:])) * 8
+        rows = max(1, max_bytes // max(1, row_bytes))
+        median = np.empty(self.shape)
+        for start in range(0, self.shape[0], rows):
+            block = np.stack([scan[start:start + rows] for scan in self.scans])
+            median[start:start + rows] = np.median(block, axis=0)
+        return median
+
+    def close(self):
+        if self.h5file.isopen:
+            self.h5file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_combined(fname, node_path, mode="mean"):
+    """ Combine all the scans of a file into a single trace
+
+    Parameters
+    ----------
+    fname: (str or Path) path of the h5 file
+    node_path: (str) path of the trace node of one of the scans, or a pattern (see match_nodes)
+    mode: (str) "mean" or "median"
+
+    Returns
+    -------
+    data: (ndarray) the combined trace
+    axes: (dict) the axes of the first scan ('x_axis', 'nav_00', ...)
+    variance: (ndarray) the variance of the mean (variance of the scans divided by their number), None for the
+              median or a single scan
+    """
+    with ScanStack(fname, node_path) as stack:
+        if mode == "mean":
+            data, variance = stack.mean_variance()
+            variance = variance / len(stack) if len(stack) > 1 else None
+        elif mode == "median":
+            data, variance = stack.median(), None
+        else:
+            raise ValueError(f"Unknown combination mode: {mode}, should be mean or median")
+        return data, stack.axes, variance
@@ -0,0 +1,221 @@
+"""Multi-start retrieval
+
+Iterative algorithms such as COPRA or PCGPA may get stuck in local minima on structured pulses. The multi-start mode
+runs several independent retrievals from random gaussian guesses with different seeds and durations over a pool of
+processes, streams the error of each iteration of each run, keeps the result with the lowest trace error and
+estimates the uncertainty of the retrieved spectral phase from its spread across the runs. The runs only send back
+their retrieved spectrum and metrics, the full result of the best run being rebuilt in the calling process.
+"""
+import copy
+import queue as queue_module
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import Manager
+from types import SimpleNamespace
+
+import numpy as np
+from pypret import lib
+
+from pymodaq_femto.pipeline import RetrievalPipeline, PipelineError, preprocess2
+
+
+def run_start(config, raw_trace, raw_spectrum, index, seed, fwhm, progress_queue=None, stop_event=None):
+    """ Process the data and run one retrieval from a random gaussian guess, executed by the pool workers
+
+    Parameters
+    ----------
+    config: (PipelineConfig) configuration of the pipeline
+    raw_trace: (dict) the raw trace, see RetrievalPipeline.set_data
+    raw_spectrum: (dict) the raw fundamental spectrum
+    index: (int) index of the run, sent back with the progress
+    seed: (int) seed of the random generator used for the initial guess
+    fwhm: (float) duration of the initial guess in fs
+    progress_queue: (Queue) receives (index, RetrievalProgress) tuples at each iteration
+    stop_event: (Event) the retrieval is stopped when set
+
+    Returns
+    -------
+    SimpleNamespace: pulse_retrieved, response_function (mu), trace_error, iterations and stop_reason of the run
+    """
+    config = copy.deepcopy(config)
+    config.retrieving.guess_type = "Random gaussian"
+    config.retrieving.fwhm = fwhm
+    np.random.seed(seed)
+
+    pipeline = RetrievalPipeline(config)
+    pipeline.set_data(raw_trace, raw_spectrum)
+    pipeline.process_spectrum()
+    pipeline.process_trace()
+
+    def on_iteration(progress):
+        if progress_queue is not None:
+            progress_queue.put((index, progress))
+        if stop_event is not None and stop_event.is_set():
+            pipeline.stop()
+
+    result = pipeline.retrieve(on_iteration=on_iteration)
+    mu = getattr(pipeline.retriever._retrieval_state, "mu", None)
+    return SimpleNamespace(
+        pulse_retrieved=np.asarray(result.pulse_retrieved),
+        response_function=None if mu is None else np.asarray(mu),
+        trace_error=float(result.trace_error),
+        iterations=result.iterations,
+        stop_reason=result.stop_reason,
+    )
+
+
+def phase_spread(results, threshold=1e-2):
+    """ Spread of the retrieved spectral phase across several retrievals of the same trace
+
+    The phases are taken relative to the first result, constant and linear terms (absolute phase and time delay,
+    which are not measured) are removed by an intensity weighted fit over the points where the spectral intensity of
+    the first result is above threshold. Note that for time symmetric processes such as SHG-FROG, runs converging to
+    the time reversed pulse will show up as a large spread.
+
+    Parameters
+    ----------
+    results: (list of SimpleNamespace) retrieval results on the same grid, the first one is the reference and must be
+             a full retrieval result (with a pnps attribute), the others only need pulse_retrieved
+    threshold: (float) relative spectral intensity below which the phase is not considered
+
+    Returns
+    -------
+    SimpleNamespace with attributes:
+        w: (ndarray) angular frequencies of the grid
+        phase_mean: (ndarray) mean phase, nan where the intensity is below threshold
+        phase_std: (ndarray) standard deviation of the phase, nan where the intensity is below threshold
+        rms_std: (float) intensity weighted rms of phase_std
+    """
+    reference = results[0].pulse_retrieved
+    w = results[0].pnps.ft.w
+    intensity = lib.abs2(reference)
+    intensity = intensity / intensity.max()
+    where = intensity > threshold
+    weights = intensity[where]
+    phase_ref = np.unwrap(np.angle(reference[where]))
+
+    residuals = []
+    for result in results:
+        dphase = np.unwrap(np.angle(result.pulse_retrieved[where] * np.conj(reference[where])))
+        z = np.polyfit(w[where], dphase, 1, w=np.sqrt(weights))
+        residuals.append(dphase - np.poly1d(z)(w[where]))
+    residuals = np.array(residuals)
+
+    phase_mean = np.full(w.shape, np.nan)
+    phase_std = np.full(w.shape, np.nan)
+    phase_mean[where] = phase_ref + np.mean(residuals, axis=0)
+    phase_std[where] = np.std(residuals, axis=0)
+    rms_std = np.sqrt(np.sum(weights * phase_std[where] ** 2) / np.sum(weights))
+    return SimpleNamespace(w=w, phase_mean=phase_mean, phase_std=phase_std, rms_std=rms_std)
+
+
+class MultiStartRetrieval:
+    """ Run the multi-start retrieval configured in pipeline.config.multistart on the data of a pipeline
+
+    Parameters
+    ----------
+    pipeline: (RetrievalPipeline) pipeline holding the raw data and the configuration, its result is set to the best
+              result of the runs
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.error_curves = []
+        self._stop_event = None
+
+    def guesses(self):
+        """ Seeds and initial durations (fs) of the runs"""
+        multistart = self.pipeline.config.multistart
+        n_starts = max(1, multistart.n_starts)
+        seeds = [int(seq.generate_state(1)[0]) for seq in np.random.SeedSequence(multistart.seed).spawn(n_starts)]
+        fwhms = np.linspace(multistart.fwhm_min, multistart.fwhm_max, n_starts)
+        return seeds, [float(fwhm) for fwhm in fwhms]
+
+    def run(self, on_progress=None, step_command=None):
+        """ Launch the runs over a pool of processes and wait for their completion
+
+        Parameters
+        ----------
+        on_progress: (callable) called as on_progress(index, progress) for each iteration of each run, progress being
+                     a RetrievalProgress
+        step_command: (callable) called regularly while waiting, e.g. to process GUI events
+
+        Returns
+        -------
+        SimpleNamespace: the result with the lowest trace error. Its multistart attribute holds the seeds, fwhms,
+                         trace_errors and error_curves of all the runs, the index of the best run and the phase spread
+                         (see phase_spread) over the successful runs
+        """
+        pipeline = self.pipeline
+        if pipeline.raw_trace is None or pipeline.raw_spectrum is None:
+            raise PipelineError("Please load a trace and a spectrum first!")
+        seeds, fwhms = self.guesses()
+        self.error_curves = [[] for _ in seeds]
+        workers = pipeline.config.multistart.workers
+        workers = None if workers <= 0 else workers
+
+        with Manager() as manager:
+            progress_queue = manager.Queue()
+            self._stop_event = manager.Event()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(run_start, pipeline.config, pipeline.raw_trace, pipeline.raw_spectrum,
+                                           index, seed, fwhm, progress_queue, self._stop_event)
+                           for index, (seed, fwhm) in enumerate(zip(seeds, fwhms))]
+                pending = set(futures)
+                while pending:
+                    done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    self._read_progress(progress_queue, on_progress)
+                    if step_command is not None:
+                        step_command()
+            self._read_progress(progress_queue, on_progress)
+            self._stop_event = None
+
+        results = []
+        errors = []
+        for future in futures:
+            try:
+                results.append(future.result())
+                errors.append(results[-1].trace_error)
+            except Exception as e:
+                results.append(None)
+                errors.append(np.nan)
+                failure = e
+        if all(result is None for result in results):
+            raise PipelineError(f"All the retrievals failed: {failure}")
+
+        best_index = int(np.nanargmin(errors))
+        best = self.rebuild(results[best_index])
+        successful = [best] + [result for ind, result in enumerate(results)
+                               if result is not None and ind != best_index]
+        best.multistart = SimpleNamespace(
+            seeds=seeds, fwhms=fwhms, trace_errors=errors, error_curves=self.error_curves, best_index=best_index,
+            phase=phase_spread(successful),
+        )
+        pipeline.result = best
+        return best
+
+    def rebuild(self, run):
+        """ Full retrieval result of a run (see run_start) on the data processed by the pipeline"""
+        pipeline = self.pipeline
+        if pipeline.pnps is None:
+            pipeline.process_spectrum()
+        if pipeline.trace_in is None:
+            pipeline.process_trace()
+        preprocess2(pipeline.trace_in, pipeline.pnps)
+        return pipeline.rebuild_result(run.pulse_retrieved, response_function=run.response_function,
+                                       trace_error=run.trace_error, iterations=run.iterations,
+                                       stop_reason=run.stop_reason)
+
+    def _read_progress(self, progress_queue, on_progress):
+        while True:
+            try:
+                index, progress = progress_queue.get_nowait()
+            except queue_module.Empty:
+                break
+            self.error_curves[index].append(progress.error)
+            if on_progress is not None:
+                on_progress(index, progress)
+
+    def stop(self):
+        """ Stop all the running retrievals, the best result obtained so far is returned by run"""
+        if self._stop_event is not None:
+            self._stop_event.set()
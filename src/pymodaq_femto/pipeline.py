@@ -0,0 +1,1330 @@
+"""Qt free retrieval pipeline
+
+This module holds the numerical part of the Retriever: building the Fourier grid, processing the fundamental spectrum
+and the non-linear trace, running the retrieval and propagating the retrieved pulse. It imports neither PyQt5,
+pyqtgraph nor pymodaq so that it can be used on servers and clusters. The Retriever user interface wraps a
+RetrievalPipeline whose configuration is built from its settings tree.
+"""
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields, asdict
+from pathlib import Path
+import queue
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import List, Tuple
+import xml.etree.ElementTree as ET
+import warnings
+
+import numpy as np
+import scipy.interpolate
+from scipy.fftpack import next_fast_len
+from pypret import FourierTransform, Pulse, lib, MeshData, random_gaussian
+from pypret.frequencies import wl2om, convert
+from pypret.retrieval.retriever import _RETRIEVER_CLASSES
+
+import pymodaq_femto.materials
+from pymodaq_femto import _PNPS_CLASSES
+from pymodaq_femto.cache import ResultCache, cache_key
+from pymodaq_femto.materials import FS, BK7
+from pymodaq_femto.pnps import cached_pnps, material_dispersion
+from pymodaq_femto.fourier import fourier_transform
+from pymodaq_femto.resample import cached_interpolation_matrix, resample
+
+guess_types = ["Random gaussian", "Fundamental spectrum", "Previous result"]
+methods_tmp = list(_PNPS_CLASSES.keys())
+methods_tmp.sort()
+methods = ['frog']
+methods.extend(methods_tmp)
+nlprocesses = list(_PNPS_CLASSES[methods[0]].keys())
+materials = OrderedDict(FS=FS, BK7=BK7)
+# real and complex types of the measured trace and of the retrieval arrays
+precisions = OrderedDict(double=(np.float64, np.complex128), single=(np.float32, np.complex64))
+
+
+class PipelineError(Exception):
+    """ Raised when a stage of the pipeline cannot be run with the current data or configuration"""
+    pass
+
+
+def pulse_from_spectrum(wavelength, spectrum, pulse=None):
+    """ Generates a pulse instance from a measured spectrum.
+    """
+    # scale to intensity over frequency, convert to amplitude and normalize
+    spectrum = spectrum * wavelength * wavelength
+    spectrum[spectrum < 0.0] = 0.0
+    spectrum = np.sqrt(spectrum + 0.0j)
+    spectrum /= spectrum.max()
+    # calculate angular frequencies
+    w = convert(wavelength, "wl", "om")
+    if pulse is None:
+        # create pulse parameters from the measured spectrum
+        # choose center wavelength as the mean of the intensity
+        w0 = lib.mean(w, lib.abs2(spectrum))
+        # choose simulation grid that encompasses the measured spectrum
+        dw = abs(np.mean(np.diff(w)))
+        N = 4 * next_fast_len(int(abs(w[-1] - w[0]) / dw))
+        ft = FourierTransform(N, dw=dw)
+        pulse = Pulse(ft, w0, unit="om")
+    # interpolate
+    pulse.spectrum = scipy.interpolate.interp1d(
+        w - pulse.w0, spectrum, bounds_error=False, fill_value=0.0
+    )(pulse.w)
+    return pulse
+
+
+def preprocess(trace, signal_range=None, dark_signal_range=None):
+    if dark_signal_range is not None:
+        dark_signal = trace.copy()
+        dark_signal.limit(dark_signal_range, axes=1)
+        dark_signal = np.median(dark_signal.data, axis=1)
+    if signal_range is not None:
+        trace.limit(*signal_range)
+    if dark_signal_range is not None:
+        # subtract dark counts for every spectrum separately
+        trace.data -= dark_signal[:, None]
+    # normalize
+    trace.normalize()
+    return trace
+
+
+# interpolate the measurement
+def preprocess2(trace, pnps):
+    """ Resample the trace on the process frequencies of pnps, converting it from wavelengths if needed
+
+    A trace on a wavelength axis is first scaled by the Jacobian of the wavelength to frequency conversion and
+    normalized, then the interpolation is a sparse matrix cached per (input axis, output axis) and applied to all the
+    rows at once (see resample.cached_interpolation_matrix). A trace already on pnps.process_w is left unchanged so
+    that the conversion is never applied twice.
+
+    Returns
+    -------
+    MeshData: the trace, modified in place
+    """
+    process_w = pnps.process_w
+    if trace.units[1] == "Hz" and np.array_equal(trace.axes[1], process_w):
+        return trace
+    frequency = trace.axes[1]
+    if trace.units[1] == "m":
+        # scaled in wavelength -> has to be corrected
+        trace.scale(frequency * frequency)
+        trace.normalize()
+        frequency = convert(frequency, "wl", "om")
+    matrix = cached_interpolation_matrix(frequency, process_w)
+    trace.data = resample(trace.data, matrix)
+    trace.axes[1] = process_w
+    trace.units[1] = "Hz"
+    return trace
+
+
+def resample_spectrum(spectrum, w, w_new):
+    """ Interpolate a complex spectrum on another frequency grid
+
+    The amplitude and the unwrapped phase are interpolated separately, so that fast phase variations (such as the
+    linear phase of a delayed pulse) are preserved on coarser grids. The spectrum is zero outside of the range of w.
+    """
+    amplitude = np.interp(w_new, w, np.abs(spectrum), left=0, right=0)
+    phase = np.interp(w_new, w, np.unwrap(np.angle(spectrum)))
+    return amplitude * np.exp(1j * phase)
+
+
+def substract_linear_phase(pulse):
+    phase = np.unwrap(np.angle(pulse.spectrum))
+    intensity = np.abs(pulse.spectrum)
+    z = np.polyfit(pulse.w, phase, 1)
+    pulse.spectrum *= np.exp(-1j * np.poly1d(z)(pulse.w))
+    return pulse
+
+
+def fit_pulse_phase(pulse, phase_blanking_threshold, order):
+    phase = np.unwrap(np.angle(pulse.spectrum))
+    amp = np.abs(pulse.spectrum)
+
+    # delta = 100e-9
+    x, phase = lib.mask_phase(pulse.w, amp, phase, phase_blanking_threshold)
+    # fitarea = (pulse.wl > pulse.wl0-delta/2)&(pulse.wl < pulse.wl0+delta/2)
+    # z = np.polyfit(pulse.w[fitarea], phase[fitarea], order)
+    z = np.polyfit(x.compressed(), phase.compressed(), order)
+    return z
+
+
+def mask(x, y, where, **kwargs):
+    y = scipy.interpolate.interp1d(x[~where], y[~where], **kwargs)(x)
+    return y
+
+
+
+
+# method of pypret.Retriever which overwrites the _error_vector method for a modified one which uses
+# an energy dependent weighting to account for unknown spectral response
+def nonuniform_error_vector(self, Tmn, store=True):
+    """ Modified to allow for energy dependent weights
+
+    The squared weights, the mask of the valid columns and the edges of the response function only depend on the
+    measurement and are computed once per retrieval. The products are computed once in preallocated work arrays and
+    reduced along both axes from the same buffers.
+    """
+    # rename
+    rs = self._retrieval_state
+    Tmn_meas = self.Tmn_meas
+    cache = _error_vector_cache(self, Tmn)
+    w2 = cache.w2
+    mask = cache.mask
+
+    # mu is vector if spectral response is unknown
+    np.multiply(Tmn, w2, out=cache.Tw2)
+    np.multiply(Tmn_meas, cache.Tw2, out=cache.product)
+    numerator = cache.product.sum(axis=0)
+    np.multiply(Tmn, cache.Tw2, out=cache.product)
+    denominator = cache.product.sum(axis=0)
+    mean_mu = numerator.sum() / denominator.sum()
+    mu = np.full(self.N, mean_mu)
+    mu[mask] = numerator[mask] / denominator[mask]
+    # extend the edges of the response function
+    mu[:cache.idx1] = mu[cache.idx1]
+    mu[cache.idx2:] = mu[cache.idx2]
+
+    # store intermediate results in current retrieval state
+    if store:
+        rs.mu = mu
+        rs.Tmn = Tmn
+        rs.Smk = self.pnps.Smk
+    r = np.multiply(mu, Tmn)
+    np.subtract(Tmn_meas, r, out=r)
+    r *= self._weights
+    return np.ravel(r)
+
+
+# method of pypret.Retriever which overwrites the _error_vector method when the spectral response is known, e.g. the
+# response retrieved on a previous shot: only its scale is optimized
+def fixed_response_error_vector(self, Tmn, store=True):
+    """ Error vector with the spectral response self._response (a vector over the process frequencies)"""
+    rs = self._retrieval_state
+    model = Tmn * self._response
+    w2 = self._weights * self._weights
+    mu = np.sum(self.Tmn_meas * model * w2) / np.sum(model * model * w2) * self._response
+    if store:
+        rs.mu = mu
+        rs.Tmn = Tmn
+        rs.Smk = self.pnps.Smk
+    r = np.multiply(mu, Tmn)
+    np.subtract(self.Tmn_meas, r, out=r)
+    r *= self._weights
+    return np.ravel(r)
+
+
+def _error_vector_cache(self, Tmn):
+    """ Quantities of nonuniform_error_vector depending only on the measurement, and its work arrays
+
+    They are stored on the retriever and computed again if the measurement, the weights or the shape or type of
+    the trace change.
+    """
+    cache = getattr(self, "_nonuniform_cache", None)
+    if (cache is None or cache.Tmn_meas is not self.Tmn_meas or cache.weights is not self._weights
+            or cache.Tw2.shape != Tmn.shape or cache.Tw2.dtype != Tmn.dtype):
+        w2 = self._weights * self._weights
+        mask = (w2.sum(axis=0) > 0.0) & (  # weights equal to zero
+            self.Tmn_meas.sum(axis=0) > 0.0
+        )  # measurement is zero
+        cache = SimpleNamespace(
+            Tmn_meas=self.Tmn_meas,
+            weights=self._weights,
+            w2=w2,
+            mask=mask,
+            idx1=lib.find(mask, lambda x: x),
+            idx2=lib.find(mask, lambda x: x, n=-1),
+            Tw2=np.empty(Tmn.shape, dtype=Tmn.dtype),
+            product=np.empty(Tmn.shape, dtype=Tmn.dtype),
+        )
+        self._nonuniform_cache = cache
+    return cache
+
+
+def local_batch_update(self, En, Tmn, batch_size):
+    """ Mini-batch version of the COPRA local iteration
+
+    Trace rows are visited in a random order, as in the sequential local iteration, but batch_size rows are projected
+    at once and their gradients are applied as a single update of the spectrum.
+
+    Parameters
+    ----------
+    En: (1d-array) the current pulse spectrum
+    Tmn: (2d-array) running estimate of the trace, filled in place
+    batch_size: (int) number of trace rows processed per update
+
+    Returns
+    -------
+    1d-array: the updated spectrum
+    """
+    pnps = self.pnps
+    rs = self._retrieval_state
+    order = np.random.permutation(np.arange(self.M))
+    for start in range(0, self.M, batch_size):
+        rows = order[start:start + batch_size]
+        p = self.parameter[rows]
+        Tmn[rows, :] = pnps.calculate(En, p)
+        Smk = np.atleast_2d(pnps.Smk)
+        Smk2 = self._project(self.Tmn_meas[rows, :] / rs.mu, Smk)
+        nablaZnm = np.atleast_2d(pnps.gradient(Smk2, p))
+        # calculate the step sizes, one per row
+        Zm = np.sum(lib.abs2(Smk2 - Smk), axis=1)
+        gradient_norm = np.max(np.sum(lib.abs2(nablaZnm), axis=1))
+        if gradient_norm > rs.current_max_gradient:
+            rs.current_max_gradient = gradient_norm
+        gamma = Zm / max(rs.current_max_gradient, rs.previous_max_gradient)
+        # update the spectrum with the summed contributions of the batch
+        En -= np.sum(gamma[:, None] * nablaZnm, axis=0)
+        En = np.abs(self.initial_guess) * np.exp(1j * np.angle(En))
+    return En
+
+
+# Optional modified retriever step calculation that keeps spectral intensity fixed
+def retrieve_step_fix_spectrum(self, iteration, En):
+    """ Perform a single COPRA step.
+
+        Parameters
+        ----------
+        iteration : int
+            The current iteration number - mainly for logging.
+        En : 1d-array
+            The current pulse spectrum.
+        """
+    # local rename
+    ft = self.ft
+    options = self.options
+    pnps = self.pnps
+    rs = self._retrieval_state
+    Tmn_meas = self.Tmn_meas
+    # current gradient -> last gradient
+    rs.previous_max_gradient = rs.current_max_gradient
+    rs.current_max_gradient = 0.0
+    # switch iteration
+    if rs.steps_since_improvement == 10:
+        rs.mode = "global"
+    # local iteration
+    if rs.mode == "local":
+        # running estimate for the trace
+        Tmn = np.zeros((self.M, self.N), dtype=Tmn_meas.dtype)
+        batch_size = getattr(options, "local_batch_size", 1)
+        if batch_size > 1:
+            En = local_batch_update(self, En, Tmn, batch_size)
+        else:
+            for m in np.random.permutation(np.arange(self.M)):
+                p = self.parameter[m]
+                Tmn[m, :] = pnps.calculate(En, p)
+                Smk2 = self._project(Tmn_meas[m, :] / rs.mu, pnps.Smk)
+                nablaZnm = pnps.gradient(Smk2, p)
+                # calculate the step size
+                Zm = lib.norm2(Smk2 - pnps.Smk)
+                gradient_norm = lib.norm2(nablaZnm)
+                if gradient_norm > rs.current_max_gradient:
+                    rs.current_max_gradient = gradient_norm
+                gamma = Zm / max(rs.current_max_gradient, rs.previous_max_gradient)
+                # update the spectrum
+                En -= gamma * nablaZnm
+                En = np.abs(self.initial_guess) * np.exp(1j * np.angle(En))
+        # Tmn is only an approximation as En changed in the iteration!
+        rs.approximate_error = True
+        R = self._R(Tmn)  # updates rs.mu!!!
+    # global iteration
+    elif rs.mode == "global":
+        Tmn = pnps.calculate(En, self.parameter)
+        r = self._r(Tmn)
+        R = self._Rr(r)  # updates rs.mu!!!
+        rs.approximate_error = False
+        # gradient descent w.r.t. Smk
+        w2 = self._weights * self._weights
+        gradrmk = (
+            -4
+            * ft.dt
+            / (ft.dw * lib.twopi)
+            * ft.backward(rs.mu * ft.forward(pnps.Smk) * (Tmn_meas - rs.mu * Tmn) * w2)
+        )
+        etar = options.alpha * r / lib.norm2(gradrmk)
+        Smk2 = pnps.Smk - etar * gradrmk
+        # gradient descent w.r.t. En
+        nablaZn = pnps.gradient(Smk2, self.parameter).sum(axis=0)
+        # calculate the step size
+        Z = lib.norm2(Smk2 - pnps.Smk)
+        etaz = options.alpha * Z / lib.norm2(nablaZn)
+        # update the spectrum
+        En -= etaz * nablaZn
+        En = np.abs(self.initial_guess) * np.exp(1j * np.angle(En))
+    return R, En
+
+
+
+def spectrum_center(x, y):
+    """ First moment of y over x, used as central wavelength of spectra and traces"""
+    return np.sum(x * y) / np.sum(y)
+
+
+def xml_values(element):
+    """ Convert a xml element written by pymodaq's ioxml.parameter_to_xml_string into a nested dict of values
+
+    Group elements become dicts keyed by the children names, other elements are converted according to their type
+    attribute.
+    """
+    param_type = element.get("type", "group")
+    if param_type == "group" or len(element) > 0:
+        return {child.tag: xml_values(child) for child in element}
+    text = element.text
+    if text is None:
+        return None
+    if param_type in ("float", "slide"):
+        return float(text)
+    elif param_type == "int":
+        return int(float(text))
+    elif param_type in ("bool", "bool_push", "led"):
+        return text in ("1", "True", "true")
+    return text
+
+
+def tree_values(tree):
+    """ Nested dict of values from a pyqtgraph Parameter tree, dicts are returned as is"""
+    if tree is None or isinstance(tree, dict):
+        return tree
+    return {child.name(): tree_values(child) if child.hasChildren() else child.value() for child in tree.children()}
+
+
+def _get(values, *path, default=None):
+    for name in path:
+        if not isinstance(values, dict) or name not in values or values[name] is None:
+            return default
+        values = values[name]
+    return values
+
+
+def _coerce(value, value_type):
+    if value_type is bool and isinstance(value, str):
+        return value in ("1", "True", "true")
+    if value_type in (int, float, str, bool):
+        return value_type(float(value)) if value_type is int else value_type(value)
+    return value
+
+
+def _from_values(cls, values):
+    """ Instantiate the dataclass cls using the entries of values matching its field names
+
+    Values are converted to the type of the fields as list parameters are saved as text in xml files.
+    """
+    kwargs = {f.name: _coerce(values[f.name], f.type) for f in fields(cls)
+              if values is not None and values.get(f.name) is not None}
+    return cls(**kwargs)
+
+
+@dataclass
+class DataInConfig:
+    wl0: float = 0.  # central wavelength of the trace in nm, computed from the trace if 0
+    wl_scaling: float = 1.  # from the trace wavelength values to meters
+    param_scaling: float = 1.  # from the trace parameter values to seconds, meters (dscan) or radians (miips)
+
+
+@dataclass
+class AlgoConfig:
+    method: str = methods[0]
+    nlprocess: str = nlprocesses[0]
+    material: str = "FS"  # dscan only
+    alpha: float = 1.  # miips only, in rad
+    gamma: float = 10.  # miips only, in Hz
+
+
+@dataclass
+class GridConfig:
+    wl0: float = 750.  # in nm
+    npoints: int = 1024
+    time_resolution: float = 1.  # in fs
+    fft_backend: str = "numpy"  # one of fourier.backends
+    fft_workers: int = 0  # number of threads, 0 for the number of CPUs
+
+
+@dataclass
+class ProcessingConfig:
+    crop_trace: bool = False
+    x0: int = 0  # ROI in pixels of the raw trace
+    y0: int = 0
+    width: int = 10
+    height: int = 10
+    dosubstract: bool = False
+    wl0: float = 0.  # trace background range in nm
+    wl1: float = 10.
+    dosubstract_spectrum: bool = False
+    wl0_s: float = 0.  # spectrum background range in nm
+    wl1_s: float = 10.
+    spectrum_masks: List[Tuple[float, float]] = field(default_factory=list)  # wavelength ranges (m) to interpolate
+
+    @classmethod
+    def from_values(cls, values):
+        flat = dict()
+        for group in ("ROIselect", "linearselect", "linearselect_spectrum"):
+            flat.update(_get(values, group, default={}))
+        return _from_values(cls, flat)
+
+
+@dataclass
+class RetrievingConfig:
+    algo_type: str = "copra"
+    verbose: bool = True
+    max_iter: int = 30
+    uniform_response: bool = True
+    fix_spectrum: bool = False
+    local_batch_size: int = 1
+    precision: str = "double"  # one of precisions
+    variance_weights: bool = True  # weight the trace by the inverse of its noise when the variance is known
+    guess_type: str = "Random gaussian"  # one of guess_types
+    warm_max_iter: int = 10  # iterations when starting from the previous result, 0 for max_iter
+    reuse_response: bool = False  # fix the spectral response to the one retrieved on the previous result
+    use_cache: bool = False  # return the stored result of a previous retrieval of the same data with the same settings
+    fwhm: float = 5.  # initial guess duration in fs
+    phase_amp: float = 0.1  # in rad
+
+    @classmethod
+    def from_values(cls, values):
+        flat = dict(values)
+        flat.update(_get(values, "pulse_guess", default={}))
+        return _from_values(cls, flat)
+
+
+@dataclass
+class ConvergenceConfig:
+    plateau_window: int = 0  # number of iterations, 0 to disable
+    plateau_tolerance: float = 1e-3  # relative decrease of the error over the window below which it has converged
+    error_target: float = 0.  # 0 to disable
+    time_budget: float = 0.  # in s, 0 to disable
+
+    def stop_reason(self, errors, elapsed):
+        """ Reason to stop the retrieval given the errors of the previous iterations and the elapsed time (s), None
+        if it should continue"""
+        if self.error_target > 0 and errors[-1] <= self.error_target:
+            return "error target"
+        if self.time_budget > 0 and elapsed >= self.time_budget:
+            return "time budget"
+        if self.plateau_window > 0 and len(errors) > self.plateau_window:
+            previous = errors[-self.plateau_window - 1]
+            if previous - min(errors[-self.plateau_window:]) <= self.plateau_tolerance * previous:
+                return "plateau"
+        return None
+
+
+@dataclass
+class MultiStartConfig:
+    enabled: bool = False
+    n_starts: int = 4
+    fwhm_min: float = 5.  # range of the initial guess durations in fs
+    fwhm_max: float = 20.
+    workers: int = 0  # 0 for the number of CPUs
+    seed: int = 0
+
+
+@dataclass
+class MultiResolutionConfig:
+    enabled: bool = False
+    schedule: str = "4, 2"  # decimation factors of the grid of the coarse levels, the full grid is retrieved last
+    decimate_rows: bool = True  # also keep one trace row out of the decimation factor on the coarse levels
+    min_rows: int = 16  # minimum number of trace rows of the coarse levels
+    max_iter: int = 0  # iterations of each coarse level, 0 for the iterations of the retrieval
+
+    def factors(self):
+        """ Decimation factors of the coarse levels from the coarsest one, factors below 2 are ignored"""
+        factors = {int(float(factor)) for factor in re.split(r"[,;\s]+", self.schedule.strip()) if factor}
+        return sorted((factor for factor in factors if factor > 1), reverse=True)
+
+
+@dataclass
+class PropagationConfig:
+    material1: str = "Air"
+    thickness1: float = 0.  # in mm
+    material2: str = "FS"
+    thickness2: float = 0.
+    prop_oversampling: int = 4
+    dt_fwhm: float = 0.5  # resolution of the FWHM calculation in fs
+    fit_threshold: float = 0.1
+
+
+@dataclass
+class PulseProperties:
+    fwhm: float = 0.  # in fs
+    gdd: float = 0.  # in fs2
+    tod: float = 0.  # in fs3
+    fod: float = 0.  # in fs4
+
+
+@dataclass
+class PipelineConfig:
+    data_in: DataInConfig = field(default_factory=DataInConfig)
+    algo: AlgoConfig = field(default_factory=AlgoConfig)
+    grid: GridConfig = field(default_factory=GridConfig)
+    processing: ProcessingConfig = field(default_factory=ProcessingConfig)
+    retrieving: RetrievingConfig = field(default_factory=RetrievingConfig)
+    convergence: ConvergenceConfig = field(default_factory=ConvergenceConfig)
+    multistart: MultiStartConfig = field(default_factory=MultiStartConfig)
+    multiresolution: MultiResolutionConfig = field(default_factory=MultiResolutionConfig)
+    propagation: PropagationConfig = field(default_factory=PropagationConfig)
+
+    @classmethod
+    def from_settings(cls, settings, prop_settings=None):
+        """ Build the configuration from the Retriever settings trees
+
+        Parameters
+        ----------
+        settings: (Parameter or dict) the Retriever settings or the nested dict of their values
+        prop_settings: (Parameter or dict) the Retriever propagation settings or the nested dict of their values
+        """
+        values = tree_values(settings)
+        prop_values = tree_values(prop_settings)
+        return cls(
+            data_in=_from_values(DataInConfig, _get(values, "data_in_info", "trace_in_info", default={})),
+            algo=_from_values(AlgoConfig, _get(values, "algo", default={})),
+            grid=_from_values(GridConfig, _get(values, "processing", "grid_settings", default={})),
+            processing=ProcessingConfig.from_values(_get(values, "processing", default={})),
+            retrieving=RetrievingConfig.from_values(_get(values, "retrieving", default={})),
+            convergence=_from_values(ConvergenceConfig, _get(values, "retrieving", "convergence", default={})),
+            multistart=_from_values(MultiStartConfig, _get(values, "retrieving", "multistart", default={})),
+            multiresolution=_from_values(MultiResolutionConfig,
+                                         _get(values, "retrieving", "multiresolution", default={})),
+            propagation=_from_values(PropagationConfig, _get(prop_values, "materials", default={})),
+        )
+
+    @classmethod
+    def from_xml(cls, xml):
+        """ Build the configuration from settings saved as xml
+
+        Parameters
+        ----------
+        xml: (str, bytes or Path) xml content or path of a xml file. It can be the Retriever settings tree alone or
+             the "All_settings" node written by Retriever.save_data which also contains the propagation settings
+        """
+        if isinstance(xml, Path) or (isinstance(xml, str) and not xml.lstrip().startswith("<")):
+            root = ET.parse(str(xml)).getroot()
+        else:
+            root = ET.fromstring(xml)
+        values = xml_values(root)
+        if "dataIN_settings" in values:
+            return cls.from_settings(values["dataIN_settings"], values.get("propagation_settings"))
+        return cls.from_settings(values)
+
+
+@dataclass
+class RetrievalProgress:
+    """ State of a retrieval after one iteration"""
+    iteration: int
+    mode: str  # 'local' or 'global' for copra, empty for the other algorithms
+    error: float  # trace error R
+    mu_mean: float  # statistics of the trace scaling factor, a vector if the spectral response is not uniform
+    mu_min: float
+    mu_max: float
+    max_gradient: float  # copra only, nan otherwise
+    elapsed: float  # time since the start of the retrieval in s
+    factor: int = 1  # grid decimation factor of the multiresolution level, 1 for the full grid
+
+
+def _notifying_step(retriever, on_iteration, start, factor=1):
+    """ Wrap the _retrieve_step method of a retriever so that on_iteration is called with a RetrievalProgress after
+    each step"""
+    retrieve_step = retriever._retrieve_step
+
+    def step(iteration, En):
+        R, En = retrieve_step(iteration, En)
+        rs = retriever._retrieval_state
+        mu = np.atleast_1d(getattr(rs, "mu", np.nan))
+        on_iteration(RetrievalProgress(
+            iteration=iteration,
+            mode=getattr(rs, "mode", ""),
+            error=float(R),
+            mu_mean=float(np.mean(mu)),
+            mu_min=float(np.min(mu)),
+            mu_max=float(np.max(mu)),
+            max_gradient=float(getattr(rs, "current_max_gradient", np.nan)),
+            elapsed=time.perf_counter() - start,
+            factor=factor,
+        ))
+        return R, En
+    return step
+
+
+class RetrievalPipeline:
+    """ Numerical stages of the Retriever without any user interface
+
+    Typical use::
+
+        pipeline = RetrievalPipeline(PipelineConfig.from_xml('settings.xml'))
+        pipeline.set_data(raw_trace, raw_spectrum)
+        pipeline.process_spectrum()
+        pipeline.process_trace()
+        result = pipeline.retrieve()
+        pulse = pipeline.propagate()
+
+    Parameters
+    ----------
+    config: (PipelineConfig)
+    """
+
+    def __init__(self, config=None):
+        if config is None:
+            config = PipelineConfig()
+        self.config = config
+        self.raw_trace = None
+        self.raw_spectrum = None
+        self.ft = None
+        self.pulse_in = None
+        self.spectrum_in = None  # copy of the processed spectrum of pulse_in, identifies it in the result cache
+        self.pnps = None
+        self.trace_in = None
+        self.trace_weights = None
+        self.retriever = None
+        self.stop_reason = None
+        self._retrieving = False
+        self._stop_requested = False  # set by stop during a retrieval, also between its levels
+        self._retrieve_exception = None
+        self.result = None
+        self.warm_start = None  # spectrum, grid and spectral response of the last retrieval
+        self.cache = None  # ResultCache, the default one is created when first used
+        self.propagated_pulse = None
+        self.phase_polynomial = None
+        self.pulse_properties = PulseProperties()
+
+    def set_data(self, raw_trace=None, raw_spectrum=None):
+        """ Set the raw data to be processed
+
+        Parameters
+        ----------
+        raw_trace: (dict) with data (2D array), x_axis (dict with a data key, wavelengths in m) and y_axis (dict with
+                   a data key, parameter values) keys, and optionally a variance key (2D array, variance of the data
+                   e.g. of the mean of several scans, see multiscan.load_combined) used as retrieval weights
+        raw_spectrum: (dict) with data (1D array) and x_axis (dict with a data key, wavelengths in m) keys
+        """
+        if raw_trace is not None:
+            self.raw_trace = raw_trace
+        if raw_spectrum is not None:
+            self.raw_spectrum = raw_spectrum
+
+    def result_key(self):
+        """ Key of the retrieval of the processed trace in the result cache (see cache.cache_key)
+
+        It is computed from the full configuration (spectrum masks included) and from the arrays the retrieval
+        starts from: the processed trace and its axes, the weights, the fundamental spectrum as processed by
+        process_spectrum (not as possibly modified since in pulse_in) and its grid.
+
+        Returns
+        -------
+        str: the key
+        """
+        if self.trace_in is None or self.pulse_in is None:
+            raise PipelineError("Please process the spectrum and the trace first!")
+        spectrum = self.spectrum_in if self.spectrum_in is not None else self.pulse_in.spectrum
+        arrays = dict(trace=self.trace_in.data, parameter=self.trace_in.axes[0], process_w=self.trace_in.axes[1],
+                      weights=self.trace_weights, spectrum=spectrum, w=self.ft.w)
+        return cache_key(arrays, asdict(self.config))
+
+    def result_cache(self):
+        """ ResultCache used by retrieve, None if the retrieval is not cached
+
+        Retrievals are cached if the use_cache option is set, except those starting from the previous result which
+        depend on more than the data and settings.
+        """
+        if not self.config.retrieving.use_cache or self.warm_started():
+            return None
+        if self.cache is None:
+            self.cache = ResultCache()
+        return self.cache
+
+    def rebuild_result(self, pulse_retrieved, trace_retrieved=None, response_function=None, cached=False,
+                       **metrics):
+        """ Retrieval result on the processed trace from a retrieved spectrum, e.g. read from the result cache (see
+        ResultCache.get) or sent back by a multi-start run
+
+        Parameters
+        ----------
+        pulse_retrieved: (ndarray) the retrieved spectrum on the grid of the pipeline
+        trace_retrieved: (ndarray) the retrieved trace, computed from the spectrum if None
+        response_function: (float or ndarray) the spectral response mu scaling the computed trace
+        cached: (bool) whether the result was read from the result cache
+        metrics: trace_error, iterations and stop_reason of the retrieval
+
+        Returns
+        -------
+        SimpleNamespace: with the attributes of the results of pypret retrievers used by the Retriever
+        """
+        if trace_retrieved is None:
+            trace_retrieved = self.pnps.calculate(pulse_retrieved.astype(self.complex_type), self.trace_in.axes[0])
+            if response_function is not None:
+                trace_retrieved = trace_retrieved * response_function
+        weights = self.trace_weights if self.trace_weights is not None else np.ones_like(self.trace_in.data)
+        return SimpleNamespace(
+            parameter=self.trace_in.axes[0],
+            measurement=self.trace_in,
+            pnps=self.pnps,
+            pulse_retrieved=pulse_retrieved,
+            trace_input=self.trace_in.data,
+            trace_retrieved=trace_retrieved,
+            weights=weights,
+            response_function=response_function,
+            warm_start=False,
+            cached=cached,
+            **metrics,
+        )
+
+    @property
+    def real_type(self):
+        """ Type of the measured trace given the configured precision"""
+        return self._precision[0]
+
+    @property
+    def complex_type(self):
+        """ Type of the spectra and masks given the configured precision"""
+        return self._precision[1]
+
+    @property
+    def _precision(self):
+        precision = self.config.retrieving.precision
+        if precision not in precisions:
+            raise PipelineError(f"Unknown precision: {precision}, should be one of {list(precisions)}")
+        return precisions[precision]
+
+    @property
+    def trace_wl0(self):
+        """ Central wavelength (m) of the raw trace: the configured data_in.wl0 (the Wl0 trace info of the Retriever),
+        computed from the trace (first moment of its wavelength marginal) if it is not set"""
+        if self.config.data_in.wl0 > 0:
+            return self.config.data_in.wl0 * 1e-9
+        return spectrum_center(self.raw_trace["x_axis"]["data"], np.sum(self.raw_trace["data"], 0))
+
+    def generate_ft_grid(self, npoints=None):
+        """ Fourier grid of the configuration, stored in ft unless npoints (default: grid.npoints) is given"""
+        grid = self.config.grid
+        ft = fourier_transform(grid.npoints if npoints is None else npoints, grid.time_resolution * 1e-15,
+                               w0=wl2om(-grid.wl0 * 1e-9 - 300e-9), backend=grid.fft_backend,
+                               workers=grid.fft_workers)
+        if npoints is None:
+            self.ft = ft
+        return ft
+
+    def process_spectrum(self):
+        """ Build the fundamental pulse from the raw spectrum and the PNPS instance of the method
+
+        Returns
+        -------
+        Pulse: the fundamental pulse
+        """
+        if self.raw_spectrum is None:
+            raise PipelineError("Please load a spectrum first!")
+        if self.raw_trace is None:
+            raise PipelineError("Please load a trace first!")
+        self.generate_ft_grid()
+        if len(np.unique(self.ft.w)) == 1:
+            raise PipelineError("Frequency axis only has one point. Check time resolution and Npoints.")
+
+        nlprocess = self.config.algo.nlprocess
+        processing = self.config.processing
+        wl0 = self.trace_wl0
+        spectrum = self.raw_spectrum["data"]
+        wavelength = self.raw_spectrum["x_axis"]["data"]
+
+        if "shg" in nlprocess:
+            wl0real = 2 * wl0
+        elif "thg" in nlprocess:
+            wl0real = 3 * wl0
+        else:
+            wl0real = wl0
+
+        pulse_in = Pulse(self.ft, wl0real)
+
+        for wl_range in processing.spectrum_masks:
+            spectrum = mask(wavelength, spectrum, (wl_range[0] <= wavelength) & (wavelength <= wl_range[1]))
+
+        if processing.dosubstract_spectrum:
+            idx1 = np.argmin(np.abs(wavelength - processing.wl0_s * 1e-9))
+            idx2 = np.argmin(np.abs(wavelength - processing.wl1_s * 1e-9))
+            if idx1 > idx2:
+                idx1, idx2 = idx2, idx1
+            spectrum = spectrum - np.mean(spectrum[idx1:idx2])
+
+        self.pulse_in = pulse_from_spectrum(wavelength, spectrum, pulse=pulse_in)
+        self.spectrum_in = np.array(self.pulse_in.spectrum)
+        self.pnps = self._pnps(self.pulse_in)
+        return self.pulse_in
+
+    def _pnps(self, pulse):
+        algo = self.config.algo
+        material = materials[algo.material] if algo.method == "dscan" else None
+        return cached_pnps(pulse, algo.method, algo.nlprocess, material=material, alpha=algo.alpha, gamma=algo.gamma)
+
+    def get_trace_in(self, rows=slice(None), columns=slice(None), key="data"):
+        """ MeshData of the raw trace, or of a block of it
+
+        Parameters
+        ----------
+        rows: (slice) of the parameter axis
+        columns: (slice) of the wavelength axis. Only the block is read when the raw data is a lazy array (see
+                 h5io.LazyH5Array)
+        key: (str) entry of the raw trace holding the data ("data" or "variance")
+        """
+        method = self.config.algo.method
+        if method == "dscan":
+            label = "Insertion"
+            unit = "m"
+        elif method == "miips":
+            label = "Phase"
+            unit = "rad"
+        else:
+            label = "Delay"
+            unit = "s"
+
+        return MeshData(
+            np.asarray(self.raw_trace[key][rows, columns]),
+            self.raw_trace["y_axis"]["data"][rows],
+            self.raw_trace["x_axis"]["data"][columns],
+            labels=[label, "wavelength"],
+            units=[unit, "m"],
+        )
+
+    def roi_limits(self):
+        """ Parameter and wavelength limits of the ROI of the processing configuration, None if not cropped"""
+        processing = self.config.processing
+        if not processing.crop_trace:
+            return None
+        # same pixel to axis conversion as the trace viewer
+        wl = self.raw_trace["x_axis"]["data"]
+        parameter = self.raw_trace["y_axis"]["data"]
+        xlim = wl[0] + (wl[-1] - wl[0]) / (len(wl) - 1) * np.array([processing.x0, processing.x0 + processing.width])
+        ylim = parameter[0] + (parameter[-1] - parameter[0]) / (len(parameter) - 1) * np.array(
+            [processing.y0, processing.y0 + processing.height])
+        return tuple(ylim), tuple(xlim)
+
+    def _read_block(self):
+        """ Rows and columns of the raw trace used by process_trace: those of the ROI (and of the background range)"""
+        limits = self.roi_limits()
+        if limits is None:
+            return slice(None), slice(None)
+        processing = self.config.processing
+        ylim, xlim = limits
+        if processing.dosubstract:
+            xlim = xlim + (processing.wl0 * 1e-9, processing.wl1 * 1e-9)
+
+        def span(axis, lim):
+            inside = np.flatnonzero((axis >= np.min(lim)) & (axis <= np.max(lim)))
+            return slice(int(inside[0]), int(inside[-1]) + 1) if inside.size else slice(None)
+
+        return span(self.raw_trace["y_axis"]["data"], ylim), span(self.raw_trace["x_axis"]["data"], xlim)
+
+    def process_trace(self, trace_in=None):
+        """ Substract the background, crop and interpolate the trace on the PNPS frequency grid
+
+        If the variance_weights option is set and the raw trace holds a variance, the retrieval weights are computed
+        from it (see process_weights).
+
+        Parameters
+        ----------
+        trace_in: (MeshData) the trace to process, defaults to the raw trace
+
+        Returns
+        -------
+        MeshData: the processed trace
+        """
+        if self.raw_trace is None and trace_in is None:
+            raise PipelineError("Please load a trace first!")
+        if self.pnps is None:
+            raise PipelineError("Please process the spectrum first")
+        weighted = (self.config.retrieving.variance_weights and self.raw_trace is not None
+                    and self.raw_trace.get("variance") is not None)
+        if trace_in is None:
+            # the rows outside of the ROI are not used, dark signals being computed for each row
+            trace_in = self.get_trace_in(*self._read_block())
+        processing = self.config.processing
+        self.trace_weights = self.process_weights() if weighted else None
+
+        if processing.dosubstract:
+            xlim = np.array((processing.wl0, processing.wl1)) * 1e-9
+            trace_in = preprocess(trace_in, signal_range=None, dark_signal_range=tuple(xlim))
+
+        if processing.crop_trace:
+            trace_in = preprocess(trace_in, signal_range=self.roi_limits())
+
+        preprocess2(trace_in, self.pnps)
+        trace_in.data = trace_in.data.astype(self.real_type)
+        if self.trace_weights is not None and self.trace_weights.shape != trace_in.data.shape:
+            warnings.warn("The variance of the raw trace does not match the processed trace, it is not used")
+            self.trace_weights = None
+        self.trace_in = trace_in
+        return trace_in
+
+    def process_weights(self):
+        """ Retrieval weights, the inverse of the standard deviation of the raw trace processed as the trace
+
+        The dark signal substraction does not change the variance, and the standard deviation is scaled and
+        interpolated as the trace. The standard deviations smaller than their median are set to the median, so that
+        pixels without signal (hence without noise) are not given huge weights. Only relative weights matter to the
+        retrievers, they are normalized to a maximum of 1.
+
+        Returns
+        -------
+        ndarray: the weights on the grid of the processed trace
+        """
+        std = self.get_trace_in(*self._read_block(), key="variance")
+        std.data = np.sqrt(np.maximum(std.data, 0.))
+        if self.config.processing.crop_trace:
+            std.limit(*self.roi_limits())
+        preprocess2(std, self.pnps)
+        std = np.abs(std.data)
+        floor = np.median(std)
+        if floor <= 0:
+            floor = np.max(std) if np.max(std) > 0 else 1.
+        weights = 1. / np.maximum(std, floor)
+        return (weights / np.max(weights)).astype(self.real_type)
+
+    def warm_started(self):
+        """ True if the retrieval starts from the previous result"""
+        return self.config.retrieving.guess_type == "Previous result" and self.warm_start is not None
+
+    def initial_guess(self):
+        """ Spectrum used as a starting point of the retrieval
+
+        The "Previous result" guess is the spectrum retrieved by the last retrieval, interpolated if the grid changed,
+        or a random gaussian if there was none.
+        """
+        retrieving = self.config.retrieving
+        if self.warm_started():
+            warm_start = self.warm_start
+            if np.array_equal(warm_start.w, self.ft.w):
+                return warm_start.spectrum.copy()
+            return resample_spectrum(warm_start.spectrum, warm_start.w, self.ft.w)
+        pulse_guess = self.pulse_in.copy()
+        if retrieving.guess_type == "Fundamental spectrum":
+            pulse_guess.spectrum = (1 + 0 * 1j) * np.abs(self.pulse_in.spectrum)
+            pulse_guess.spectrum /= self.pulse_in.wl * self.pulse_in.wl
+            pulse_guess.field /= np.abs(pulse_guess.field).max()
+        elif retrieving.guess_type in ("Random gaussian", "Previous result"):
+            random_gaussian(pulse_guess, retrieving.fwhm * 1e-15, phase_max=retrieving.phase_amp)
+        else:
+            raise PipelineError(f"Unknown initial guess type: {retrieving.guess_type}")
+        return pulse_guess.spectrum
+
+    def create_retriever(self, pnps=None, max_iter=None, response=None, **kwargs):
+        """ Instantiate the retriever of the configured algorithm with the optional modified steps
+
+        Parameters
+        ----------
+        pnps: (PNPS) defaults to the PNPS instance of the pipeline
+        max_iter: (int) defaults to the iterations of the retrieving configuration
+        response: (1D array) known spectral response over the process frequencies, only its scale is retrieved
+        kwargs: extra keyword arguments passed to the retriever (status_sig, callback, step_command...)
+        """
+        retrieving = self.config.retrieving
+        retriever = _RETRIEVER_CLASSES[retrieving.algo_type](
+            self.pnps if pnps is None else pnps,
+            logging=True,
+            verbose=retrieving.verbose,
+            maxiter=retrieving.max_iter if max_iter is None else max_iter,
+            **kwargs
+        )
+        if retrieving.fix_spectrum and retriever.method == "copra":
+            retriever._retrieve_step = retrieve_step_fix_spectrum.__get__(retriever)
+            retriever.options.local_batch_size = retrieving.local_batch_size
+        if response is not None:
+            retriever._response = response
+            retriever._error_vector = fixed_response_error_vector.__get__(retriever)
+        elif not retrieving.uniform_response:
+            retriever._error_vector = nonuniform_error_vector.__get__(retriever)
+        return retriever
+
+    def retrieve(self, callback=None, status_sig=None, step_command=None, on_iteration=None):
+        """ Run the retrieval on the processed trace
+
+        If the multiresolution mode is enabled, the retrieval is first run on the coarse levels of its schedule: grids
+        with fewer points (and the same time resolution) and one trace row out of the decimation factor. The spectrum
+        retrieved on a level is the initial guess of the next one, the last level being the full grid. The
+        convergence rules apply to each level, the time budget to the whole retrieval. A stop requested between two
+        levels is kept: the remaining coarse levels are skipped and a single iteration is run on the full grid.
+
+        With the "Previous result" guess, the retrieval starts from the spectrum of the last retrieval (see
+        initial_guess) on the full grid only, with warm_max_iter iterations and, if reuse_response is set, with the
+        spectral response retrieved on the previous shot.
+
+        If the use_cache option is set, the result of a previous retrieval of the same processed data with the same
+        configuration (see result_key) is read from the result cache (see cache.ResultCache) instead, and new results
+        are stored in it unless stopped by the user.
+
+        Parameters
+        ----------
+        callback: (callable) called by the retriever at each iteration
+        status_sig: (pyqtSignal) signal used by the retriever to emit text information
+        step_command: (callable) called by the retriever at each iteration, e.g. to process GUI events
+        on_iteration: (callable) called with a RetrievalProgress after each step of iterative retrievers
+
+        Returns
+        -------
+        SimpleNamespace: the retrieval result. Its stop_reason attribute is the convergence rule that stopped the
+                         retrieval ('error target', 'time budget' or 'plateau'), 'stopped' if stopped by the user,
+                         'max iterations' or 'completed' for algorithms that are not iterated step by step. With the
+                         multiresolution mode, its multiresolution attribute holds the factors, iterations, trace
+                         errors and stop reasons of the coarse levels. Its cached attribute is True if it was read
+                         from the result cache
+        """
+        self._retrieving = True
+        try:
+            return self._retrieve(callback, status_sig, step_command, on_iteration)
+        finally:
+            self._retrieving = False
+            self._stop_requested = False
+
+    def _retrieve(self, callback, status_sig, step_command, on_iteration):
+        if self.trace_in is None:
+            raise PipelineError("Please process the trace first!")
+        kwargs = dict(status_sig=status_sig, callback=callback, step_command=step_command)
+        kwargs = {key: val for key, val in kwargs.items() if val is not None}
+        # no-op if process_trace already converted the trace
+        preprocess2(self.trace_in, self.pnps)
+        self.trace_in.data = self.trace_in.data.astype(self.real_type, copy=False)
+        cache = self.result_cache()
+        if cache is not None:
+            key = self.result_key()
+            entry = cache.get(key)
+            if entry is not None and entry.pulse_retrieved.shape == self.ft.w.shape:
+                self.stop_reason = entry.stop_reason
+                self.result = self.rebuild_result(entry.pulse_retrieved, entry.trace_retrieved,
+                                                  entry.response_function, cached=True, trace_error=entry.trace_error,
+                                                  iterations=entry.iterations, stop_reason=entry.stop_reason)
+                self._set_warm_start(entry.response_function)
+                return self.result
+        start = time.perf_counter()
+        guess = self.initial_guess()
+
+        retrieving = self.config.retrieving
+        warm = self.warm_started()
+        response = None
+        if warm and retrieving.reuse_response and self.warm_start.response is not None and \
+                np.array_equal(self.warm_start.process_w, self.pnps.process_w):
+            response = self.warm_start.response
+        max_iter = retrieving.warm_max_iter if warm and retrieving.warm_max_iter > 0 else None
+
+        multiresolution = self.config.multiresolution
+        levels = SimpleNamespace(factors=[], iterations=[], trace_errors=[], stop_reasons=[])
+        for factor in (multiresolution.factors() if multiresolution.enabled and not warm else []):
+            if self._stop_requested:
+                break
+            pnps, trace, weights = self.coarse_level(factor)
+            result = self._retrieve_level(pnps, trace, weights, resample_spectrum(guess, self.ft.w, pnps.ft.w),
+                                          kwargs, on_iteration, start, factor,
+                                          multiresolution.max_iter if multiresolution.max_iter > 0 else None)
+            guess = resample_spectrum(result.pulse_retrieved, pnps.ft.w, self.ft.w)
+            levels.factors.append(factor)
+            levels.iterations.append(result.iterations)
+            levels.trace_errors.append(result.trace_error)
+            levels.stop_reasons.append(result.stop_reason)
+            if result.stop_reason in ("stopped", "time budget"):
+                break
+
+        stopped = levels.stop_reasons[-1] if levels.stop_reasons and levels.stop_reasons[-1] in (
+            "stopped", "time budget") else None
+        if self._stop_requested:
+            stopped = "stopped"
+        # when stopped on a coarse level or between levels, a single iteration gives the result on the full grid
+        self.result = self._retrieve_level(self.pnps, self.trace_in, self.trace_weights, guess, kwargs, on_iteration,
+                                           start, 1, 1 if stopped else max_iter, response)
+        if stopped:
+            self.stop_reason = self.result.stop_reason = stopped
+        self.result.warm_start = warm
+        self.result.cached = False
+        mu = getattr(self.retriever._retrieval_state, "mu", None)
+        self._set_warm_start(mu)
+        if multiresolution.enabled:
+            self.result.iterations += sum(levels.iterations)
+            self.result.multiresolution = levels
+        if cache is not None and self.result.stop_reason != "stopped":
+            try:
+                cache.put(key, self.result, response_function=mu)
+            except OSError as e:
+                warnings.warn(f"The retrieval result could not be cached: {e}")
+        return self.result
+
+    def _set_warm_start(self, mu):
+        """ Keep the retrieved spectrum and the normalized spectral response mu for the next warm started retrieval"""
+        self.warm_start = SimpleNamespace(
+            w=self.ft.w, spectrum=np.array(self.result.pulse_retrieved), process_w=self.pnps.process_w,
+            response=mu / np.mean(mu) if np.ndim(mu) == 1 and np.mean(mu) > 0 else None)
+
+    def coarse_level(self, factor):
+        """ PNPS instance, trace and weights of a coarse level of the multiresolution retrieval
+
+        Parameters
+        ----------
+        factor: (int) decimation factor of the number of points of the grid (and of the trace rows)
+
+        Returns
+        -------
+        tuple: (PNPS on the coarse grid, MeshData of the trace on its process frequencies, weights or None)
+        """
+        multiresolution = self.config.multiresolution
+        ft = self.generate_ft_grid(max(16, self.config.grid.npoints // factor))
+        pulse = Pulse(ft, self.pulse_in.w0, unit="om")
+        pulse.spectrum = resample_spectrum(self.pulse_in.spectrum, self.ft.w, ft.w)
+        pnps = self._pnps(pulse)
+
+        rows = slice(None)
+        if multiresolution.decimate_rows:
+            n_rows = len(self.trace_in.axes[0])
+            rows = slice(None, None, max(1, min(factor, n_rows // max(1, multiresolution.min_rows))))
+        trace = MeshData(self.trace_in.data[rows], self.trace_in.axes[0][rows], self.trace_in.axes[1],
+                         labels=self.trace_in.labels, units=list(self.trace_in.units))
+        preprocess2(trace, pnps)
+        trace.data = trace.data.astype(self.real_type, copy=False)
+        weights = None
+        if self.trace_weights is not None:
+            matrix = cached_interpolation_matrix(self.trace_in.axes[1], pnps.process_w)
+            weights = resample(self.trace_weights[rows], matrix)
+            weights = (weights / np.max(weights)).astype(self.real_type)
+        return pnps, trace, weights
+
+    def _retrieve_level(self, pnps, trace, weights, guess, kwargs, on_iteration, start, factor, max_iter=None,
+                        response=None):
+        """ Run the retriever on one level, the convergence being checked on the errors of this level"""
+        self.retriever = self.create_retriever(pnps=pnps, max_iter=max_iter, response=response, **kwargs)
+        # a stop requested while the previous level was ending is kept
+        self.stop_reason = "stopped" if self._stop_requested else None
+        errors = []
+
+        def check_convergence(progress):
+            errors.append(progress.error)
+            reason = "stopped" if self._stop_requested else self.config.convergence.stop_reason(errors,
+                                                                                                  progress.elapsed)
+            if reason is not None:
+                if self.stop_reason is None:
+                    self.stop_reason = reason
+                self.retriever._retrieval_state.running = False
+            if on_iteration is not None:
+                on_iteration(progress)
+
+        stepwise = hasattr(self.retriever, "_retrieve_step")
+        if stepwise:
+            self.retriever._retrieve_step = _notifying_step(self.retriever, check_convergence, start, factor)
+        if hasattr(pnps, "prepare_masks"):
+            # dscan: masks of all the insertions are computed once
+            pnps.prepare_masks(trace.axes[0], dtype=self.complex_type)
+        self.retriever.retrieve(trace, guess.astype(self.complex_type), weights=weights)
+        if self.stop_reason is None:
+            self.stop_reason = "max iterations" if stepwise else "completed"
+        result = self.retriever.result()
+        result.stop_reason = self.stop_reason
+        result.iterations = len(errors)
+        return result
+
+    def iter_retrieve(self, **kwargs):
+        """ Run the retrieval in a thread and yield its progress after each iteration
+
+        Leaving the loop early stops the retrieval, the result is then available in the result attribute::
+
+            for progress in pipeline.iter_retrieve():
+                if progress.error < 1e-3:
+                    break
+            result = pipeline.result
+
+        Parameters
+        ----------
+        kwargs: keyword arguments of retrieve (callback, status_sig, step_command)
+
+        Yields
+        ------
+        RetrievalProgress
+        """
+        progress_queue, thread = self._start_retrieve_thread(kwargs)
+        try:
+            while True:
+                progress = progress_queue.get()
+                if progress is None:
+                    break
+                yield progress
+        finally:
+            self.stop()
+            thread.join()
+        if self._retrieve_exception is not None:
+            raise self._retrieve_exception
+
+    async def aiter_retrieve(self, **kwargs):
+        """ Asynchronous version of iter_retrieve, to be used with async for"""
+        progress_queue, thread = self._start_retrieve_thread(kwargs)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                progress = await loop.run_in_executor(None, progress_queue.get)
+                if progress is None:
+                    break
+                yield progress
+        finally:
+            self.stop()
+            await loop.run_in_executor(None, thread.join)
+        if self._retrieve_exception is not None:
+            raise self._retrieve_exception
+
+    def _start_retrieve_thread(self, kwargs):
+        progress_queue = queue.Queue()
+        self._retrieve_exception = None
+
+        def run():
+            try:
+                self.retrieve(on_iteration=progress_queue.put, **kwargs)
+            except Exception as e:
+                self._retrieve_exception = e
+            finally:
+                progress_queue.put(None)
+
+        thread = threading.Thread(target=run, daemon=True)
+        self.result = None
+        self._retrieving = True  # a stop before the thread runs is not lost
+        thread.start()
+        return progress_queue, thread
+
+    def stop(self):
+        """ Stop a running retrieval, including between the levels of a multiresolution retrieval"""
+        if self._retrieving:
+            self._stop_requested = True
+        if self.retriever is not None and self.retriever._retrieval_state.running:
+            if self.stop_reason is None:
+                self.stop_reason = "stopped"
+            self.retriever._retrieval_state.running = False
+
+    def propagate(self):
+        """ Propagate the retrieved pulse through the configured materials and fit its spectral phase
+
+        Returns
+        -------
+        Pulse: the propagated pulse, its properties are stored in pulse_properties
+        """
+        if self.result is None:
+            raise PipelineError("Complete the retrieval first")
+        propagation = self.config.propagation
+        pulse = Pulse(self.result.pnps.ft, self.result.pnps.w0, unit="om")
+        pulse.spectrum = self.result.pulse_retrieved
+
+        for material, length in zip((propagation.material1, propagation.material2),
+                                    (propagation.thickness1, propagation.thickness2)):
+            item = getattr(pymodaq_femto.materials, material)
+            k, _, valid = material_dispersion(item, pulse.ft, pulse.w0)
+
+            # Add material dispersion without 0th and 1st Taylor orders (they don't change the pulse)
+            kfull = np.zeros_like(pulse.w)
+            kfull[valid] = k
+            pulse.spectrum *= np.exp(1j * kfull * 1e-3 * length)
+
+        phasepoly = fit_pulse_phase(pulse, propagation.fit_threshold, 4)
+        pulse.spectrum *= np.exp(-1j * np.poly1d(phasepoly[-1])(pulse.w))
+        pulse.spectrum *= np.exp(-1j * np.poly1d(phasepoly[-2])(pulse.w))
+
+        self.propagated_pulse = pulse
+        self.phase_polynomial = phasepoly
+        self.pulse_properties.gdd = phasepoly[-3] * 1e30 * 2
+        self.pulse_properties.tod = phasepoly[-4] * 1e45 * 6
+        self.pulse_properties.fod = phasepoly[-5] * 1e60 * 24
+        self.update_fwhm()
+        return pulse
+
+    def update_fwhm(self):
+        """ FWHM (fs) of the propagated pulse, 0 if undefined"""
+        precision = 1e-15 * self.config.propagation.dt_fwhm
+        try:
+            self.pulse_properties.fwhm = 1e15 * self.propagated_pulse.fwhm(precision)
+        except ValueError:
+            warnings.warn("FWHM is undefined.")
+            self.pulse_properties.fwhm = 0.
+        return self.pulse_properties.fwhm
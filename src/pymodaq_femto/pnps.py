@@ -1,8 +1,191 @@
+from collections import OrderedDict
+import copy
+import threading
+
+from pypret import PNPS
 from pypret.pnps import CollinearPNPS
 from pypret.frequencies import wl2om
 import numpy as np
 
 
+class LRUCache:
+    """ Thread safe least recently used cache with hit and miss counters
+
+    Parameters
+    ----------
+    maxsize: (int) maximum number of entries, the least recently used entry is discarded beyond
+    """
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """ Return the entry of key, calling factory() to create it if missing"""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        value = factory()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """ dict with the hits, misses, current size and maxsize of the cache"""
+        return dict(hits=self.hits, misses=self.misses, size=len(self._entries), maxsize=self.maxsize)
+
+
+def grid_key(ft, w0):
+    """ Hashable description of a Fourier grid and a central frequency"""
+    return ft.N, float(ft.dt), float(ft.t[0]), float(ft.w[0]), float(w0)
+
+
+def material_key(material):
+    return getattr(material, "name", None) or repr(material)
+
+
+pnps_cache = LRUCache(maxsize=8)
+dispersion_cache = LRUCache(maxsize=16)
+
+
+def cached_pnps(pulse, method, process, material=None, alpha=None, gamma=None):
+    """ PNPS instance of the method for pulse, reusing instances built for the same grid and configuration
+
+    Instances are kept in pnps_cache, keyed on the grid, the central frequency, the method, the process and the
+    method parameters. A shallow copy of the cached instance is returned so that the results of calculate are not
+    shared between users while the precomputed arrays (process frequencies, dispersion tables...) are.
+
+    Parameters
+    ----------
+    pulse: (Pulse)
+    method: (str) one of the PNPS methods ('frog', 'dscan', 'miips', ...)
+    process: (str) the non-linear process ('shg', 'thg', ...)
+    material: (Material) dscan only
+    alpha: (float) miips only
+    gamma: (float) miips only
+
+    Returns
+    -------
+    PNPS: a new instance
+    """
+    kwargs = dict()
+    if method == "dscan":
+        kwargs["material"] = material
+        params = (material_key(material),)
+    elif method == "miips":
+        kwargs.update(alpha=alpha, gamma=gamma)
+        params = (float(alpha), float(gamma))
+    else:
+        params = ()
+    key = grid_key(pulse.ft, pulse.w0) + (method, process) + params
+    pnps = copy.copy(pnps_cache.get(key, lambda: PNPS(pulse, method, process, **kwargs)))
+    # intermediate results may be stored in dicts updated in place
+    for name, value in vars(pnps).items():
+        if isinstance(value, dict):
+            setattr(pnps, name, dict(value))
+    if hasattr(pnps, "pulse"):
+        pnps.pulse = pulse
+    # same grid, but the transforms may be computed with another FFT backend
+    pnps.ft = pulse.ft
+    return pnps
+
+
+def _dispersion(material, ft, w0):
+    w = ft.w + w0
+    # use only the valid range of the Sellmeier equations
+    w1, w2 = sorted(wl2om(np.array(material._range)))
+    valid = (w >= w1) & (w <= w2)
+    w = w[valid]
+    if hasattr(material, "dispersion"):
+        k0, dk = material.dispersion(w0, unit="om", order=1)
+    else:
+        k0 = material.k(w0, unit="om")
+        dk = (material.k(w0 + ft.dw, unit="om") - k0) / ft.dw
+    # remove first and second Taylor order
+    k = material.k(w, unit="om") - k0 - dk * ft.w[valid]
+    n = material.n(w, unit="om")
+    for array in (k, n, valid):
+        array.flags.writeable = False
+    return k, n, valid
+
+
+def material_dispersion(material, ft, w0):
+    """ Wavenumber (without the first two Taylor orders around w0) and index of a material over its valid range
+
+    The results are kept in dispersion_cache, keyed on the grid, the central frequency and the material, so that
+    repeated d-scan setups and propagations through the same materials are computed once. The first order is the
+    analytic group delay of the material (materials.SellmeierMaterial.dispersion), or a finite difference for other
+    materials.
+
+    Parameters
+    ----------
+    material: (Material)
+    ft: (FourierTransform) the grid, frequencies are ft.w + w0
+    w0: (float) central angular frequency
+
+    Returns
+    -------
+    tuple: k (rad/m) and n on the valid frequencies, boolean mask of the valid frequencies of the grid. The arrays
+           are read only as they are shared
+    """
+    key = grid_key(ft, w0) + (material_key(material),)
+    return dispersion_cache.get(key, lambda: _dispersion(material, ft, w0))
+
+
+batch_temporaries = 8  # estimate of the number of complex (N,) arrays allocated per parameter by PNPS.calculate
+
+
+def calculate_batched(pnps, spectrum, parameter, max_bytes=256 * 2 ** 20, operator=None):
+    """ Trace of all the parameter values computed in batches of rows with a bounded memory
+
+    PNPS.calculate allocates several complex arrays of the size of the whole trace. Here it is called on batches of
+    parameter values whose temporaries fit in about max_bytes and each batch is optionally transformed by operator
+    (for instance a resampling on another grid, see resample.interpolation_matrix) before being stored, so that only the
+    result is allocated for the whole scan. pnps.Tmn, pnps.Smk... hold the values of the last batch afterwards.
+
+    Parameters
+    ----------
+    pnps: (PNPS)
+    spectrum: (1D array) the complex spectrum of the pulse
+    parameter: (1D array) the scanned parameter
+    max_bytes: (int) approximate memory of the temporaries of one batch
+    operator: (None or sparse matrix) of shape (K, N) applied to the rows of the trace
+
+    Returns
+    -------
+    ndarray: the (M, N) trace on pnps.process_w or the (M, K) transformed trace
+    """
+    parameter = np.atleast_1d(parameter)
+    N = pnps.ft.N
+    rows = max(1, int(max_bytes // (N * 16 * batch_temporaries)))
+    if hasattr(pnps, "prepare_masks"):
+        # dscan: the mask table is built once for the whole scan, the batches look their rows up
+        pnps.prepare_masks(parameter)
+    trace = None
+    for start in range(0, parameter.size, rows):
+        pnps.calculate(spectrum, parameter[start:start + rows])
+        Tmn = np.atleast_2d(pnps.Tmn)
+        if operator is not None:
+            Tmn = np.asarray(operator @ Tmn.T).T
+        if trace is None:
+            trace = np.empty((parameter.size, Tmn.shape[1]), dtype=Tmn.dtype)
+        trace[start:start + rows] = Tmn
+    return trace
 
 
 class DSCAN(CollinearPNPS):
@@ -14,6 +197,8 @@ class DSCAN(CollinearPNPS):
     parameter_name = "insertion"
     parameter_unit = "m"
     method = "dscan"
+    mask_table_max_bytes = 256 * 2 ** 20  # above, masks are evaluated on the fly
+    mask_table_dtype = np.complex128  # also used for masks evaluated on the fly
 
     def __init__(self, pulse, process, material, **kwargs):
         super().__init__(
@@ -22,23 +207,78 @@ class DSCAN(CollinearPNPS):
 
     def _post_init(self):
         super()._post_init()
-        w = self.ft.w + self.w0
-        # use only the valid range of the Sellmeier equations
-        w1, w2 = sorted(wl2om(np.array(self.material._range)))
-        valid = (w >= w1) & (w <= w2)
-        w = w[valid]
-        # remove first and second Taylor order
-        k = self.material.k(w, unit="om")
-        k0 = self.material.k(self.w0, unit="om")
-        k1 = self.material.k(self.w0 + self.ft.dw, unit="om")
-        dk = (k1 - k0) / self.ft.dw
-        self._k = k - k0 - dk * self.ft.w[valid]
-        self._n = self.material.n(w, unit="om")
-        self._mask_valid = valid
+        self._k, self._n, self._mask_valid = material_dispersion(self.material, self.ft, self.w0)
+        self._mask_table = None
+        self._mask_insertions = None  # sorted insertions of the rows of the table
+
+    def prepare_masks(self, parameter, dtype=None, max_bytes=None):
+        """ Precompute the masks of all the insertions of parameter in a (M, N) table
+
+        The rows of the table, sorted by insertion, are then returned by mask for these insertions. The table is kept
+        when parameter is a subset of the insertions it was built for, so that it is built once for the whole
+        insertion axis of a trace. Nothing is stored if the table would be larger than max_bytes, masks are then
+        evaluated on the fly.
+
+        Parameters
+        ----------
+        parameter: (1D array) the insertions
+        dtype: (dtype) complex128 or complex64, kept for the following tables. Defaults to mask_table_dtype
+        max_bytes: (int) maximum size of the table, kept for the following tables. Defaults to mask_table_max_bytes
+
+        Returns
+        -------
+        bool: True if the table is available
+        """
+        parameter = np.atleast_1d(parameter)
+        if dtype is not None:
+            self.mask_table_dtype = dtype
+        if max_bytes is not None:
+            self.mask_table_max_bytes = max_bytes
+        dtype = np.dtype(self.mask_table_dtype)
+        max_bytes = self.mask_table_max_bytes
+        if (self._mask_table is not None and self._mask_table.dtype == dtype and
+                self._mask_table.nbytes <= max_bytes and np.all(self._table_rows(parameter) >= 0)):
+            return True
+        self._mask_table = None
+        self._mask_insertions = None
+        insertions = np.unique(parameter.astype(float))
+        if insertions.size * self.ft.N * dtype.itemsize > max_bytes:
+            return False
+        table = np.zeros((insertions.size, self.ft.N), dtype=dtype)
+        block = 64
+        for start in range(0, insertions.size, block):
+            table[start:start + block, self._mask_valid] = np.exp(1.0j * np.outer(insertions[start:start + block],
+                                                                                   self._k))
+        table[insertions == 0.0] = 1.0
+        table.flags.writeable = False
+        self._mask_table = table
+        self._mask_insertions = insertions
+        return True
+
+    def _table_rows(self, insertions):
+        """ Rows of the mask table of the insertions, -1 for those not in the table"""
+        insertions = np.asarray(insertions, dtype=float)
+        if self._mask_insertions is None:
+            return np.full(insertions.shape, -1)
+        rows = np.minimum(np.searchsorted(self._mask_insertions, insertions), self._mask_insertions.size - 1)
+        return np.where(self._mask_insertions[rows] == insertions, rows, -1)
+
+    def calculate(self, spectrum, parameter):
+        if np.size(parameter) > 1 and self._mask_table is None:
+            self.prepare_masks(parameter)
+        return super().calculate(spectrum, parameter)
+
+    def gradient(self, Smk2, parameter):
+        if np.size(parameter) > 1 and self._mask_table is None:
+            self.prepare_masks(parameter)
+        return super().gradient(Smk2, parameter)
 
     def mask(self, insertion):
+        row = self._table_rows(insertion)
+        if row >= 0:
+            return self._mask_table[row]
         if insertion == 0.0:
-            return np.ones(self.ft.N, dtype=np.complex128)
-        H = np.zeros(self.ft.N, dtype=np.complex128)
+            return np.ones(self.ft.N, dtype=self.mask_table_dtype)
+        H = np.zeros(self.ft.N, dtype=self.mask_table_dtype)
         H[self._mask_valid] = np.exp(1.0j * self._k * insertion)
         return H
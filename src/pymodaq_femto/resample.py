@@ -0,0 +1,73 @@
+"""Linear interpolation of traces as sparse matrices
+
+Interpolating the rows of a (M, N) trace from a grid x onto a grid x_new is a linear operation that is the same for
+all the rows: it is stored once as a sparse (len(x_new), N) matrix with two non-zero elements per row and applied to
+blocks of rows with a sparse matrix product. Scaling factors of the source grid (such as the Jacobian of a frequency
+to wavelength conversion) are folded in the matrix.
+"""
+import hashlib
+
+import numpy as np
+import scipy.sparse
+
+from pymodaq_femto.pnps import LRUCache
+
+matrix_cache = LRUCache(maxsize=8)
+
+
+def interpolation_matrix(x, x_new, scale=None):
+    """ Sparse matrix of the linear interpolation from x onto x_new
+
+    Parameters
+    ----------
+    x: (1D array) source grid, not necessarily sorted but without duplicate values
+    x_new: (1D array) destination grid, points outside of the range of x are set to zero
+    scale: (None or 1D array) factors applied to the source values before the interpolation
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix: of shape (len(x_new), len(x))
+    """
+    x = np.asarray(x, dtype=float)
+    x_new = np.asarray(x_new, dtype=float)
+    order = np.argsort(x)
+    xs = x[order]
+    if xs.size < 2 or not np.all(np.diff(xs) > 0):
+        raise ValueError("The source grid should hold at least two distinct values, without duplicates or NaN")
+    rows = np.flatnonzero((x_new >= xs[0]) & (x_new <= xs[-1]))
+    idx = np.clip(np.searchsorted(xs, x_new[rows], side="right") - 1, 0, xs.size - 2)
+    frac = (x_new[rows] - xs[idx]) / (xs[idx + 1] - xs[idx])
+    cols = np.concatenate((order[idx], order[idx + 1]))
+    values = np.concatenate((1.0 - frac, frac))
+    if scale is not None:
+        values *= np.asarray(scale)[cols]
+    return scipy.sparse.csr_matrix((values, (np.concatenate((rows, rows)), cols)), shape=(x_new.size, x.size))
+
+
+def _grid_key(a):
+    """ Shape, dtype and sha1 digest of the values of a grid"""
+    a = np.ascontiguousarray(a, dtype=float)
+    return a.shape, a.dtype.str, hashlib.sha1(a.tobytes()).hexdigest()
+
+
+def cached_interpolation_matrix(x, x_new, scale=None):
+    """ interpolation_matrix kept in matrix_cache, keyed on the content of the grids and of scale"""
+    key = tuple(None if a is None else _grid_key(a) for a in (x, x_new, scale))
+    return matrix_cache.get(key, lambda: interpolation_matrix(x, x_new, scale))
+
+
+def resample(data, matrix):
+    """ Apply the interpolation matrix to the last axis of data
+
+    Parameters
+    ----------
+    data: (ndarray) of shape (..., N)
+    matrix: (sparse matrix) of shape (K, N)
+
+    Returns
+    -------
+    ndarray: of shape (..., K)
+    """
+    data = np.asarray(data)
+    flat = data.reshape((-1, data.shape[-1]))
+    return np.asarray(matrix @ flat.T).T.reshape(data.shape[:-1] + (matrix.shape[0],))
@@ -28,25 +28,45 @@ from pymodaq_femto.graphics import (
     MeshDataPlot,
     PulsePlot,
     PulsePropagationPlot,
+    MonitorPlot,
+)
+from pymodaq_femto.simulation import Simulator
+from pymodaq_femto.pipeline import (
+    RetrievalPipeline,
+    PipelineConfig,
+    PipelineError,
+    precisions,
+    guess_types,
+    pulse_from_spectrum,
 )
-from pymodaq_femto.simulation import Simulator, methods, nlprocesses, materials
 from collections import OrderedDict
-from pypret import FourierTransform, Pulse, PNPS, lib, MeshData, random_gaussian
-from pypret.frequencies import om2wl, wl2om, convert
+from pypret import lib
 import scipy
-import importlib
 from scipy.fftpack import next_fast_len
-from pymodaq.daq_utils.h5modules import H5BrowserUtil, H5Saver
+from pymodaq.daq_utils.h5modules import H5BrowserUtil
+from pymodaq_femto.h5io import save_retrieval, load_h5_trace, read_h5_axes
+from pymodaq_femto.multiscan import load_combined
+from pymodaq_femto.multistart import MultiStartRetrieval
+from pymodaq_femto.monitor import OnlineMonitor
+from pymodaq_femto.cache import ResultCache
+from pymodaq_femto.fourier import backends as fft_backends
 from pyqtgraph.graphicsItems.GradientEditorItem import Gradients
 from pymodaq_femto import _PNPS_CLASSES
 from pypret.retrieval.retriever import _RETRIEVER_CLASSES
-import warnings
 import math
+import time
 import inspect
 import pymodaq_femto.materials
 
 retriever_algos = list(_RETRIEVER_CLASSES.keys())
 
+Gradients.update(OrderedDict([
+    ('femto', {'ticks': [(0.0, (0, 0, 0, 255)), (0.085, (255, 85, 255, 255)), (0.25, (0, 0, 255, 255))
+        , (0.41, (85, 255, 255, 255)), (0.59, (32, 179, 37, 255)), (0.72, (255, 255, 0, 255))
+        , (0.88, (255, 0, 0, 255)), (1, (255, 255, 255, 255)), ], 'mode': 'rgb'}),
+    ('femto_error', {'ticks': [(0.0, (0, 0, 255, 255)), (0.5, (0, 0, 0, 255)),
+                               (1, (255, 0, 0, 255))], 'mode': 'rgb'}), ]))
+
 config = utils.load_config()
 logger = utils.set_logger(utils.get_module_name(__file__))
 
@@ -94,85 +114,6 @@ class DataIn(OrderedDict):
             self[k] = kwargs[k]
 
 
-def pulse_from_spectrum(wavelength, spectrum, pulse=None):
-    """ Generates a pulse instance from a measured spectrum.
-    """
-    # scale to intensity over frequency, convert to amplitude and normalize
-    spectrum = spectrum * wavelength * wavelength
-    spectrum[spectrum < 0.0] = 0.0
-    spectrum = np.sqrt(spectrum + 0.0j)
-    spectrum /= spectrum.max()
-    # calculate angular frequencies
-    w = convert(wavelength, "wl", "om")
-    if pulse is None:
-        # create pulse parameters from the measured spectrum
-        # choose center wavelength as the mean of the intensity
-        w0 = lib.mean(w, lib.abs2(spectrum))
-        # choose simulation grid that encompasses the measured spectrum
-        dw = abs(np.mean(np.diff(w)))
-        N = 4 * next_fast_len(int(abs(w[-1] - w[0]) / dw))
-        ft = FourierTransform(N, dw=dw)
-        pulse = Pulse(ft, w0, unit="om")
-    # interpolate
-    pulse.spectrum = scipy.interpolate.interp1d(
-        w - pulse.w0, spectrum, bounds_error=False, fill_value=0.0
-    )(pulse.w)
-    return pulse
-
-
-def preprocess(trace, signal_range=None, dark_signal_range=None):
-    if dark_signal_range is not None:
-        dark_signal = trace.copy()
-        dark_signal.limit(dark_signal_range, axes=1)
-        dark_signal = np.median(dark_signal.data, axis=1)
-    if signal_range is not None:
-        trace.limit(*signal_range)
-    if dark_signal_range is not None:
-        # subtract dark counts for every spectrum separately
-        trace.data -= dark_signal[:, None]
-    # normalize
-    trace.normalize()
-    return trace
-
-
-# interpolate the measurement
-def preprocess2(trace, pnps):
-    if trace.units[1] == "m":
-        # scaled in wavelength -> has to be corrected
-        wavelength = trace.axes[1]
-        frequency = convert(wavelength, "wl", "om")
-        trace.scale(wavelength * wavelength)
-        trace.normalize()
-        trace.axes[1] = frequency
-        trace.units[1] = "Hz"
-    trace.interpolate(axis2=pnps.process_w)
-
-
-def substract_linear_phase(pulse):
-    phase = np.unwrap(np.angle(pulse.spectrum))
-    intensity = np.abs(pulse.spectrum)
-    z = np.polyfit(pulse.w, phase, 1)
-    pulse.spectrum *= np.exp(-1j * np.poly1d(z)(pulse.w))
-    return pulse
-
-
-def fit_pulse_phase(pulse, phase_blanking_threshold, order):
-    phase = np.unwrap(np.angle(pulse.spectrum))
-    amp = np.abs(pulse.spectrum)
-
-    # delta = 100e-9
-    x, phase = lib.mask_phase(pulse.w, amp, phase, phase_blanking_threshold)
-    # fitarea = (pulse.wl > pulse.wl0-delta/2)&(pulse.wl < pulse.wl0+delta/2)
-    # z = np.polyfit(pulse.w[fitarea], phase[fitarea], order)
-    z = np.polyfit(x.compressed(), phase.compressed(), order)
-    return z
-
-
-def mask(x, y, where, **kwargs):
-    y = scipy.interpolate.interp1d(x[~where], y[~where], **kwargs)(x)
-    return y
-
-
 params_simul = Simulator.params
 params_algo = utils.find_dict_in_list_from_key_val(params_simul, "name", "algo")
 
@@ -182,108 +123,65 @@ def truncate(number, digits) -> float:
     return math.trunc(stepper * number) / stepper
 
 
-# method of pypret.Retriever which overwrites the _error_vector method for a modified one which uses
-# an energy dependent weighting to account for unknown spectral response
-def nonuniform_error_vector(self, Tmn, store=True):
-    " Modified to allow for energy dependent weights"
-    # rename
-    rs = self._retrieval_state
-    Tmn_meas = self.Tmn_meas
-    # scaling factor
-    w2 = self._weights * self._weights
-
-    # mu is vector if spectral response is unknown
-    mean_mu = np.sum(Tmn_meas * Tmn * w2) / np.sum(Tmn * Tmn * w2)
-    mu = np.full(self.N, mean_mu)
-    mask = (w2.sum(axis=0) > 0.0) & (  # weights equal to zero
-        Tmn_meas.sum(axis=0) > 0.0
-    )  # measurement is zero
-    mu[mask] = (
-        np.sum(Tmn_meas * Tmn * w2, axis=0)[mask] / np.sum(Tmn * Tmn * w2, axis=0)[mask]
-    )
-    # extend the edges of the response function
-    idx1 = lib.find(mask, lambda x: x)
-    mu[:idx1] = mu[idx1]
-    idx2 = lib.find(mask, lambda x: x, n=-1)
-    mu[idx2:] = mu[idx2]
-
-    # store intermediate results in current retrieval state
-    if store:
-        rs.mu = mu
-        rs.Tmn = Tmn
-        rs.Smk = self.pnps.Smk
-    return np.ravel((Tmn_meas - mu * Tmn) * self._weights)
-
-
-# Optional modified retriever step calculation that keeps spectral intensity fixed
-def retrieve_step_fix_spectrum(self, iteration, En):
-    """ Perform a single COPRA step.
+class ThrottledCallback:
+    """ Forward calls to func at most max_rate times per second
 
-        Parameters
-        ----------
-        iteration : int
-            The current iteration number - mainly for logging.
-        En : 1d-array
-            The current pulse spectrum.
-        """
-    # local rename
-    ft = self.ft
-    options = self.options
-    pnps = self.pnps
-    rs = self._retrieval_state
-    Tmn_meas = self.Tmn_meas
-    # current gradient -> last gradient
-    rs.previous_max_gradient = rs.current_max_gradient
-    rs.current_max_gradient = 0.0
-    # switch iteration
-    if rs.steps_since_improvement == 10:
-        rs.mode = "global"
-    # local iteration
-    if rs.mode == "local":
-        # running estimate for the trace
-        Tmn = np.zeros((self.M, self.N))
-        for m in np.random.permutation(np.arange(self.M)):
-            p = self.parameter[m]
-            Tmn[m, :] = pnps.calculate(En, p)
-            Smk2 = self._project(Tmn_meas[m, :] / rs.mu, pnps.Smk)
-            nablaZnm = pnps.gradient(Smk2, p)
-            # calculate the step size
-            Zm = lib.norm2(Smk2 - pnps.Smk)
-            gradient_norm = lib.norm2(nablaZnm)
-            if gradient_norm > rs.current_max_gradient:
-                rs.current_max_gradient = gradient_norm
-            gamma = Zm / max(rs.current_max_gradient, rs.previous_max_gradient)
-            # update the spectrum
-            En -= gamma * nablaZnm
-            En = np.abs(self.initial_guess) * np.exp(1j * np.angle(En))
-        # Tmn is only an approximation as En changed in the iteration!
-        rs.approximate_error = True
-        R = self._R(Tmn)  # updates rs.mu!!!
-    # global iteration
-    elif rs.mode == "global":
-        Tmn = pnps.calculate(En, self.parameter)
-        r = self._r(Tmn)
-        R = self._Rr(r)  # updates rs.mu!!!
-        rs.approximate_error = False
-        # gradient descent w.r.t. Smk
-        w2 = self._weights * self._weights
-        gradrmk = (
-            -4
-            * ft.dt
-            / (ft.dw * lib.twopi)
-            * ft.backward(rs.mu * ft.forward(pnps.Smk) * (Tmn_meas - rs.mu * Tmn) * w2)
-        )
-        etar = options.alpha * r / lib.norm2(gradrmk)
-        Smk2 = pnps.Smk - etar * gradrmk
-        # gradient descent w.r.t. En
-        nablaZn = pnps.gradient(Smk2, self.parameter).sum(axis=0)
-        # calculate the step size
-        Z = lib.norm2(Smk2 - pnps.Smk)
-        etaz = options.alpha * Z / lib.norm2(nablaZn)
-        # update the spectrum
-        En -= etaz * nablaZn
-        En = np.abs(self.initial_guess) * np.exp(1j * np.angle(En))
-    return R, En
+    Calls arriving faster are coalesced: only the arguments of the latest one are kept and forwarded at the next
+    allowed call or by flush.
+
+    Parameters
+    ----------
+    func: (callable)
+    max_rate: (float) maximum number of calls per second forwarded to func
+    """
+
+    def __init__(self, func, max_rate):
+        self.func = func
+        self.min_interval = 1 / max_rate
+        self._last = -np.inf
+        self._pending = None
+
+    def __call__(self, *args, **kwargs):
+        self._pending = (args, kwargs)
+        if time.perf_counter() - self._last >= self.min_interval:
+            self.flush()
+
+    def flush(self):
+        """ Forward the pending call if any"""
+        if self._pending is not None:
+            args, kwargs = self._pending
+            self._pending = None
+            self._last = time.perf_counter()
+            self.func(*args, **kwargs)
+
+
+def downsample_image(image, shape, y_axis, x_axis):
+    """ Block average image (and its axes) so that it is not larger than shape
+
+    Parameters
+    ----------
+    image: (2D array)
+    shape: (tuple of 2 int) maximum number of rows and columns, e.g. the size in pixels of the viewer
+    y_axis: (1D array) axis along the rows of image
+    x_axis: (1D array) axis along the columns of image
+
+    Returns
+    -------
+    image, y_axis, x_axis: the averaged arrays
+    """
+    factors = [max(1, int(np.ceil(size / max(1, max_size)))) for size, max_size in zip(image.shape, shape)]
+    if factors == [1, 1]:
+        return image, y_axis, x_axis
+    ny, nx = [(size // factor) * factor for size, factor in zip(image.shape, factors)]
+    averaged = image[:ny, :nx].reshape(ny // factors[0], factors[0], nx // factors[1], factors[1]).mean(axis=(1, 3))
+    axes = []
+    for axis, size, factor in zip((y_axis, x_axis), image.shape, factors):
+        axis = np.asarray(axis)
+        if len(axis) == size:
+            axes.append(axis[:(size // factor) * factor].reshape(-1, factor).mean(axis=1))
+        else:
+            axes.append(np.linspace(axis[0], axis[-1], size // factor))
+    return (averaged, *axes)
 
 
 def popup_message(title, text):
@@ -301,6 +199,7 @@ class Retriever(QObject):
 
     status_signal = pyqtSignal(str)
     retriever_signal = pyqtSignal(str)
+    monitor_signal = pyqtSignal(object)
     params_in = [
         params_algo,
         {
@@ -324,6 +223,15 @@ class Retriever(QObject):
                     "readonly": True,
                     "tip": "Loaded node within trace file",
                 },
+                {
+                    "title": "Scans:",
+                    "name": "scans",
+                    "type": "list",
+                    "values": ["Single", "Mean", "Median"],
+                    "value": "Single",
+                    "tip": "Load only the selected trace node, or combine the traces of all the scans of the file "
+                    "(Scan000, Scan001...). The variance of the mean is used as retrieval weights",
+                },
                 {
                     "title": "Trace Info",
                     "name": "trace_in_info",
@@ -458,6 +366,22 @@ class Retriever(QObject):
                             "value": 1.0,
                             "tip": "Time spacing between 2 points in the time grid",
                         },
+                        {
+                            "title": "FFT backend:",
+                            "name": "fft_backend",
+                            "type": "list",
+                            "values": list(fft_backends.keys()),
+                            "tip": "Library computing the Fourier transforms. scipy and pyfftw use several threads, "
+                            "pyfftw has to be installed",
+                        },
+                        {
+                            "title": "FFT threads:",
+                            "name": "fft_workers",
+                            "type": "int",
+                            "value": 0,
+                            "min": 0,
+                            "tip": "Number of threads of the scipy and pyfftw backends, 0 for the number of CPUs",
+                        },
                     ],
                 },
                 {
@@ -589,6 +513,15 @@ class Retriever(QObject):
                     "value": True,
                     "tip": "Display infos during retrieval",
                 },
+                {
+                    "title": "Max refresh rate (Hz):",
+                    "name": "refresh_rate",
+                    "type": "float",
+                    "value": 5.0,
+                    "min": 0.1,
+                    "tip": "Maximum rate of the live display updates during retrieval. Intermediate states are "
+                    "skipped and the trace is averaged down to the size of its viewer",
+                },
                 {
                     "title": "Max iteration:",
                     "name": "max_iter",
@@ -603,6 +536,13 @@ class Retriever(QObject):
                     "value": True,
                     "tip": "Assume uniform response of non-linear process. Turn off for real data.",
                 },
+                {
+                    "title": "Variance weights:",
+                    "name": "variance_weights",
+                    "type": "bool",
+                    "value": True,
+                    "tip": "Weight the trace by the inverse of its noise when averaged over several scans",
+                },
                 {
                     "title": "Keep spectral intensity fixed",
                     "name": "fix_spectrum",
@@ -610,12 +550,56 @@ class Retriever(QObject):
                     "values": False,
                     "tip": "When true, only lets the phase evolve during the algorithm",
                 },
+                {
+                    "title": "Local batch size:",
+                    "name": "local_batch_size",
+                    "type": "int",
+                    "value": 1,
+                    "min": 1,
+                    "tip": "Number of trace rows processed per update in the local iterations when the spectral "
+                    "intensity is fixed. 1 is the standard sequential COPRA step",
+                },
+                {
+                    "title": "Precision:",
+                    "name": "precision",
+                    "type": "list",
+                    "values": list(precisions.keys()),
+                    "tip": "Floating point precision of the measured trace, masks and retrieval arrays. Single "
+                    "precision halves their memory, see the documentation for its accuracy",
+                },
                 {
                     "title": "Initial guess:",
                     "name": "guess_type",
                     "type": "list",
-                    "values": ["Random gaussian", "Fundamental spectrum"],
-                    "tip": "Retriever Algorithm",
+                    "values": guess_types,
+                    "tip": "Starting point of the retrieval. Previous result starts from the last retrieved pulse "
+                    "(a random gaussian for the first retrieval), e.g. to follow consecutive shots",
+                },
+                {
+                    "title": "Warm start iterations:",
+                    "name": "warm_max_iter",
+                    "type": "int",
+                    "value": 10,
+                    "min": 0,
+                    "visible": False,
+                    "tip": "Max iteration when starting from the previous result, 0 for Max iteration",
+                },
+                {
+                    "title": "Reuse spectral response:",
+                    "name": "reuse_response",
+                    "type": "bool",
+                    "value": False,
+                    "visible": False,
+                    "tip": "When starting from the previous result, fix the non-uniform spectral response to the one "
+                    "retrieved previously, only its scale is retrieved",
+                },
+                {
+                    "title": "Use result cache:",
+                    "name": "use_cache",
+                    "type": "bool",
+                    "value": False,
+                    "tip": "Read the result of a previous retrieval of the same data with the same settings from the "
+                    "result cache instead of retrieving again",
                 },
                 {
                     "title": "Initial Pulse Guess",
@@ -639,6 +623,146 @@ class Retriever(QObject):
                         },
                     ],
                 },
+                {
+                    "title": "Convergence",
+                    "name": "convergence",
+                    "type": "group",
+                    "expanded": False,
+                    "children": [
+                        {
+                            "title": "Plateau window:",
+                            "name": "plateau_window",
+                            "type": "int",
+                            "value": 0,
+                            "min": 0,
+                            "tip": "Stop when the error did not decrease by more than the plateau tolerance over "
+                            "this number of iterations. 0 to disable",
+                        },
+                        {
+                            "title": "Plateau tolerance:",
+                            "name": "plateau_tolerance",
+                            "type": "float",
+                            "value": 1e-3,
+                            "min": 0.0,
+                            "tip": "Relative decrease of the error",
+                        },
+                        {
+                            "title": "Error target:",
+                            "name": "error_target",
+                            "type": "float",
+                            "value": 0.0,
+                            "min": 0.0,
+                            "tip": "Stop when the trace error is below this value. 0 to disable",
+                        },
+                        {
+                            "title": "Time budget (s):",
+                            "name": "time_budget",
+                            "type": "float",
+                            "value": 0.0,
+                            "min": 0.0,
+                            "tip": "Stop after this duration. 0 to disable",
+                        },
+                    ],
+                },
+                {
+                    "title": "Multi-start",
+                    "name": "multistart",
+                    "type": "group",
+                    "expanded": False,
+                    "children": [
+                        {
+                            "title": "Enabled:",
+                            "name": "enabled",
+                            "type": "bool",
+                            "value": False,
+                            "tip": "Run several retrievals from random gaussian guesses in parallel and keep the "
+                            "one with the lowest trace error",
+                        },
+                        {
+                            "title": "Number of starts:",
+                            "name": "n_starts",
+                            "type": "int",
+                            "value": 4,
+                            "min": 1,
+                        },
+                        {
+                            "title": "FWHM min (fs):",
+                            "name": "fwhm_min",
+                            "type": "float",
+                            "value": 5.0,
+                            "tip": "Shortest duration of the initial guesses",
+                        },
+                        {
+                            "title": "FWHM max (fs):",
+                            "name": "fwhm_max",
+                            "type": "float",
+                            "value": 20.0,
+                            "tip": "Longest duration of the initial guesses",
+                        },
+                        {
+                            "title": "Processes:",
+                            "name": "workers",
+                            "type": "int",
+                            "value": 0,
+                            "min": 0,
+                            "tip": "Number of processes, 0 for the number of CPUs",
+                        },
+                        {
+                            "title": "Seed:",
+                            "name": "seed",
+                            "type": "int",
+                            "value": 0,
+                            "min": 0,
+                            "tip": "Change it to get another set of random initial guesses",
+                        },
+                    ],
+                },
+                {
+                    "title": "Multiresolution",
+                    "name": "multiresolution",
+                    "type": "group",
+                    "expanded": False,
+                    "children": [
+                        {
+                            "title": "Enabled:",
+                            "name": "enabled",
+                            "type": "bool",
+                            "value": False,
+                            "tip": "Retrieve first on coarser grids, each retrieved spectrum being the initial guess "
+                            "of the next finer level, the last level being the full grid",
+                        },
+                        {
+                            "title": "Schedule:",
+                            "name": "schedule",
+                            "type": "str",
+                            "value": "4, 2",
+                            "tip": "Decimation factors of the number of points of the grid of the coarse levels",
+                        },
+                        {
+                            "title": "Decimate rows:",
+                            "name": "decimate_rows",
+                            "type": "bool",
+                            "value": True,
+                            "tip": "Also keep one trace row out of the decimation factor on the coarse levels",
+                        },
+                        {
+                            "title": "Min rows:",
+                            "name": "min_rows",
+                            "type": "int",
+                            "value": 16,
+                            "min": 1,
+                            "tip": "Minimum number of trace rows of the coarse levels",
+                        },
+                        {
+                            "title": "Coarse iterations:",
+                            "name": "max_iter",
+                            "type": "int",
+                            "value": 0,
+                            "min": 0,
+                            "tip": "Iterations of each coarse level, 0 for the iterations of the retrieval",
+                        },
+                    ],
+                },
                 {
                     "title": "Start Retrieval",
                     "name": "start",
@@ -809,6 +933,7 @@ class Retriever(QObject):
         self.setupUI()
         self.create_menu(self.mainwindow.menuBar())
         self.simulator = None
+        self.pipeline = RetrievalPipeline()
         self.data_in = None
         self.ft = None
         self.retriever = None
@@ -817,6 +942,8 @@ class Retriever(QObject):
         self.propagated_pulse = None
         self.result = None
         self.save_file_pathname = None
+        self.monitor = None
+        self.monitor_signal.connect(self.update_monitor)
         self.settings.child("processing", "process_trace").sigActivated.connect(
             self.process_trace
         )
@@ -852,81 +979,41 @@ class Retriever(QObject):
                 save_file_pathname = gutils.select_file(
                     start_path=self.save_file_pathname, save=True, ext="h5"
                 )  # see daq_utils
-            h5saver = H5Saver(save_type="custom")
-            h5saver.init_file(
-                update_h5=True,
-                custom_naming=False,
-                addhoc_file_path=save_file_pathname,
-                raw_group_name="PyMoDAQFemtoAnalysis",
-            )
-
-            data_in_group = h5saver.get_set_group(h5saver.raw_group, "DataIn")
-            trace_group = h5saver.get_set_group(data_in_group, "NLTrace")
-            spectrum_group = h5saver.get_set_group(data_in_group, "FunSpectrum")
-            h5saver.add_data(trace_group, self.data_in["raw_trace"], scan_type="")
-            h5saver.add_data(spectrum_group, self.data_in["raw_spectrum"], scan_type="")
 
             settings_str = b"<DataIn_settings>" + ioxml.parameter_to_xml_string(
                 self.settings
             )
             settings_str += b"</DataIn_settings>"
-            h5saver.set_attr(data_in_group, "settings", settings_str)
-            if self.result is not None:
-                rr = self.result
-                result_group = h5saver.get_set_group(h5saver.raw_group, "Result")
-
-                spectrum_group = h5saver.get_set_group(result_group, "Spectrum")
-                h5saver.add_data(
-                    spectrum_group,
-                    dict(
-                        data=rr.pulse_retrieved,
-                        x_axis=dict(data=rr.pnps.ft.w, label="frequency", units="Hz"),
-                    ),
-                    scan_type="",
-                )
-
-                h5saver.set_attr(spectrum_group, "w0", rr.pnps.w0)
-                h5saver.set_attr(spectrum_group, "Npts", rr.pnps.ft.N)
 
-                trace_group_retrieved = h5saver.get_set_group(result_group, "NLTrace")
-                trace_retrieved = dict(
-                    data=rr.trace_retrieved,
-                    x_axis=dict(data=rr.pnps.process_w, label="frequency", units="Hz"),
-                    y_axis=dict(
-                        data=rr.parameter, label="parameter", units="Par. units"
-                    ),
-                )
-                h5saver.add_data(trace_group_retrieved, trace_retrieved, scan_type="")
-
-            if self.propagated_pulse is not None:
-                propag_group = h5saver.get_set_group(result_group, "Propagation")
-                h5saver.add_data(
-                    propag_group,
-                    dict(
-                        data=self.propagated_pulse.spectrum,
-                        x_axis=dict(data=rr.pnps.ft.w, label="frequency", units="Hz"),
-                    ),
-                    scan_type="",
-                )
-                settings_str = b'<prop_settings title="Prop. Settings" type="group">'
-                settings_str += ioxml.parameter_to_xml_string(self.prop_settings)
-                settings_str += ioxml.parameter_to_xml_string(self.pulse_settings)
-                settings_str += b"</prop_settings>"
-
-                h5saver.set_attr(propag_group, "settings", settings_str)
-
-            settings_str = b'<All_settings title="All Settings" type="group">'
-            settings_str += ioxml.parameter_to_xml_string(self.settings)
-            settings_str += ioxml.parameter_to_xml_string(self.pulse_settings)
-            settings_str += ioxml.parameter_to_xml_string(self.prop_settings)
-            settings_str += b"</All_settings>"
-
-            h5saver.set_attr(h5saver.raw_group, "settings", settings_str)
+            prop_settings_str = b'<prop_settings title="Prop. Settings" type="group">'
+            prop_settings_str += ioxml.parameter_to_xml_string(self.prop_settings)
+            prop_settings_str += ioxml.parameter_to_xml_string(self.pulse_settings)
+            prop_settings_str += b"</prop_settings>"
+
+            all_settings_str = b'<All_settings title="All Settings" type="group">'
+            all_settings_str += ioxml.parameter_to_xml_string(self.settings)
+            all_settings_str += ioxml.parameter_to_xml_string(self.pulse_settings)
+            all_settings_str += ioxml.parameter_to_xml_string(self.prop_settings)
+            all_settings_str += b"</All_settings>"
+
+            save_retrieval(
+                str(save_file_pathname),
+                self.data_in["raw_trace"],
+                self.data_in["raw_spectrum"],
+                settings_str,
+                all_settings_str,
+                result=self.result,
+                propagated_pulse=self.propagated_pulse,
+                prop_settings_xml=prop_settings_str,
+            )
 
         except Exception as e:
-            pass
+            logger.exception(str(e))
 
-        h5saver.close_file()
+    def clear_cache(self):
+        cache = ResultCache()
+        removed = cache.clear()
+        popup_message("Result cache", f"{removed} results removed from {cache.directory}")
 
     def create_menu(self, menubar):
         """
@@ -950,6 +1037,9 @@ class Retriever(QObject):
 
         self.io_menu = menubar.addMenu("IO")
         self.io_menu.addAction(self.save_data_action)
+        self.io_menu.addSeparator()
+        self.clear_cache_action = self.io_menu.addAction("Clear Result Cache")
+        self.clear_cache_action.triggered.connect(self.clear_cache)
 
     def settings_changed(self, param, changes):
         for param, change, data in changes:
@@ -1123,14 +1213,18 @@ class Retriever(QObject):
                 elif param.name() == "guess_type":
                     if param.value() == "Fundamental spectrum":
                         self.settings.child("retrieving", "pulse_guess").hide()
-                    elif param.value() == "Random gaussian":
+                    else:
                         self.settings.child("retrieving", "pulse_guess").show()
+                    for name in ("warm_max_iter", "reuse_response"):
+                        self.settings.child("retrieving", name).show(param.value() == "Previous result")
 
                 elif param.name() == "algo_type":
                     if param.value() == "copra":
                         self.settings.child("retrieving", "fix_spectrum").show()
+                        self.settings.child("retrieving", "local_batch_size").show()
                     else:
                         self.settings.child("retrieving", "fix_spectrum").hide()
+                        self.settings.child("retrieving", "local_batch_size").hide()
 
     def prop_settings_changed(self, param, changes):
         for param, change, data in changes:
@@ -1157,6 +1251,7 @@ class Retriever(QObject):
 
         """
         try:
+            self.stop_monitoring()
             if hasattr(self, "mainwindow"):
                 self.mainwindow.close()
 
@@ -1203,6 +1298,9 @@ class Retriever(QObject):
         self.ui.dock_propagation = Dock("Propagation")
         self.dockarea.addDock(self.ui.dock_propagation, "below", self.ui.dock_retriever)
 
+        self.ui.dock_monitoring = Dock("Monitoring")
+        self.dockarea.addDock(self.ui.dock_monitoring, "below", self.ui.dock_propagation)
+
         self.ui.dock_processed.raiseDock()
 
         # ######################################################
@@ -1221,9 +1319,16 @@ class Retriever(QObject):
                     QIcon(QPixmap(":/icons/Icon_Library/Open_2D.png")),
                     "Load last 2D scan",
                 )
+                self.monitor_action = gutils.QAction(
+                    QIcon(QPixmap(":/icons/Icon_Library/run2.png")),
+                    "Online monitoring of the scans",
+                )
+                self.monitor_action.setCheckable(True)
                 self.toolbar.addAction(self.load_last_scan_action)
+                self.toolbar.addAction(self.monitor_action)
                 self.toolbar.addSeparator()
                 self.load_last_scan_action.triggered.connect(self.load_last_scan)
+                self.monitor_action.triggered.connect(self.toggle_monitoring)
 
         self.load_trace_in_action = gutils.QAction(
             QIcon(QPixmap(":/icons/Icon_Library/Open_2D.png")),
@@ -1390,6 +1495,18 @@ class Retriever(QObject):
         self.prop_tree.setParameters(self.prop_settings, showTop=False)
         self.pulse_tree.setParameters(self.pulse_settings, showTop=False)
 
+        ##################################################
+        # setup monitoring dock
+        monitor_widget = QtWidgets.QWidget()
+        monitor_widget.setLayout(QtWidgets.QVBoxLayout())
+        self.monitor_canvas = MplCanvas(monitor_widget, width=5, height=4, dpi=100)
+        toolbar_monitor = NavigationToolbar(self.monitor_canvas, monitor_widget)
+        self.monitor_label = QtWidgets.QLabel()
+        monitor_widget.layout().addWidget(toolbar_monitor)
+        monitor_widget.layout().addWidget(self.monitor_canvas)
+        monitor_widget.layout().addWidget(self.monitor_label)
+        self.ui.dock_monitoring.addWidget(monitor_widget)
+
         self.ui.dock_data_in.raiseDock()
 
     def open_simulator(self):
@@ -1471,16 +1588,21 @@ class Retriever(QObject):
             ).setValue(np.mean(np.diff(raw_trace["y_axis"]["data"])) * 1e15)
         self.state.append("trace_loaded")
 
+    def update_pipeline(self):
+        """ Update the configuration and the raw data of the pipeline from the settings and the loaded data"""
+        self.pipeline.config = PipelineConfig.from_settings(self.settings, self.prop_settings)
+        self.pipeline.config.processing.spectrum_masks = [
+            tuple(roi.pos()) for roi in self.viewer_spectrum_in.roi_manager.ROIs.values()
+        ]
+        if self.data_in is not None:
+            self.pipeline.set_data(
+                raw_trace=self.data_in.get("raw_trace"),
+                raw_spectrum=self.data_in.get("raw_spectrum"),
+            )
+
     def generate_ft_grid(self):
-        wl0 = self.settings.child("processing", "grid_settings", "wl0").value() * 1e-9
-        Npts = self.settings.child("processing", "grid_settings", "npoints").value()
-        dt = (
-            self.settings.child(
-                "processing", "grid_settings", "time_resolution"
-            ).value()
-            * 1e-15
-        )
-        self.ft = FourierTransform(Npts, dt, w0=wl2om(-wl0 - 300e-9))
+        self.update_pipeline()
+        self.ft = self.pipeline.generate_ft_grid()
 
     def process_trace(self):
         if "trace_loaded" not in self.state:
@@ -1495,48 +1617,14 @@ class Retriever(QObject):
             logger.info("PNPS is not yet defined, process the spectrum first")
             return
 
-        trace_in = self.get_trace_in()
-        # TODO
-        # ## substract bright spots range (if any)
-        # if len(self.viewer_trace_in.roi_manager.ROIs) > 0:
-        #     roi = [self.viewer_trace_in.roi_manager.ROIs.keys()][0]
-        #     pos = self.viewer_trace_in.roi_manager.ROIs[roi].pos()
-        #     width, height = self.viewer_trace_in.roi_manager.ROIs[roi].size()
-        #     xlim_pxls = np.array([pos.x(), pos.y()+width])
-        #     ylim_pxls = np.array([pos.x(), pos.y() + height])
-        #     xlim, ylim = self.viewer_trace_in.scale_axis(xlim_pxls, ylim_pxls)
-        #     trace_in = preprocess(trace_in, signal_range=None, bright_signal_range=tuple(xlim)) # bright_signal_range doesn't exists yet'
-
-        if self.settings.child("processing", "linearselect", "dosubstract").value():
-            xlim = (
-                np.array(
-                    (
-                        self.settings.child(
-                            "processing", "linearselect", "wl0"
-                        ).value(),
-                        self.settings.child(
-                            "processing", "linearselect", "wl1"
-                        ).value(),
-                    )
-                )
-                * 1e-9
-            )
-            trace_in = preprocess(
-                trace_in, signal_range=None, dark_signal_range=tuple(xlim)
-            )
-
-        if self.settings.child("processing", "ROIselect", "crop_trace").value():
-            x0 = self.settings.child("processing", "ROIselect", "x0").value()
-            y0 = self.settings.child("processing", "ROIselect", "y0").value()
-            width = self.settings.child("processing", "ROIselect", "width").value()
-            height = self.settings.child("processing", "ROIselect", "height").value()
-            xlim_pxls = np.array([x0, x0 + width])
-            ylim_pxls = np.array([y0, y0 + height])
-            xlim, ylim = self.viewer_trace_in.scale_axis(xlim_pxls, ylim_pxls)
-            trace_in = preprocess(trace_in, signal_range=(tuple(ylim), tuple(xlim)))
-
+        self.update_pipeline()
+        try:
+            # only the ROI block of the raw trace is read, and its variance gives the weights if available
+            trace_in = self.pipeline.process_trace()
+        except PipelineError as e:
+            popup_message("Error", str(e))
+            return
         self.data_in["trace_in"] = trace_in
-        preprocess2(self.data_in["trace_in"], self.pnps)
         self.state.append("trace_processed")
 
         self.trace_canvas.figure.clf()
@@ -1553,64 +1641,17 @@ class Retriever(QObject):
             return
         self.ui.dock_propagation.raiseDock()
 
-        self.propagated_pulse = Pulse(
-            self.result.pnps.ft, self.result.pnps.w0, unit="om"
-        )
-        self.propagated_pulse.spectrum = self.result.pulse_retrieved
+        self.update_pipeline()
+        self.pipeline.result = self.result
+        self.propagated_pulse = self.pipeline.propagate()
+        phasepoly = self.pipeline.phase_polynomial
+        properties = self.pipeline.pulse_properties
 
-        material_list = []
-        material_list.append(self.prop_settings.child("materials", "material1").value())
-        material_list.append(self.prop_settings.child("materials", "material2").value())
+        self.pulse_settings.child("pulse_prop", "gdd").setValue(truncate(properties.gdd, 4))
+        self.pulse_settings.child("pulse_prop", "tod").setValue(truncate(properties.tod, 4))
+        self.pulse_settings.child("pulse_prop", "fod").setValue(truncate(properties.fod, 4))
+        self.pulse_settings.child("pulse_prop", "fwhm_meas").setValue(truncate(properties.fwhm, 4))
 
-        thickness_list = []
-        thickness_list.append(
-            self.prop_settings.child("materials", "thickness1").value()
-        )
-        thickness_list.append(
-            self.prop_settings.child("materials", "thickness2").value()
-        )
-
-        for material, length in zip(material_list, thickness_list):
-            item = getattr(pymodaq_femto.materials, material)
-            w1, w2 = sorted(wl2om(np.array(item._range)))
-            w = self.propagated_pulse.w + self.propagated_pulse.w0
-            valid = (w >= w1) & (w <= w2)
-
-            w = w[valid]
-            k = item.k(w, unit="om")
-            k0 = item.k(self.propagated_pulse.w0, unit="om")
-            k1 = item.k(
-                self.propagated_pulse.w0 + self.propagated_pulse.ft.dw, unit="om"
-            )
-            dk = (k1 - k0) / self.propagated_pulse.ft.dw
-
-            # Add material dispersion without 0th and 1st Taylor orders (they don't change the pulse)
-            kfull = np.zeros_like(self.propagated_pulse.w)
-            kfull[valid] = k - k0 - dk * self.propagated_pulse.w[valid]
-            self.propagated_pulse.spectrum *= np.exp(1j * kfull * 1e-3 * length)
-
-        phasepoly = fit_pulse_phase(
-            self.propagated_pulse,
-            self.prop_settings.child("materials", "fit_threshold").value(),
-            4,
-        )
-        self.propagated_pulse.spectrum *= np.exp(
-            -1j * np.poly1d(phasepoly[-1])(self.propagated_pulse.w)
-        )
-        self.propagated_pulse.spectrum *= np.exp(
-            -1j * np.poly1d(phasepoly[-2])(self.propagated_pulse.w)
-        )
-        self.pulse_settings.child("pulse_prop", "gdd").setValue(
-            truncate(phasepoly[-3] * 1e30 * 2, 4)
-        )
-        self.pulse_settings.child("pulse_prop", "tod").setValue(
-            truncate(phasepoly[-4] * 1e45 * 6, 4)
-        )
-        self.pulse_settings.child("pulse_prop", "fod").setValue(
-            truncate(phasepoly[-5] * 1e60 * 24, 4)
-        )
-
-        self.update_fwhm()
         plot_oversampling = self.prop_settings.child(
             "materials", "prop_oversampling"
         ).value()
@@ -1630,16 +1671,11 @@ class Retriever(QObject):
         self.prop_canvas.draw()
 
     def update_fwhm(self):
-        precision = 1e-15 * self.prop_settings.child("materials", "dt_fwhm").value()
-        try:
-            fwhm = 1e15 * self.propagated_pulse.fwhm(precision)
-            self.pulse_settings.child("pulse_prop", "fwhm_meas").setValue(
-                truncate(fwhm, 4)
-            )
-
-        except ValueError:
-            warnings.warn("FWHM is undefined.")
-            self.pulse_settings.child("pulse_prop", "fwhm_meas").setValue(0)
+        if self.propagated_pulse is None:
+            return
+        self.update_pipeline()
+        fwhm = self.pipeline.update_fwhm()
+        self.pulse_settings.child("pulse_prop", "fwhm_meas").setValue(truncate(fwhm, 4))
 
     def process_spectrum(self):
         if "spectrum_loaded" not in self.state:
@@ -1650,94 +1686,19 @@ class Retriever(QObject):
             return
         self.ui.dock_processed.raiseDock()
 
-        self.generate_ft_grid()
-        if len(np.unique(self.ft.w)) == 1:
-            popup_message(
-                "Error",
-                "Frequency axis only has one point. Check time resolution and Npoints.",
-            )
+        self.update_pipeline()
+        try:
+            # the displays write retrieved spectra in data_in["pulse_in"], not in the pulse of the pipeline
+            self.data_in["pulse_in"] = self.pipeline.process_spectrum().copy()
+        except PipelineError as e:
+            popup_message("Error", str(e))
             return
-
-        method = self.settings.child("algo", "method").value()
-        nlprocess = self.settings.child("algo", "nlprocess").value()
-        wl0 = self.settings.child("data_in_info", "trace_in_info", "wl0").value() * 1e-9
-        spectrum = self.data_in["raw_spectrum"]["data"]
-        wavelength = self.data_in["raw_spectrum"]["x_axis"]["data"]
-
-        if "shg" in nlprocess:
-            wl0real = 2 * wl0
-        elif "thg" in nlprocess:
-            wl0real = 3 * wl0
-        else:
-            wl0real = wl0
-
-        self.data_in["pulse_in"] = Pulse(self.ft, wl0real)
-
-        for roi in self.viewer_spectrum_in.roi_manager.ROIs:
-            range = self.viewer_spectrum_in.roi_manager.ROIs[roi].pos()
-            spectrum = mask(
-                wavelength,
-                spectrum,
-                (range[0] <= wavelength) & (wavelength <= range[1]),
-            )
-
-        if self.settings.child(
-            "processing", "linearselect_spectrum", "dosubstract_spectrum"
-        ).value():
-            x1 = (
-                self.settings.child(
-                    "processing", "linearselect_spectrum", "wl0_s"
-                ).value()
-                * 1e-9
-            )
-            x2 = (
-                self.settings.child(
-                    "processing", "linearselect_spectrum", "wl1_s"
-                ).value()
-                * 1e-9
-            )
-
-            idx1 = np.argmin(np.abs(wavelength - x1))
-            idx2 = np.argmin(np.abs(wavelength - x2))
-
-            if idx1 > idx2:
-                idx1, idx2 = idx2, idx1
-
-            spectrum -= np.mean(spectrum[idx1:idx2])
-
-        self.data_in["pulse_in"] = pulse_from_spectrum(
-            wavelength, spectrum, pulse=self.data_in["pulse_in"]
-        )
+        self.ft = self.pipeline.ft
+        self.pnps = self.pipeline.pnps
 
         self.settings.child("data_in_info", "spectrum_in_info", "ftl").setValue(
             self.data_in["pulse_in"].fwhm(dt=0.1)
         )
-        # self.pnps = PNPS(self.data_in['pulse_in'], method, nlprocess)
-
-        if method == "dscan":
-            material = materials[self.settings.child("algo", "material").value()]
-            self.pnps = PNPS(
-                self.data_in["pulse_in"], method, nlprocess, material=material
-            )
-            parameter = utils.linspace_step(
-                self.settings.child("algo", "dscan_parameter", "min").value(),
-                self.settings.child("algo", "dscan_parameter", "max").value(),
-                self.settings.child("algo", "dscan_parameter", "step").value(),
-            )
-            parameter *= 1e-3
-        elif method == "miips":
-            alpha = self.settings.child("algo", "alpha").value()
-            gamma = self.settings.child("algo", "gamma").value()
-            self.pnps = PNPS(
-                self.data_in["pulse_in"], method, nlprocess, alpha=alpha, gamma=gamma
-            )
-            parameter = utils.linspace_step(
-                self.settings.child("algo", "miips_parameter", "min").value(),
-                self.settings.child("algo", "miips_parameter", "max").value(),
-                self.settings.child("algo", "miips_parameter", "step").value(),
-            )
-        else:
-            self.pnps = PNPS(self.data_in["pulse_in"], method, nlprocess)
 
         self.state.append("spectrum_processed")
         self.pulse_canvas.figure.clf()
@@ -1759,7 +1720,12 @@ class Retriever(QObject):
                 self.retriever_thread = None
 
         self.retriever_thread = QThread()
-        retriever = RetrieverWorker(self.data_in, self.pnps, self.settings)
+        self.update_pipeline()
+        retriever = RetrieverWorker(
+            self.pipeline,
+            max_refresh_rate=self.settings.child("retrieving", "refresh_rate").value(),
+            image_shape=(self.viewer_live_trace.parent.height(), self.viewer_live_trace.parent.width()),
+        )
         retriever.moveToThread(self.retriever_thread)
         retriever.status_sig[str].connect(self.update_retriever_info)
         retriever.result_signal[SimpleNamespace].connect(self.display_results)
@@ -1896,25 +1862,8 @@ class Retriever(QObject):
         self.update_ROI(QtCore.QRectF(pos[0], pos[1], size[0], size[1]))
 
     def get_trace_in(self):
-        method = self.settings.child("algo", "method").value()
-        if method == "dscan":
-            label = "Insertion"
-            unit = "m"
-        elif method == "miips":
-            label = "Phase"
-            unit = "rad"
-        else:
-            label = "Delay"
-            unit = "s"
-
-        self.data_in["trace_in"] = MeshData(
-            self.data_in["raw_trace"]["data"],
-            self.data_in["raw_trace"]["y_axis"]["data"],
-            self.data_in["raw_trace"]["x_axis"]["data"],
-            labels=[label, "wavelength"],
-            units=[unit, "m"],
-        )
-
+        self.update_pipeline()
+        self.data_in["trace_in"] = self.pipeline.get_trace_in()
         return self.data_in["trace_in"]
 
     def get_pulse_in(self):
@@ -1925,73 +1874,148 @@ class Retriever(QObject):
         )
 
     def get_axes_from_trace_node(self, fname, node_path):
-        h5file = self.h5browse.open_file(fname)
-        data, axes, nav_axes, is_spread = self.h5browse.get_h5_data(node_path)
-        self.h5browse.close_file()
+        axes = read_h5_axes(fname, node_path)
         return axes["x_axis"], axes["nav_00"]
 
+    def read_last_scan(self):
+        """ Trace of the last 2D scan of the dashboard's DAQ_Scan module
+
+        Returns
+        -------
+        tuple: (data, wl, parameter_axis) the trace and its axes, as displayed by the scan module (not scaled)
+        """
+        viewer = self.dashboard.scan_module.ui.scan2D_graph
+        parameter_axis = utils.Axis(
+            data=viewer.x_axis_scaled.copy(),
+            label=viewer.scaling_options["scaled_xaxis"]["label"],
+            units=viewer.scaling_options["scaled_xaxis"]["units"],
+        )
+        wl = utils.Axis(
+            data=viewer.y_axis_scaled.copy(),
+            label=viewer.scaling_options["scaled_yaxis"]["label"],
+            units=viewer.scaling_options["scaled_yaxis"]["units"],
+        )
+        data = self.dashboard.scan_module.scan_data_2D[0].T.copy()
+        return data, wl, parameter_axis
+
     def load_last_scan(self):
         try:
-            viewer = self.dashboard.scan_module.ui.scan2D_graph
-            parameter_axis = utils.Axis(
-                data=viewer.x_axis_scaled.copy(),
-                label=viewer.scaling_options["scaled_xaxis"]["label"],
-                units=viewer.scaling_options["scaled_xaxis"]["units"],
-            )
-            wl = utils.Axis(
-                data=viewer.y_axis_scaled.copy(),
-                label=viewer.scaling_options["scaled_yaxis"]["label"],
-                units=viewer.scaling_options["scaled_yaxis"]["units"],
-            )
-            data = self.dashboard.scan_module.scan_data_2D[0].T.copy()
-
+            data, wl, parameter_axis = self.read_last_scan()
             self.set_data_in_exp(data, wl, parameter_axis)
         except Exception as e:
+            logger.exception(str(e))
+            popup_message("Error", f"Could not load the last scan: {e}")
+
+    def toggle_monitoring(self, checked):
+        if checked:
+            self.start_monitoring()
+        else:
+            self.stop_monitoring()
+
+    def start_monitoring(self):
+        """ Retrieve online the trace of each scan completed by the dashboard's DAQ_Scan module
+
+        The traces are processed and retrieved with the current settings in a background thread (see
+        monitor.OnlineMonitor), each retrieval starting from the previous result. Traces acquired while a retrieval is
+        running are dropped but the latest one.
+        """
+        if self.data_in is None or self.data_in.get("raw_spectrum") is None:
+            popup_message("Error", "Please load a spectrum first!")
+            self.monitor_action.setChecked(False)
+            return
+        self.stop_monitoring()
+        self.update_pipeline()
+        self.monitor = OnlineMonitor(
+            self.pipeline.config,
+            self.data_in["raw_spectrum"],
+            on_record=lambda record, result: self.monitor_signal.emit(record),
+        )
+        self.monitor.start()
+        self.dashboard.scan_module.scan_done_signal.connect(self.submit_last_scan)
+        self.monitor_canvas.figure.clf()
+        self.monitor_canvas.draw()
+        self.monitor_label.setText("Waiting for a scan...")
+        self.ui.dock_monitoring.raiseDock()
+
+    def stop_monitoring(self):
+        if self.monitor is None:
+            return
+        try:
+            self.dashboard.scan_module.scan_done_signal.disconnect(self.submit_last_scan)
+        except TypeError:  # not connected
             pass
+        self.monitor.stop()
+        self.monitor = None
+
+    def submit_last_scan(self, *args):
+        """ Slot of the scan_done_signal of the DAQ_Scan module: enqueue the trace of the completed scan"""
+        if self.monitor is None:
+            return
+        try:
+            data, wl, parameter_axis = self.read_last_scan()
+            wl, parameter_axis = self.scale_trace_axes(wl, parameter_axis)
+            self.monitor.submit({"data": data, "x_axis": wl, "y_axis": parameter_axis})
+        except Exception as e:
+            logger.exception(str(e))
+
+    @pyqtSlot(object)
+    def update_monitor(self, record):
+        if self.monitor is None:
+            return
+        self.pulse_settings.child("pulse_prop", "gdd").setValue(truncate(record.gdd, 4))
+        self.pulse_settings.child("pulse_prop", "tod").setValue(truncate(record.tod, 4))
+        self.pulse_settings.child("pulse_prop", "fod").setValue(truncate(record.fod, 4))
+        self.pulse_settings.child("pulse_prop", "fwhm_meas").setValue(truncate(record.fwhm, 4))
+
+        self.monitor_canvas.figure.clf()
+        MonitorPlot(self.monitor.series(), self.monitor_canvas.figure)
+        self.monitor_canvas.draw()
+        self.monitor_label.setText(
+            f"Traces: {len(self.monitor.records)} retrieved, {self.monitor.dropped} dropped, "
+            f"{self.monitor.failed} failed - last: {record.iterations} iterations, "
+            f"trace error {record.trace_error:.3e}, latency {record.latency:.2f} s"
+        )
 
     def load_trace_in(self, fname=None, node_path=None):
         try:
-            if fname is not None and node_path is not None:
-                h5file = self.h5browse.open_file(fname)
-                data, axes, nav_axes, is_spread = self.h5browse.get_h5_data(node_path)
-                self.h5browse.close_file()
-            else:
+            scans = self.settings.child("data_in_info", "scans").value()
+            variance = None
+            if fname is None or node_path is None:
                 data, fname, node_path = browse_data(
                     ret_all=True,
                     message="Select the node corresponding to the"
                     "Characterization Trace",
                 )
+                if fname != "" and scans == "Single":
+                    wl, parameter_axis = self.get_axes_from_trace_node(fname, node_path)
+            elif scans == "Single":
+                data, axes = load_h5_trace(fname, node_path)
+                wl, parameter_axis = axes["x_axis"], axes["nav_00"]
+
+            if fname != "" and scans != "Single":
+                data, axes, variance = load_combined(fname, node_path, mode=scans.lower())
+                wl, parameter_axis = axes["x_axis"], axes["nav_00"]
 
             if fname != "":
                 self.save_file_pathname = fname
                 self.settings.child("data_in_info", "loaded_file").setValue(fname)
                 self.settings.child("data_in_info", "loaded_node").setValue(node_path)
-                wl, parameter_axis = self.get_axes_from_trace_node(fname, node_path)
-                self.set_data_in_exp(data, wl, parameter_axis, fname, node_path)
+                self.set_data_in_exp(data, wl, parameter_axis, fname, node_path, variance=variance)
 
         except Exception as e:
             logger.exception(str(e))
 
-    def set_data_in_exp(self, data, wl, parameter_axis, fname="", node_path=""):
+    def set_data_in_exp(self, data, wl, parameter_axis, fname="", node_path="", variance=None):
         if self.data_in is None:
             self.data_in = DataIn(source="experimental")
 
-        scaling_parameter = self.settings.child(
-            "data_in_info", "trace_in_info", "param_scaling"
-        ).value()
-        scaling_wl = self.settings.child(
-            "data_in_info", "trace_in_info", "wl_scaling"
-        ).value()
-
-        wl["units"] = "m"
-        wl["data"] *= scaling_wl
-
-        parameter_axis["data"] *= scaling_parameter
-        parameter_axis["units"] = "p.u."
-
+        wl, parameter_axis = self.scale_trace_axes(wl, parameter_axis)
+        raw_trace = {"data": data, "x_axis": wl, "y_axis": parameter_axis}
+        if variance is not None:
+            raw_trace["variance"] = variance
         self.data_in.update(
             dict(
-                raw_trace={"data": data, "x_axis": wl, "y_axis": parameter_axis},
+                raw_trace=raw_trace,
                 file_path=fname,
                 node_path=node_path,
             )
@@ -2003,11 +2027,25 @@ class Retriever(QObject):
         self.viewer_trace_in.show_hide_histogram()
         self.viewer_trace_in.ROIselect_action.trigger()
 
+    def scale_trace_axes(self, wl, parameter_axis):
+        """ Scale the axes of a trace in place to meters (wavelength) and SI units (parameter)"""
+        scaling_parameter = self.settings.child(
+            "data_in_info", "trace_in_info", "param_scaling"
+        ).value()
+        scaling_wl = self.settings.child(
+            "data_in_info", "trace_in_info", "wl_scaling"
+        ).value()
+
+        wl["units"] = "m"
+        wl["data"] *= scaling_wl
+
+        parameter_axis["data"] *= scaling_parameter
+        parameter_axis["units"] = "p.u."
+        return wl, parameter_axis
+
     def load_spectrum_in(self, fname=None, node_path=None):
         if fname is not None and node_path is not None:
-            h5file = self.h5browse.open_file(fname)
-            data, axes, nav_axes, is_spread = self.h5browse.get_h5_data(node_path)
-            self.h5browse.close_file()
+            data, axes = load_h5_trace(fname, node_path)
 
         else:
             data, fname, node_path = browse_data(
@@ -2015,9 +2053,7 @@ class Retriever(QObject):
                 message="Select the node corresponding to the" "Fundamental Spectrum",
             )
             if fname != "":
-                h5file = self.h5browse.open_file(fname)
-                data, axes, nav_axes, is_spread = self.h5browse.get_h5_data(node_path)
-                self.h5browse.close_file()
+                axes = read_h5_axes(fname, node_path)
             else:
                 return
 
@@ -2058,12 +2094,21 @@ class RetrieverWorker(QObject):
     status_sig = pyqtSignal(str)
     callback_sig = pyqtSignal(list)
 
-    def __init__(self, data_in, pnps, settings):
+    events_rate = 20  # processing of the events of the thread (e.g. stop command) per second
+
+    def __init__(self, pipeline, max_refresh_rate=5.0, image_shape=(1000, 1000)):
+        """
+        Parameters
+        ----------
+        pipeline: (RetrievalPipeline) pipeline with a processed trace
+        max_refresh_rate: (float) maximum number of live display updates per second
+        image_shape: (tuple of 2 int) size in pixels of the live trace viewer
+        """
         super().__init__()
-        self.settings = settings
-        self.data_in = data_in
-        self.pnps = pnps
-        self.retriever = None
+        self.pipeline = pipeline
+        self.max_refresh_rate = max_refresh_rate
+        self.image_shape = image_shape
+        self.multistart = None
 
     # def send_callback(self, pnps):
     #     self.callback_sig.emit([pnps.Tmn, [pnps.parameter, pnps.process_w], pnps.pulse.field, pnps.field.t])
@@ -2076,65 +2121,55 @@ class RetrieverWorker(QObject):
             self.stop_retriever()
 
     def start_retriever(self):
-        retriever_cls = _RETRIEVER_CLASSES[
-            self.settings.child("retrieving", "algo_type").value()
-        ]
-        verbose = self.settings.child("retrieving", "verbose").value()
-        max_iter = self.settings.child("retrieving", "max_iter").value()
-        fwhm = self.settings.child("retrieving", "pulse_guess", "fwhm").value()
-        amplitude = self.settings.child(
-            "retrieving", "pulse_guess", "phase_amp"
-        ).value()
-        fix_spectrum = self.settings.child("retrieving", "fix_spectrum").value()
-
-        uniform_response = self.settings.child("retrieving", "uniform_response").value()
-        preprocess2(self.data_in["trace_in"], self.pnps)
-
-        self.retriever = retriever_cls(
-            self.pnps,
-            logging=True,
-            verbose=verbose,
-            maxiter=max_iter,
-            status_sig=self.status_sig,
-            callback=self.callback_sig.emit,
+        if self.pipeline.config.multistart.enabled:
+            result = self.start_multistart()
+        else:
+            callback = ThrottledCallback(self.send_live_data, self.max_refresh_rate)
+            result = self.pipeline.retrieve(
+                callback=callback,
+                status_sig=self.status_sig,
+                step_command=ThrottledCallback(QtWidgets.QApplication.processEvents, self.events_rate),
+            )
+            callback.flush()
+            if result.cached:
+                self.status_sig.emit(f"Retrieval read from the result cache: {result.stop_reason} after "
+                                     f"{result.iterations} iterations")
+            else:
+                warm = " from the previous result" if result.warm_start else ""
+                self.status_sig.emit(f"Retrieval ended{warm}: {result.stop_reason} after {result.iterations} "
+                                     f"iterations")
+        self.result_signal.emit(result)
+
+    def send_live_data(self, args):
+        """ Emit the live data with the trace averaged down to the size of the viewer"""
+        image, y_axis, x_axis = downsample_image(args[0], self.image_shape, args[1], args[2])
+        self.callback_sig.emit([image, y_axis, x_axis] + list(args[3:]))
+
+    def start_multistart(self):
+        self.multistart = MultiStartRetrieval(self.pipeline)
+        seeds, fwhms = self.multistart.guesses()
+        self.status_sig.emit(f"Multi-start retrieval: {len(seeds)} runs")
+        result = self.multistart.run(
+            on_progress=self.send_progress,
             step_command=QtWidgets.QApplication.processEvents,
         )
-        if fix_spectrum and self.retriever.method == "copra":
-            self.retriever._retrieve_step = retrieve_step_fix_spectrum.__get__(
-                self.retriever
-            )
-        if not uniform_response:
-            self.retriever._error_vector = nonuniform_error_vector.__get__(
-                self.retriever
-            )
-
-        if (
-            self.settings.child("retrieving", "guess_type").value()
-            == "Fundamental spectrum"
-        ):
-            pulse_guess = self.data_in["pulse_in"].copy()
-            pulse_guess.spectrum = (1 + 0 * 1j) * np.abs(
-                self.data_in["pulse_in"].spectrum
-            )
-            pulse_guess.spectrum /= (
-                self.data_in["pulse_in"].wl * self.data_in["pulse_in"].wl
-            )
-            pulse_guess.field /= np.abs(pulse_guess.field).max()
-
-            guess = pulse_guess.spectrum
-
-        elif (
-            self.settings.child("retrieving", "guess_type").value() == "Random gaussian"
-        ):
-            random_gaussian(self.data_in["pulse_in"], fwhm * 1e-15, phase_max=amplitude)
-            guess = self.data_in["pulse_in"].spectrum
-
-        self.retriever.retrieve(self.data_in["trace_in"], guess, weights=None)
+        self.multistart = None
+        stats = result.multistart
+        for ind, (fwhm, error) in enumerate(zip(stats.fwhms, stats.trace_errors)):
+            self.status_sig.emit(f"Run {ind} (guess FWHM {fwhm:.1f} fs): trace error {error:.4e}")
+        self.status_sig.emit(
+            f"Best run: {stats.best_index}, phase spread (rms): {stats.phase.rms_std:.3f} rad"
+        )
+        return result
 
-        self.result_signal.emit(self.retriever.result())
+    def send_progress(self, index, progress):
+        self.status_sig.emit(f"Run {index}, iteration {progress.iteration}: error {progress.error:.4e}")
 
     def stop_retriever(self):
-        self.retriever._retrieval_state.running = False
+        if self.multistart is not None:
+            self.multistart.stop()
+        else:
+            self.pipeline.stop()
 
 
 def main():
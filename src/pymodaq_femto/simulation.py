@@ -4,27 +4,17 @@ from PyQt5 import QtWidgets
 from pathlib import Path
 from pyqtgraph.parametertree import Parameter, ParameterTree
 from pymodaq.daq_utils.parameter import pymodaq_ptypes
-from pypret.frequencies import om2wl, wl2om, convert
-from pypret import FourierTransform, Pulse, PNPS, lib, MeshData
+from pypret import MeshData
 
 import numpy as np
-from pymodaq.daq_utils.daq_utils import gauss1D, my_moment, l2w, linspace_step, Axis, normalize
-from pymodaq.daq_utils.array_manipulation import linspace_this_image, crop_vector_to_axis, crop_array_to_axis,\
-    linspace_this_vect
-from pypret.material import BK7
-from pymodaq_femto.materials import FS
+from pymodaq.daq_utils.daq_utils import my_moment, l2w, Axis
+from pymodaq.daq_utils.array_manipulation import linspace_this_image, crop_array_to_axis
 from pymodaq_femto.graphics import MplCanvas, NavigationToolbar, MeshDataPlot, PulsePlot
-from collections import OrderedDict
 from pymodaq_femto import _PNPS_CLASSES
-
-
-
-methods_tmp = list(_PNPS_CLASSES.keys())
-methods_tmp.sort()
-methods = ['frog']
-methods.extend(methods_tmp)
-nlprocesses = list(_PNPS_CLASSES[methods[0]].keys())
-materials = OrderedDict(FS=FS, BK7=BK7)
+from pymodaq_femto.pipeline import methods, nlprocesses, materials
+from pymodaq_femto.fourier import backends as fft_backends
+from pymodaq_femto import simulation_core
+from pymodaq_femto.simulation_core import SimulationConfig, calculate_trace, make_grid, make_pulse, make_pnps
 
 
 
@@ -107,6 +97,38 @@ class Simulator(QObject):
                  'tip': 'Number of points for the temporal and Fourier Transform Grid'},
                 {'title': 'Time resolution (fs):', 'name': 'time_resolution', 'type': 'float', 'value': 0.5,
                  'tip': 'Time spacing between 2 points in the time grid'},
+                {'title': 'FFT backend:', 'name': 'fft_backend', 'type': 'list', 'values': list(fft_backends.keys()),
+                 'tip': 'Library computing the Fourier transforms. scipy and pyfftw use several threads, pyfftw has to'
+                        ' be installed'},
+                {'title': 'FFT threads:', 'name': 'fft_workers', 'type': 'int', 'value': 0, 'min': 0,
+                 'tip': 'Number of threads of the scipy and pyfftw backends, 0 for the number of CPUs'},
+                {'title': 'Engine:', 'name': 'engine', 'type': 'list', 'values': ['Standard', 'Batched'],
+                 'tip': 'Batched computes the trace in batches of parameter values with a bounded memory and resamples'
+                        ' it directly on the wavelength grid, for large grids and scans'},
+                {'title': 'Batch memory (MB):', 'name': 'batch_memory', 'type': 'int', 'value': 256, 'min': 1,
+                 'tip': 'Approximate memory used by the computation of one batch of the Batched engine'},
+            ]},
+            {'title': 'Detector model:', 'name': 'detector', 'type': 'group', 'children': [
+                {'title': 'Enabled?:', 'name': 'enabled', 'type': 'bool', 'value': False,
+                 'tip': 'Apply the detector model to the traces used by the Retriever'},
+                {'title': 'Peak counts:', 'name': 'peak_counts', 'type': 'float', 'value': 1e4, 'min': 1,
+                 'tip': 'Number of counts at the maximum of the trace'},
+                {'title': 'Shot noise?:', 'name': 'shot_noise', 'type': 'bool', 'value': True,
+                 'tip': 'Add the shot noise of the counts'},
+                {'title': 'Read noise (counts):', 'name': 'read_noise', 'type': 'float', 'value': 0., 'min': 0,
+                 'tip': 'Standard deviation of the read noise in counts'},
+                {'title': 'Dark offset (counts):', 'name': 'dark_offset', 'type': 'float', 'value': 0.,
+                 'tip': 'Offset added to the counts'},
+                {'title': 'Resolution (nm):', 'name': 'resolution', 'type': 'float', 'value': 0., 'min': 0,
+                 'tip': 'FWHM of the spectrometer response, 0 for an infinite resolution'},
+                {'title': 'Response file:', 'name': 'response_file', 'type': 'browsepath', 'filetype': True,
+                 'value': '',
+                 'tip': 'CSV file containing in columns the wavelength (nm) and the spectral response, empty for a'
+                        ' flat response'},
+                {'title': 'Normalize?:', 'name': 'normalize', 'type': 'bool', 'value': True,
+                 'tip': 'Divide the counts by the peak counts'},
+                {'title': 'Seed:', 'name': 'seed', 'type': 'int', 'value': 0, 'min': 0,
+                 'tip': 'Seed of the noise, for reproducible traces'},
             ]},
             {'title': 'Plot settings:', 'name': 'plot_settings', 'type': 'group', 'children': [
                 {'title': 'Units:', 'name': 'units', 'type': 'list', 'values': ['nm', 'Hz'],
@@ -130,13 +152,16 @@ class Simulator(QObject):
     def __init__(self, parent=None, show_ui=True):
         super().__init__()
 
-        if parent is None:
+        if parent is None and show_ui:
             parent = QtWidgets.QWidget()
 
         self.parent = parent
         self.figs = []
         self.pnps = None
         self.max_pnps = 1
+        self._parameter = None
+        self._spectrum = None
+        self._trace_computed = False
         self.pulse = None
 
         self.settings = Parameter.create(name='dataIN_settings', type='group', children=self.params)
@@ -162,13 +187,24 @@ class Simulator(QObject):
 
 
 
+    @property
+    def config(self):
+        """ SimulationConfig of the current settings"""
+        return SimulationConfig.from_settings(self.settings)
+
     @property
     def trace(self):
+        if not self._trace_computed:
+            grid = self.config.grid
+            calculate_trace(self.pnps, self._spectrum, self._parameter, engine='Batched',
+                            batch_memory=grid.batch_memory)
+            self.max_pnps = np.max(self.pnps.Tmn)
+            self._trace_computed = True
         return self.pnps.trace
 
     @property
     def parameter(self):
-        return self.pnps.parameter
+        return self._parameter
 
 
     def setupUI(self):
@@ -273,13 +309,8 @@ class Simulator(QObject):
         self.pulse_canvas.draw()
 
     def spectrum_exp(self, Npts=512, wl_lim=None):
-        spectrum = normalize(lib.abs2(self.pulse.spectrum))
-        wl = self.pulse.wl
-        if wl_lim is not None:
-            wl, spectrum = crop_vector_to_axis(wl, spectrum, wl_lim)
-        wl_lin, spectrum_lin = linspace_this_vect(wl[::-1], spectrum[::-1], Npts)
-
-        return Axis(data=wl_lin, label='Wavelength', units='m'), spectrum_lin
+        md = simulation_core.spectrum_exp(self.pulse, Npts, wl_lim)
+        return Axis(data=md.axes[0], label='Wavelength', units='m'), md.data
 
     def trace_exp(self, threshold=None, Npts=512, wl_lim=None):
         """ Experimental trace on linear wavelength grid of the simulated trace
@@ -291,25 +322,15 @@ class Simulator(QObject):
 
         Returns
         -------
-        meshdata: (MeshData)
+        tuple: (data, wavelength Axis, parameter Axis)
         """
-        md = self.pnps.trace.copy()
-        md.normalize()
-        md = self.get_trace_wl(md, Npts)
-        md.axes[0] = md.axes[0][::-1]
-        md.data = md.data[::-1, :]
-
-        if threshold is not None:
-            md.autolimit(threshold=threshold)
-        elif wl_lim is not None:
-            delay_c, wlc, trace_croped = crop_array_to_axis(md.axes[0], md.axes[1], md.data.T,
-                                                   (np.min(md.axes[0]), np.max(md.axes[0]), wl_lim[0], wl_lim[1]))
-            wl_lin, data_wl = linspace_this_image(wlc, trace_croped.T, axis=1,
-                                                   Npts=Npts)
-            md.data = data_wl
-            md.axes[1] = wl_lin
-            # md.data = trace_croped.T
-            # md.axes[1] = wlc
+        # the trace already computed on the process frequencies is resampled, otherwise it is computed in batches
+        engine = 'Standard' if self._trace_computed else 'Batched'
+        md = simulation_core.trace_exp(self.pnps, self._spectrum, self._parameter, threshold, Npts, wl_lim,
+                                       engine=engine, batch_memory=self.config.grid.batch_memory)
+        detector = self.config.detector
+        if detector.enabled:
+            md.data = detector.apply(md.data, md.axes[1])
         return md.data, Axis(data=md.axes[1], label=md.labels[1], units=md.units[1]),\
                Axis(data=md.axes[0], label=md.labels[0], units=md.units[0])
 
@@ -329,7 +350,7 @@ class Simulator(QObject):
     def show_trace(self):
         self.update_pnps()
         self.trace_canvas.figure.clf()
-        md = self.pnps.trace.copy()
+        md = self.trace.copy()
         md.normalize()
         Npts = self.settings.child('plot_settings', 'Npts').value()
         if self.settings.child('plot_settings', 'units').value() == 'nm':
@@ -356,86 +377,27 @@ class Simulator(QObject):
         self.trace_canvas.draw()
 
     def update_grid(self):
-        Nt = self.settings.child('grid_settings', 'npoints').value()
-        dt = self.settings.child('grid_settings', 'time_resolution').value() * 1e-15
-        wl0 = self.settings.child('grid_settings', 'wl0').value() * 1e-9
-        self.ft = FourierTransform(Nt, dt=dt, w0=wl2om(-wl0 - 300e-9))
+        self.ft = make_grid(self.config.grid)
 
     def update_pnps(self):
-
         pulse = self.update_pulse()
-        method = self.settings.child('algo', 'method').value()
-        process = self.settings.child('algo', 'nlprocess').value()
-
-        if method == 'dscan':
-            material = materials[self.settings.child('algo', 'material').value()]
-            self.pnps = PNPS(pulse, method, process, material=material)
-            parameter = linspace_step(self.settings.child('algo', 'dscan_parameter', 'min').value(),
-                                      self.settings.child('algo', 'dscan_parameter', 'max').value(),
-                                      self.settings.child('algo', 'dscan_parameter', 'step').value())
-            parameter *= 1e-3
-        elif method == 'miips':
-            alpha = self.settings.child('algo', 'alpha').value()
-            gamma = self.settings.child('algo', 'gamma').value()
-            self.pnps = PNPS(pulse, method, process, alpha=alpha, gamma=gamma)
-            parameter = linspace_step(self.settings.child('algo', 'miips_parameter', 'min').value(),
-                                      self.settings.child('algo', 'miips_parameter', 'max').value(),
-                                      self.settings.child('algo', 'miips_parameter', 'step').value())
-        else:
-            self.pnps = PNPS(pulse, method, process)
-            parameter = np.linspace(self.ft.t[-1], self.ft.t[0], len(self.ft.t))
-        self.pnps.calculate(pulse.spectrum, parameter)
-        self.max_pnps = np.max(self.pnps.Tmn)
+        config = self.config
+        self.pnps, self._parameter = make_pnps(config.algo, pulse)
+        self._spectrum = pulse.spectrum
+        self._trace_computed = False
+        if config.grid.engine != 'Batched':
+            # with the Batched engine, the trace is computed when needed
+            calculate_trace(self.pnps, pulse.spectrum, self._parameter)
+            self.max_pnps = np.max(self.pnps.Tmn)
+            self._trace_computed = True
         return self.pnps
 
     def update_pulse(self):
         self.update_grid()
-        wl0 = self.settings.child('grid_settings', 'wl0').value() * 1e-9
-        w0 = convert(wl0, 'wl', 'om')
-        pulse = Pulse(self.ft, wl0)
-
-        if self.settings.child('pulse_source').value() == 'Simulated':
-            fwhm = self.settings.child('pulse_settings', 'fwhm_time').value()
-            domega = 4 * np.log(2) / fwhm
-            pulse.spectrum = gauss1D(pulse.w, x0=0., dx=domega * 1e15)  # x0=0 because the frequency axis is already
-
-            if self.settings.child('pulse_settings', 'shaping_type').value() == 'Taylor':
-                GD = self.settings.child('pulse_settings', 'taylor_phase','GD').value()
-                GDD = self.settings.child('pulse_settings', 'taylor_phase', 'GDD').value()
-                TOD = self.settings.child('pulse_settings', 'taylor_phase', 'TOD').value()
-                phase = GD * 1e-15 * pulse.w +\
-                        GDD * 1e-30 * pulse.w ** 2 / 2 +\
-                        TOD * 1e-45 * pulse.w ** 3 / 6
-                pulse.spectrum = pulse.spectrum * np.exp(1j * phase)
-            elif self.settings.child('pulse_settings', 'shaping_type').value() == 'Gaussian':
-                amp = self.settings.child('pulse_settings', 'gaussian_phase', 'gauss_amp').value()
-                dtime = self.settings.child('pulse_settings', 'gaussian_phase', 'dtime').value() *1e-15
-                phase = amp * gauss1D(pulse.t, 0, dtime)
-                pulse.field = pulse.field * np.exp(1j * phase)
-
-            Npulses = self.settings.child('pulse_settings', 'npulses').value()
-            if Npulses > 1:
-                delta_t = self.settings.child('pulse_settings', 'delay_pulses').value()
-                spectrum = np.zeros_like(pulse.spectrum)
-                for ind in range(Npulses):
-                    spectrum += 1 / Npulses * pulse.spectrum * np.exp(1j * pulse.w * (-Npulses/2+ind) * delta_t * 1e-15)
-                pulse.spectrum = spectrum
-
-            # # recenter pulse in time domain
-            # idx = np.argmax(pulse.intensity)
-            # pulse.spectrum = pulse.spectrum * np.exp(-1j * pulse.t[idx] * (pulse.w - pulse.w0))
-
-        else:
-            data_path = self.settings.child('pulse_settings', 'data_file_path').value()
-            data = np.genfromtxt(data_path, delimiter=',', skip_header=1)
-            in_wl, in_int, in_phase = (data[:, i] for i in range(3))
-
-            in_int = np.interp(pulse.wl, in_wl * 1e-9, np.maximum(0, in_int), left=0, right=0)
-            in_phase = np.interp(pulse.wl, in_wl * 1e-9, in_phase, left=0, right=0)
-            pulse.spectrum = in_int * np.exp(1j * in_phase)
+        config = self.config
+        self.pulse = make_pulse(config.pulse, self.ft, config.grid.wl0 * 1e-9)
+        return self.pulse
 
-        self.pulse = pulse
-        return pulse
 
 
 def main():
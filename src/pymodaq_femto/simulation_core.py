@@ -0,0 +1,346 @@
+"""Qt free simulation of pulses and non-linear traces
+
+This module holds the numerical part of the Simulator: building the Fourier grid and the pulse, computing the trace of
+a characterization method, sampling the trace and the spectrum on linear wavelength grids and applying a detector
+model. Like the pipeline module, it imports neither PyQt5, pyqtgraph, matplotlib nor pymodaq, so that traces can be
+simulated in worker processes on headless nodes. The Simulator user interface builds a SimulationConfig from its
+settings tree and calls the functions below.
+
+    from pymodaq_femto.simulation_core import SimulationConfig, simulate
+
+    config = SimulationConfig()
+    config.algo.method = "dscan"
+    config.grid.npoints = 2048
+    trace, spectrum, pulse = simulate(config)
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+from pypret import Pulse, lib, MeshData
+from pypret.frequencies import om2wl, wl2om
+
+from pymodaq_femto.pipeline import methods, nlprocesses, materials, tree_values, _get, _from_values
+from pymodaq_femto.pnps import cached_pnps, calculate_batched
+from pymodaq_femto.fourier import fourier_transform
+from pymodaq_femto.resample import cached_interpolation_matrix, resample
+from pymodaq_femto.detector import DetectorModel
+
+default_data_file = str(Path(__file__).parent.parent.parent.joinpath('data/spectral_data.csv'))
+
+
+def gauss1D(x, x0, dx):
+    """ Gaussian amplitude of intensity FWHM dx centered in x0 (same as pymodaq's gauss1D)"""
+    return np.exp(-2 * np.log(2) * ((x - x0) / dx) ** 2)
+
+
+def linspace_step(start, stop, step):
+    """ Values from start to stop (included if it falls on the step) spaced by step (same as pymodaq's
+    linspace_step)"""
+    if np.abs(step) < 1e-12 or np.sign(stop - start) != np.sign(step) or start == stop:
+        raise ValueError('Invalid value for one parameter')
+    Nsteps = int(np.ceil((stop - start) / step))
+    if np.abs(start + Nsteps * step - stop) < 1e-12:
+        Nsteps += 1
+    return np.linspace(start, start + (Nsteps - 1) * step, Nsteps)
+
+
+@dataclass
+class PulseConfig:
+    pulse_source: str = "Simulated"  # or "From File"
+    fwhm_time: float = 5.  # Fourier limited duration in fs
+    shaping_type: str = "Taylor"  # or "Gaussian"
+    npulses: int = 1
+    delay_pulses: float = 100.  # in fs
+    GD: float = 0.  # in fs
+    GDD: float = 50.  # in fs2
+    TOD: float = 500.  # in fs3
+    gauss_amp: float = 6.  # in rad
+    dtime: float = 10.  # FWHM of the gaussian temporal phase in fs
+    data_file_path: str = default_data_file  # csv file with wavelength (nm), intensity and phase (rad) columns
+
+    @classmethod
+    def from_values(cls, values, pulse_source=None):
+        flat = dict(values)
+        for group in ("taylor_phase", "gaussian_phase"):
+            flat.update(_get(values, group, default={}))
+        if pulse_source is not None:
+            flat["pulse_source"] = pulse_source
+        return _from_values(cls, flat)
+
+
+@dataclass
+class ScanConfig:
+    min: float = -10.  # in mm (dscan) or rad (miips)
+    max: float = 10.
+    step: float = 0.025
+
+
+@dataclass
+class SimulationAlgoConfig:
+    method: str = methods[0]
+    nlprocess: str = nlprocesses[0]
+    alpha: float = 1.  # miips only, in rad
+    gamma: float = 10.  # miips only, in Hz
+    material: str = "FS"  # dscan only
+    dscan_parameter: ScanConfig = field(default_factory=ScanConfig)
+    miips_parameter: ScanConfig = field(default_factory=lambda: ScanConfig(0., 2 * np.pi, 2 * np.pi / 100))
+
+    @classmethod
+    def from_values(cls, values):
+        scans = ("dscan_parameter", "miips_parameter")
+        config = _from_values(cls, {key: value for key, value in values.items() if key not in scans})
+        for name in scans:
+            setattr(config, name, _from_values(ScanConfig, {**vars(getattr(config, name)),
+                                                            **_get(values, name, default={})}))
+        return config
+
+
+@dataclass
+class SimulationGridConfig:
+    wl0: float = 750.  # in nm
+    npoints: int = 1024
+    time_resolution: float = 0.5  # in fs
+    fft_backend: str = "numpy"  # one of fourier.backends
+    fft_workers: int = 0  # number of threads, 0 for the number of CPUs
+    engine: str = "Standard"  # or "Batched", see calculate_trace
+    batch_memory: int = 256  # in MB, Batched engine only
+
+
+@dataclass
+class OutputConfig:
+    autolimits: bool = False  # crop the trace where its marginals are above autolim_thresh
+    setlimits: bool = False  # crop the trace and the spectrum between limit_min and limit_max
+    autolim_thresh: float = 1e-2
+    limit_min: float = 500.  # in nm
+    limit_max: float = 1100.  # in nm
+    Npts: int = 512  # number of points of the wavelength axis
+
+
+@dataclass
+class SimulationConfig:
+    pulse: PulseConfig = field(default_factory=PulseConfig)
+    algo: SimulationAlgoConfig = field(default_factory=SimulationAlgoConfig)
+    grid: SimulationGridConfig = field(default_factory=SimulationGridConfig)
+    output: OutputConfig = field(default_factory=OutputConfig)
+    detector: DetectorModel = field(default_factory=DetectorModel)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """ Build the configuration from the Simulator settings tree
+
+        Parameters
+        ----------
+        settings: (Parameter or dict) the Simulator settings or the nested dict of their values
+        """
+        values = tree_values(settings)
+        return cls(
+            pulse=PulseConfig.from_values(_get(values, "pulse_settings", default={}),
+                                          _get(values, "pulse_source")),
+            algo=SimulationAlgoConfig.from_values(_get(values, "algo", default={})),
+            grid=_from_values(SimulationGridConfig, _get(values, "grid_settings", default={})),
+            output=_from_values(OutputConfig, _get(values, "plot_settings", default={})),
+            detector=_from_values(DetectorModel, _get(values, "detector", default={})),
+        )
+
+    @property
+    def wl_lim(self):
+        """ The wavelength limits in m of the outputs, None if not set"""
+        if self.output.setlimits:
+            return np.array([self.output.limit_min, self.output.limit_max]) * 1e-9
+        return None
+
+    @property
+    def threshold(self):
+        return self.output.autolim_thresh if self.output.autolimits else None
+
+
+def make_grid(grid):
+    """ Fourier transform of the simulation grid
+
+    Parameters
+    ----------
+    grid: (SimulationGridConfig)
+    """
+    wl0 = grid.wl0 * 1e-9
+    return fourier_transform(grid.npoints, grid.time_resolution * 1e-15, w0=wl2om(-wl0 - 300e-9),
+                             backend=grid.fft_backend, workers=grid.fft_workers)
+
+
+def make_pulse(config, ft, wl0):
+    """ Simulated pulse, or pulse read from a file
+
+    Parameters
+    ----------
+    config: (PulseConfig)
+    ft: (FourierTransform)
+    wl0: (float) central wavelength in m
+    """
+    pulse = Pulse(ft, wl0)
+    if config.pulse_source == 'Simulated':
+        domega = 4 * np.log(2) / config.fwhm_time
+        pulse.spectrum = gauss1D(pulse.w, x0=0., dx=domega * 1e15)  # x0=0 because the frequency axis is already
+        # centered on w0
+
+        if config.shaping_type == 'Taylor':
+            phase = config.GD * 1e-15 * pulse.w + \
+                config.GDD * 1e-30 * pulse.w ** 2 / 2 + \
+                config.TOD * 1e-45 * pulse.w ** 3 / 6
+            pulse.spectrum = pulse.spectrum * np.exp(1j * phase)
+        elif config.shaping_type == 'Gaussian':
+            phase = config.gauss_amp * gauss1D(pulse.t, 0, config.dtime * 1e-15)
+            pulse.field = pulse.field * np.exp(1j * phase)
+
+        if config.npulses > 1:
+            spectrum = np.zeros_like(pulse.spectrum)
+            for ind in range(config.npulses):
+                spectrum += 1 / config.npulses * pulse.spectrum * \
+                    np.exp(1j * pulse.w * (-config.npulses / 2 + ind) * config.delay_pulses * 1e-15)
+            pulse.spectrum = spectrum
+    else:
+        data = np.genfromtxt(config.data_file_path, delimiter=',', skip_header=1)
+        in_wl, in_int, in_phase = (data[:, i] for i in range(3))
+
+        in_int = np.interp(pulse.wl, in_wl * 1e-9, np.maximum(0, in_int), left=0, right=0)
+        in_phase = np.interp(pulse.wl, in_wl * 1e-9, in_phase, left=0, right=0)
+        pulse.spectrum = in_int * np.exp(1j * in_phase)
+    return pulse
+
+
+def make_pnps(config, pulse):
+    """ PNPS instance of the method and its scanned parameter, the trace is not computed
+
+    Parameters
+    ----------
+    config: (SimulationAlgoConfig)
+    pulse: (Pulse)
+
+    Returns
+    -------
+    tuple: (PNPS, 1D array of the parameter in m (dscan), rad (miips) or s (delay))
+    """
+    if config.method == 'dscan':
+        pnps = cached_pnps(pulse, config.method, config.nlprocess, material=materials[config.material])
+        scan = config.dscan_parameter
+        parameter = linspace_step(scan.min, scan.max, scan.step) * 1e-3
+    elif config.method == 'miips':
+        pnps = cached_pnps(pulse, config.method, config.nlprocess, alpha=config.alpha, gamma=config.gamma)
+        scan = config.miips_parameter
+        parameter = linspace_step(scan.min, scan.max, scan.step)
+    else:
+        pnps = cached_pnps(pulse, config.method, config.nlprocess)
+        parameter = np.linspace(pulse.ft.t[-1], pulse.ft.t[0], len(pulse.ft.t))
+    return pnps, parameter
+
+
+def calculate_trace(pnps, spectrum, parameter, engine="Standard", batch_memory=256):
+    """ Compute the trace of pnps on its process frequencies
+
+    With the Standard engine, pnps.calculate is called on the whole scan. With the Batched engine, the trace is
+    computed in batches of parameter values using about batch_memory MB (see pnps.calculate_batched) and stored in
+    pnps.Tmn and pnps.parameter.
+
+    Returns
+    -------
+    MeshData: pnps.trace
+    """
+    if engine == "Batched":
+        pnps.Tmn = calculate_batched(pnps, spectrum, parameter, max_bytes=batch_memory * 2 ** 20)
+        pnps.parameter = parameter
+    else:
+        pnps.calculate(spectrum, parameter)
+    return pnps.trace
+
+
+def trace_exp(pnps, spectrum, parameter, threshold=None, Npts=512, wl_lim=None, engine="Standard",
+              batch_memory=256):
+    """ Experimental trace: the trace sampled on a linear wavelength grid and normalized
+
+    With the Standard engine, the trace already computed by calculate_trace is resampled. With the Batched engine,
+    it is computed in batches that are directly resampled, the trace on the process frequencies is never stored.
+    The resampling is a sparse interpolation matrix including the Jacobian of the frequency to wavelength conversion.
+
+    Parameters
+    ----------
+    pnps: (PNPS)
+    spectrum: (1D array) complex spectrum of the pulse
+    parameter: (1D array) the scanned parameter
+    threshold: (None or float) crop the trace where its marginals are above threshold
+    Npts: (int) number of points of the wavelength axis
+    wl_lim: (None or list of 2 floats) wavelength limits in m, used if threshold is None: the normalized trace is
+            cropped to them and interpolated again on Npts points
+    engine: (str) "Standard" or "Batched"
+    batch_memory: (int) in MB, Batched engine only
+
+    Returns
+    -------
+    MeshData: of axes the parameter (reversed) and the wavelength in m
+    """
+    wl = om2wl(pnps.process_w)
+    wl_lin = np.linspace(np.min(wl), np.max(wl), Npts)
+    operator = cached_interpolation_matrix(wl, wl_lin, scale=1 / wl ** 2)
+    if engine == "Batched":
+        data = calculate_batched(pnps, spectrum, parameter, max_bytes=batch_memory * 2 ** 20, operator=operator)
+    else:
+        data = resample(np.atleast_2d(pnps.Tmn), operator)
+    data /= np.max(data)
+    md = MeshData(data[::-1, :], parameter[::-1], wl_lin,
+                  labels=[pnps.parameter_name, 'Wavelength'], units=[pnps.parameter_unit, 'm'])
+    if threshold is not None:
+        md.autolimit(threshold=threshold)
+    elif wl_lim is not None:
+        # as the Simulator always did: the points of the full grid within wl_lim are interpolated again on Npts points
+        wl_crop = wl_lin[(wl_lin >= wl_lim[0]) & (wl_lin <= wl_lim[1])]
+        wl_new = np.linspace(np.min(wl_crop), np.max(wl_crop), Npts)
+        md = MeshData(resample(md.data, cached_interpolation_matrix(wl_lin, wl_new)), md.axes[0], wl_new,
+                      labels=md.labels, units=md.units)
+    return md
+
+
+def spectrum_exp(pulse, Npts=512, wl_lim=None):
+    """ Experimental spectrum: the spectral intensity of pulse sampled on a linear wavelength grid and normalized
+
+    Parameters
+    ----------
+    pulse: (Pulse)
+    Npts: (int) number of points of the wavelength axis
+    wl_lim: (None or list of 2 floats) wavelength limits in m
+
+    Returns
+    -------
+    MeshData: of axis the wavelength in m
+    """
+    spectrum = lib.abs2(pulse.spectrum)
+    spectrum = spectrum / np.max(spectrum)
+    wl = pulse.wl[::-1]
+    spectrum = spectrum[::-1]
+    if wl_lim is not None:
+        inside = (wl >= np.min(wl_lim)) & (wl <= np.max(wl_lim))
+        wl, spectrum = wl[inside], spectrum[inside]
+    wl_lin = np.linspace(np.min(wl), np.max(wl), Npts)
+    return MeshData(np.interp(wl_lin, wl, spectrum), wl_lin, labels=['Wavelength'], units=['m'])
+
+
+def simulate(config):
+    """ Simulate the experimental trace and spectrum of a configuration
+
+    Parameters
+    ----------
+    config: (SimulationConfig)
+
+    Returns
+    -------
+    tuple: (trace, spectrum, pulse) with trace and spectrum the MeshData returned by trace_exp and spectrum_exp and
+           pulse the simulated Pulse. The detector model is applied to the trace if enabled
+    """
+    ft = make_grid(config.grid)
+    pulse = make_pulse(config.pulse, ft, config.grid.wl0 * 1e-9)
+    pnps, parameter = make_pnps(config.algo, pulse)
+    if config.grid.engine != "Batched":
+        calculate_trace(pnps, pulse.spectrum, parameter)
+    trace = trace_exp(pnps, pulse.spectrum, parameter, threshold=config.threshold, Npts=config.output.Npts,
+                      wl_lim=config.wl_lim, engine=config.grid.engine, batch_memory=config.grid.batch_memory)
+    if config.detector.enabled:
+        trace.data = config.detector.apply(trace.data, trace.axes[1])
+    spectrum = spectrum_exp(pulse, Npts=config.output.Npts, wl_lim=config.wl_lim)
+    return trace, spectrum, pulse
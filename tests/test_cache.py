@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from pymodaq_femto.cache import ResultCache
+from pymodaq_femto.pipeline import RetrievalPipeline
+
+
+def processed_pipeline():
+    """ Pipeline holding a processed trace and spectrum, without running the processing"""
+    rng = np.random.default_rng(0)
+    pipeline = RetrievalPipeline()
+    pipeline.ft = SimpleNamespace(w=np.linspace(2e15, 3e15, 64))
+    pipeline.pulse_in = SimpleNamespace(spectrum=rng.random(64) + 0j)
+    pipeline.spectrum_in = pipeline.pulse_in.spectrum.copy()  # as set by process_spectrum
+    pipeline.trace_in = SimpleNamespace(data=rng.random((20, 32)), axes=[np.linspace(-1e-3, 1e-3, 20),
+                                                                         np.linspace(4e15, 6e15, 32)])
+    return pipeline
+
+
+def result(size=64):
+    return SimpleNamespace(pulse_retrieved=np.arange(size) + 1j, trace_retrieved=np.ones((20, 32)),
+                           trace_error=np.float32(0.01), iterations=12, stop_reason="plateau")
+
+
+def test_cache_is_opt_in():
+    pipeline = processed_pipeline()
+    assert pipeline.result_cache() is None
+    pipeline.config.retrieving.use_cache = True
+    assert pipeline.result_cache() is not None
+
+
+def test_key_changes_with_settings_and_data():
+    pipeline = processed_pipeline()
+    key = pipeline.result_key()
+    assert pipeline.result_key() == key
+
+    pipeline.config.processing.spectrum_masks = [(700e-9, 710e-9)]
+    masked = pipeline.result_key()
+    assert masked != key
+    pipeline.config.processing.spectrum_masks = []
+    assert pipeline.result_key() == key
+
+    pipeline.config.retrieving.max_iter += 1
+    assert pipeline.result_key() != key
+    pipeline.config.retrieving.max_iter -= 1
+
+    pipeline.trace_weights = np.ones(pipeline.trace_in.data.shape)
+    assert pipeline.result_key() != key
+    pipeline.trace_weights = None
+
+    pipeline.trace_in.data[0, 0] += 1e-3
+    assert pipeline.result_key() != key
+
+
+def test_key_ignores_spectra_written_in_pulse_in():
+    # the Retriever displays may write retrieved spectra in the pulse of the pipeline
+    pipeline = processed_pipeline()
+    key = pipeline.result_key()
+    pipeline.pulse_in.spectrum = pipeline.pulse_in.spectrum * 1j
+    assert pipeline.result_key() == key
+
+
+def test_hit_and_miss(tmp_path):
+    pipeline = processed_pipeline()
+    cache = ResultCache(tmp_path)
+    key = pipeline.result_key()
+    assert cache.get(key) is None
+    cache.put(key, result(), response_function=np.full(32, 2.))
+    entry = cache.get(key)
+    np.testing.assert_array_equal(entry.pulse_retrieved, result().pulse_retrieved)
+    np.testing.assert_array_equal(entry.response_function, 2.)
+    assert (entry.trace_error, entry.iterations, entry.stop_reason) == (np.float32(0.01), 12, "plateau")
+
+    pipeline.config.grid.npoints *= 2
+    assert cache.get(pipeline.result_key()) is None
+
+
+def test_eviction_and_corrupted_entries(tmp_path):
+    cache = ResultCache(tmp_path)
+    for key in "abc":
+        cache.put(key, result())
+    assert len(cache) == 3
+    cache.max_bytes = 2 * cache.path("a").stat().st_size
+    assert cache.evict() == 1
+    assert len(cache) == 2
+
+    cache.path("bad").write_bytes(b"not a npz file")
+    assert cache.get("bad") is None
+    assert "bad" not in cache
+    assert cache.clear() == 2
+    assert len(cache) == 0
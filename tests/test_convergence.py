@@ -0,0 +1,34 @@
+from pymodaq_femto.pipeline import ConvergenceConfig
+
+
+def test_disabled_by_default():
+    config = ConvergenceConfig()
+    assert config.stop_reason([1., 1., 1., 1.], 1e6) is None
+
+
+def test_error_target():
+    config = ConvergenceConfig(error_target=1e-2)
+    assert config.stop_reason([1., 0.1], 0.) is None
+    assert config.stop_reason([1., 0.1, 1e-2], 0.) == "error target"
+
+
+def test_time_budget():
+    config = ConvergenceConfig(time_budget=2.)
+    assert config.stop_reason([1.], 1.9) is None
+    assert config.stop_reason([1.], 2.) == "time budget"
+
+
+def test_plateau():
+    config = ConvergenceConfig(plateau_window=3, plateau_tolerance=1e-2)
+    # not enough iterations to compare over the window
+    assert config.stop_reason([1., 1., 1.], 0.) is None
+    # the error still decreases by more than the tolerance over the window
+    assert config.stop_reason([1., 0.9, 0.8, 0.7], 0.) is None
+    assert config.stop_reason([1., 0.999, 0.998, 0.995], 0.) == "plateau"
+    # only the last window + 1 errors matter
+    assert config.stop_reason([10., 1., 0.999, 0.998, 0.995], 0.) == "plateau"
+
+
+def test_error_target_before_plateau():
+    config = ConvergenceConfig(plateau_window=2, error_target=0.5)
+    assert config.stop_reason([0.5, 0.5, 0.5], 0.) == "error target"
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("PyQt5")
+from pymodaq_femto.retriever import ThrottledCallback, downsample_image
+
+
+def test_throttled_callback_coalesces_and_flushes():
+    calls = []
+    callback = ThrottledCallback(lambda *args, **kwargs: calls.append((args, kwargs)), max_rate=1e-3)
+    callback(1)  # the first call is forwarded
+    callback(2)
+    callback(3, key="latest")
+    assert calls == [((1,), {})]
+    callback.flush()
+    assert calls == [((1,), {}), ((3,), {"key": "latest"})]
+    callback.flush()  # nothing pending
+    assert len(calls) == 2
+
+
+def test_throttled_callback_forwards_slow_calls():
+    calls = []
+    callback = ThrottledCallback(calls.append, max_rate=1e9)
+    for value in range(5):
+        callback(value)
+    assert calls == list(range(5))
+
+
+def test_downsample_image_shapes_and_axes():
+    image = np.arange(100 * 60, dtype=float).reshape(100, 60)
+    y_axis = np.linspace(0., 1., 100)
+    x_axis = np.linspace(500., 600., 60)
+    averaged, y, x = downsample_image(image, (30, 25), y_axis, x_axis)
+    # factors of 4 along the rows and 3 along the columns
+    assert averaged.shape == (25, 20)
+    np.testing.assert_allclose(averaged[0, 0], image[:4, :3].mean())
+    np.testing.assert_allclose(y, y_axis.reshape(25, 4).mean(axis=1))
+    np.testing.assert_allclose(x, x_axis.reshape(20, 3).mean(axis=1))
+
+
+def test_downsample_image_truncates_and_resamples_axes():
+    image = np.ones((10, 7))
+    averaged, y, x = downsample_image(image, (3, 7), np.arange(10.), np.array([0., 6.]))
+    # 10 rows by blocks of 4: the last incomplete block is dropped
+    assert averaged.shape == (2, 7)
+    np.testing.assert_allclose(y, [1.5, 5.5])
+    np.testing.assert_allclose(x, np.linspace(0., 6., 7))
+
+
+def test_downsample_image_small_image_unchanged():
+    image = np.ones((10, 20))
+    y_axis, x_axis = np.arange(10.), np.arange(20.)
+    averaged, y, x = downsample_image(image, (100, 100), y_axis, x_axis)
+    assert averaged is image and y is y_axis and x is x_axis
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import scipy.constants as sc
+
+from pymodaq_femto.materials import FS, BK7, SellmeierMaterial
+
+wavelengths = np.linspace(500e-9, 1500e-9, 11)
+
+
+def central_difference(func, x, h):
+    return (func(x + h) - func(x - h)) / (2 * h)
+
+
+@pytest.mark.parametrize("material", [FS, BK7])
+def test_squared_index_jet(material):
+    x = wavelengths * material._scaling
+    h = 1e-4
+    jet = material._n2(x, order=3)
+    for order in range(3):
+        derivative = central_difference(lambda xx: material._n2(xx, order=order)[order], x, h)
+        np.testing.assert_allclose(jet[order + 1], derivative, rtol=1e-6)
+
+
+@pytest.mark.parametrize("material", [FS, BK7])
+def test_dispersion_matches_finite_differences(material):
+    w = 2 * np.pi * sc.c / wavelengths
+    h = w * 1e-5
+    k = material.dispersion(w, unit="om", order=3)
+    np.testing.assert_allclose(k[0], material.k(w, unit="om"), rtol=1e-12)
+    for order in range(3):
+        derivative = central_difference(lambda ww: material.dispersion(ww, unit="om", order=order)[order], w, h)
+        np.testing.assert_allclose(k[order + 1], derivative, rtol=1e-5)
+
+
+def test_dispersion_order_limit():
+    with pytest.raises(ValueError):
+        FS.dispersion(800e-9, order=4)
+
+
+def test_terms_are_abstract():
+    class Incomplete(SellmeierMaterial):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete(coefficients=[1.], freq_range=[1e-7, 1e-6])
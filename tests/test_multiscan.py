@@ -0,0 +1,59 @@
+import numpy as np
+import tables
+
+from pymodaq_femto.multiscan import ScanStack, load_combined
+
+node_path = "/Raw_datas/Scan000/Detector000/Data"
+
+
+def write_scans(fname, scans):
+    """ h5 file with one Scan group per trace, with the layout of the DAQ_Scan files"""
+    with tables.open_file(str(fname), "w") as h5file:
+        raw = h5file.create_group("/", "Raw_datas")
+        for index, data in enumerate(scans):
+            scan = h5file.create_group(raw, f"Scan{index:03d}")
+            navigation = h5file.create_group(scan, "Navigation_axes")
+            h5file.create_array(navigation, "Nav_x_axis", np.linspace(0, 1, data.shape[0]))
+            detector = h5file.create_group(scan, "Detector000")
+            h5file.create_array(detector, "Data", data[None])
+            h5file.create_array(detector, "X_axis", np.linspace(700, 800, data.shape[1]))
+
+
+def random_scans(count=7, shape=(40, 30)):
+    rng = np.random.default_rng(0)
+    truth = rng.random(shape)
+    return np.stack([truth + 0.1 * rng.standard_normal(shape) for _ in range(count)])
+
+
+def test_mean_variance_matches_numpy(tmp_path):
+    scans = random_scans()
+    fname = tmp_path.joinpath("scans.h5")
+    write_scans(fname, scans)
+    with ScanStack(fname, node_path) as stack:
+        assert len(stack) == len(scans)
+        mean, variance = stack.mean_variance()
+    np.testing.assert_allclose(mean, np.mean(scans, axis=0), rtol=0, atol=1e-12)
+    np.testing.assert_allclose(variance, np.var(scans, axis=0, ddof=1), rtol=0, atol=1e-12)
+
+
+def test_load_combined_variance_of_the_mean(tmp_path):
+    scans = random_scans()
+    fname = tmp_path.joinpath("scans.h5")
+    write_scans(fname, scans)
+    data, axes, variance = load_combined(fname, node_path, mode="mean")
+    np.testing.assert_allclose(data, np.mean(scans, axis=0), rtol=0, atol=1e-12)
+    np.testing.assert_allclose(variance, np.var(scans, axis=0, ddof=1) / len(scans), rtol=0, atol=1e-12)
+    data, axes, variance = load_combined(fname, node_path, mode="median")
+    np.testing.assert_allclose(data, np.median(scans, axis=0))
+    assert variance is None
+
+
+def test_single_scan_has_no_variance(tmp_path):
+    scans = random_scans(count=1)
+    fname = tmp_path.joinpath("scans.h5")
+    write_scans(fname, scans)
+    with ScanStack(fname, node_path) as stack:
+        mean, variance = stack.mean_variance()
+    np.testing.assert_allclose(mean, scans[0])
+    np.testing.assert_array_equal(variance, 0.)
+    assert load_combined(fname, node_path)[2] is None
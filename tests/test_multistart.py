@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pymodaq_femto import multistart
+from pymodaq_femto.multistart import MultiStartRetrieval
+from pymodaq_femto.pipeline import RetrievalPipeline, PipelineError
+
+N = 64
+trace_errors = [0.3, 0.1, None, 0.2]  # None: the run fails
+
+
+def fake_run_start(config, raw_trace, raw_spectrum, index, seed, fwhm, progress_queue=None, stop_event=None):
+    """ Replaces run_start in the pool workers: the spectrum of run index is index + 1"""
+    if trace_errors[index] is None:
+        raise RuntimeError("failed run")
+    if progress_queue is not None:
+        progress_queue.put((index, SimpleNamespace(error=trace_errors[index])))
+    return SimpleNamespace(pulse_retrieved=np.full(N, index + 1, dtype=complex), response_function=np.full(N, 2.),
+                           trace_error=trace_errors[index], iterations=5, stop_reason="max iterations")
+
+
+def processed_pipeline():
+    """ Pipeline holding a processed trace and a fake PNPS whose trace is the first value of the spectrum"""
+    pipeline = RetrievalPipeline()
+    w = np.linspace(2e15, 3e15, N)
+    pipeline.pnps = SimpleNamespace(ft=SimpleNamespace(w=w), process_w=2 * w,
+                                    calculate=lambda spectrum, parameter: np.full((len(parameter), N),
+                                                                                  spectrum[0].real))
+    pipeline.trace_in = SimpleNamespace(data=np.ones((10, N)), axes=[np.arange(10.), 2 * w], units=["m", "Hz"])
+    pipeline.raw_trace = dict()
+    pipeline.raw_spectrum = dict()
+    pipeline.config.multistart.n_starts = len(trace_errors)
+    pipeline.config.multistart.workers = 2
+    return pipeline
+
+
+def test_best_run_is_selected(monkeypatch):
+    monkeypatch.setattr(multistart, "run_start", fake_run_start)
+    pipeline = processed_pipeline()
+    progress = []
+    best = MultiStartRetrieval(pipeline).run(on_progress=lambda index, p: progress.append(index))
+
+    assert best.multistart.best_index == 1
+    assert best.trace_error == 0.1
+    np.testing.assert_array_equal(best.pulse_retrieved, 2.)
+    # rebuilt in the calling process from the spectrum and the response function of the run
+    assert best.pnps is pipeline.pnps
+    np.testing.assert_array_equal(best.trace_retrieved, 2. * 2.)
+    assert pipeline.result is best
+    assert np.isnan(best.multistart.trace_errors[2])
+    assert best.multistart.error_curves[2] == []
+    assert sorted(progress) == [0, 1, 3]
+    # the runs only differ by a constant phase
+    assert best.multistart.phase.rms_std < 1e-12
+
+
+def test_guesses_are_reproducible():
+    pipeline = processed_pipeline()
+    seeds, fwhms = MultiStartRetrieval(pipeline).guesses()
+    assert (seeds, fwhms) == MultiStartRetrieval(pipeline).guesses()
+    assert len(set(seeds)) == len(trace_errors)
+    assert fwhms[0] == pipeline.config.multistart.fwhm_min and fwhms[-1] == pipeline.config.multistart.fwhm_max
+
+
+def failing_run_start(*args, **kwargs):
+    raise RuntimeError("failed run")
+
+
+def test_all_runs_failed(monkeypatch):
+    monkeypatch.setattr(multistart, "run_start", failing_run_start)
+    with pytest.raises(PipelineError):
+        MultiStartRetrieval(processed_pipeline()).run()
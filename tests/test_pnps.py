@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from pymodaq_femto.pnps import DSCAN
+
+
+def make_dscan(N=64):
+    """ DSCAN with a synthetic dispersion, without the pypret pulse and process"""
+    dscan = DSCAN.__new__(DSCAN)
+    dscan.ft = SimpleNamespace(N=N)
+    dscan._mask_valid = np.ones(N, dtype=bool)
+    dscan._mask_valid[:4] = False
+    dscan._k = np.linspace(1e6, 2e6, N)[dscan._mask_valid]
+    dscan._mask_table = None
+    dscan._mask_insertions = None
+    return dscan
+
+
+def test_mask_table_matches_on_the_fly():
+    dscan = make_dscan()
+    insertions = np.linspace(-2e-3, 2e-3, 41)
+    expected = [dscan.mask(insertion) for insertion in insertions]
+    assert dscan.prepare_masks(insertions)
+    for insertion, H in zip(insertions, expected):
+        np.testing.assert_allclose(dscan.mask(insertion), H)
+    np.testing.assert_array_equal(dscan.mask(0.), np.ones(dscan.ft.N))
+
+
+def test_mask_table_built_once():
+    dscan = make_dscan()
+    insertions = np.linspace(-2e-3, 2e-3, 41)
+    assert dscan.prepare_masks(insertions)
+    table = dscan._mask_table
+    assert dscan.prepare_masks(insertions[::-1][5:17])  # a chunk, in another order
+    assert dscan._mask_table is table
+    # an insertion outside of the table is evaluated on the fly
+    H = np.zeros(dscan.ft.N, dtype=complex)
+    H[dscan._mask_valid] = np.exp(1j * dscan._k * 3e-3)
+    np.testing.assert_allclose(dscan.mask(3e-3), H)
+    assert dscan._mask_table is table
+
+
+def test_mask_table_too_large():
+    dscan = make_dscan()
+    assert not dscan.prepare_masks(np.linspace(-1e-3, 1e-3, 11), max_bytes=16)
+    assert dscan._mask_table is None
+    H = np.zeros(dscan.ft.N, dtype=complex)
+    H[dscan._mask_valid] = np.exp(1j * dscan._k * 1e-3)
+    np.testing.assert_allclose(dscan.mask(1e-3), H)
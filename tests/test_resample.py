@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from pymodaq_femto.resample import interpolation_matrix, cached_interpolation_matrix, resample
+
+
+def random_grid(rng, size, low=0., high=10.):
+    return np.sort(rng.uniform(low, high, size))
+
+
+def test_interpolation_matrix_matches_interp():
+    rng = np.random.default_rng(0)
+    x = random_grid(rng, 50)
+    x_new = np.linspace(-1., 11., 200)  # partly outside of the range of x
+    data = rng.random((7, x.size))
+    expected = np.array([np.interp(x_new, x, row, left=0., right=0.) for row in data])
+    np.testing.assert_allclose(resample(data, interpolation_matrix(x, x_new)), expected, atol=1e-12)
+
+
+def test_unsorted_grid_and_scale():
+    rng = np.random.default_rng(1)
+    x = random_grid(rng, 40)[::-1]  # decreasing, as a frequency axis converted from wavelengths
+    x_new = random_grid(rng, 100, 1., 9.)
+    scale = rng.random(x.size)
+    data = rng.random((3, x.size))
+    order = np.argsort(x)
+    expected = np.array([np.interp(x_new, x[order], (row * scale)[order]) for row in data])
+    np.testing.assert_allclose(resample(data, interpolation_matrix(x, x_new, scale)), expected, atol=1e-12)
+
+
+def test_duplicate_values_are_rejected():
+    with pytest.raises(ValueError):
+        interpolation_matrix(np.array([0., 1., 1., 2.]), np.linspace(0, 2, 5))
+    with pytest.raises(ValueError):
+        interpolation_matrix(np.array([1.]), np.linspace(0, 2, 5))
+
+
+def test_cache_keyed_on_content():
+    x = np.linspace(0., 1., 20)
+    x_new = np.linspace(0., 1., 30)
+    matrix = cached_interpolation_matrix(x, x_new)
+    assert cached_interpolation_matrix(x.copy(), x_new.copy()) is matrix
+    shifted = cached_interpolation_matrix(x + 0.1, x_new)
+    assert shifted is not matrix
+    assert (shifted != matrix).nnz > 0
@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from pymodaq_femto.simulation_core import trace_exp
+
+
+def fake_pnps():
+    """ Trace on process frequencies spanning about 470 to 940 nm, whose maximum is at the largest wavelength"""
+    rng = np.random.default_rng(0)
+    Tmn = rng.random((5, 64))
+    Tmn[:, 0] = 10.
+    return SimpleNamespace(process_w=np.linspace(2e15, 4e15, 64), Tmn=Tmn, parameter_name="insertion",
+                           parameter_unit="m")
+
+
+def test_trace_is_normalized_before_cropping():
+    pnps = fake_pnps()
+    parameter = np.linspace(-1., 1., 5)
+    full = trace_exp(pnps, None, parameter, Npts=200)
+    cropped = trace_exp(pnps, None, parameter, Npts=200, wl_lim=[6e-7, 8e-7])
+    assert np.max(full.data) == 1.
+    assert cropped.data.shape == (5, 200)
+    assert 6e-7 <= np.min(cropped.axes[1]) and np.max(cropped.axes[1]) <= 8e-7
+    expected = np.array([np.interp(cropped.axes[1], full.axes[1], row) for row in full.data])
+    np.testing.assert_allclose(cropped.data, expected, atol=1e-12)
+    assert np.max(cropped.data) < 1.
+
+
+def test_threshold_takes_precedence_over_wl_lim():
+    pnps = fake_pnps()
+    parameter = np.linspace(-1., 1., 5)
+    expected = trace_exp(pnps, None, parameter, threshold=0.1, Npts=200)
+    md = trace_exp(pnps, None, parameter, threshold=0.1, Npts=200, wl_lim=[6e-7, 8e-7])
+    np.testing.assert_allclose(md.data, expected.data)
+    np.testing.assert_allclose(md.axes[1], expected.axes[1])